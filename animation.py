@@ -0,0 +1,203 @@
+import io
+import os
+import struct
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+
+import image_output
+from ray_tracer import render_image
+
+
+_worker = {}
+
+
+def _init_worker(scene, update, depth, backend, tile_processes=None, termination=None, sampler=None, copy=True):
+    _worker['scene'] = scene
+    _worker['update'] = update
+    _worker['depth'] = depth
+    _worker['backend'] = backend
+    _worker['tile_processes'] = tile_processes
+    _worker['termination'] = termination
+    _worker['sampler'] = sampler
+    _worker['copy'] = copy
+
+
+def render_frame(frame_index):
+    scene = deepcopy(_worker['scene']) if _worker['copy'] else _worker['scene']
+    if _worker['update'] is not None:
+        scene = _worker['update'](scene, frame_index) or scene
+    camera = scene.camera
+    # only the bytes go back to the parent, workers never load PIL
+    frame = render_image(camera, scene.objects, scene.lights, _worker['depth'], 0, backend=_worker['backend'],
+                         processes=_worker['tile_processes'], termination=_worker['termination'],
+                         sampler=_worker['sampler'], output=image_output.BUFFER)
+    return frame_index, (camera.res_x, camera.res_y), bytes(frame)
+
+
+def animate(scene, frame_count, update=None, depth=2, processes=None, window=None, backend='scalar',
+            tile_processes=None, termination=None, sampler=None, copy=True):
+    # update(scene, frame_index) gets a fresh copy of scene for every frame, so it has to
+    # set the absolute state of that frame and be picklable (a module level function);
+    # with copy=False every process keeps one scene that update changes in place, moving
+    # instances and passing them to scene.update, so a frame costs only what moved
+    init = (scene, update, depth, backend, None, termination, sampler, copy)
+    if processes == 1:
+        # frames one after another, each of them may still be split into tiles across processes
+        _init_worker(scene, update, depth, backend, tile_processes, termination, sampler, copy)
+        for frame_index in range(frame_count):
+            yield to_image(render_frame(frame_index))
+        return
+
+    processes = processes or os.cpu_count()
+    window = window or processes * 2
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=init) as pool:
+        pending = deque()
+        next_index = 0
+        while pending or next_index < frame_count:
+            while next_index < frame_count and len(pending) < window:
+                pending.append(pool.submit(render_frame, next_index))
+                next_index += 1
+            yield to_image(pending.popleft().result())
+
+
+def to_image(result):
+    frame_index, size, data = result
+    return frame_index, image_output.to_pil(data, *size)
+
+
+def render_animation(scene, frame_count, writer, update=None, depth=2, processes=None, window=None,
+                     backend='scalar', verbose=0, termination=None, sampler=None, copy=True):
+    with writer:
+        for frame_index, frame in animate(scene, frame_count, update, depth, processes, window, backend,
+                                          termination=termination, sampler=sampler, copy=copy):
+            writer.write(frame)
+            if verbose:
+                print('Frame_{} finished'.format(frame_index))
+
+
+class PNGSequenceWriter:
+    def __init__(self, pattern='frame{}.png', size=None, loop=False):
+        self.pattern = pattern
+        self.size = size
+        self.loop = loop
+        self.count = 0
+        self.total = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, frame):
+        if self.size and frame.size != tuple(self.size):
+            from PIL import Image
+            frame = frame.resize(self.size, Image.NEAREST)
+        frame.save(self.pattern.format(self.count))
+        self.count += 1
+
+    def close(self):
+        # frames mirrored for a ping-pong loop are copied file by file, nothing is kept in memory
+        if self.loop and self.total is None:
+            self.total = self.count * 2
+            for index in range(self.count):
+                with open(self.pattern.format(index), 'rb') as src, \
+                        open(self.pattern.format(self.total - index - 1), 'wb') as dst:
+                    dst.write(src.read())
+
+
+class GIFWriter:
+    def __init__(self, path, duration=100, size=None, loop=False, repeat=0):
+        self.path = path
+        self.delay = max(1, int(round(duration / 10)))
+        self.size = size
+        self.loop = loop
+        self.repeat = repeat
+        self.file = None
+        self.spool = None
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, frame):
+        if self.size and frame.size != tuple(self.size):
+            from PIL import Image
+            frame = frame.resize(self.size, Image.NEAREST)
+        if self.file is None:
+            self.start(frame.size)
+
+        block = encode_gif_frame(frame, self.delay)
+        self.file.write(block)
+        if self.loop:
+            self.spool.seek(0, os.SEEK_END)
+            self.blocks.append((self.spool.tell(), len(block)))
+            self.spool.write(block)
+
+    def start(self, size):
+        self.file = open(self.path, 'wb')
+        self.file.write(b'GIF89a' + struct.pack('<HHBBB', size[0], size[1], 0, 0, 0))
+        self.file.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.repeat) + b'\x00')
+        if self.loop:
+            self.spool = tempfile.TemporaryFile()
+
+    def close(self):
+        if self.file is None:
+            return
+        for offset, length in reversed(self.blocks):
+            self.spool.seek(offset)
+            self.file.write(self.spool.read(length))
+        self.file.write(b'\x3b')
+        self.file.close()
+        self.file = None
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+        self.blocks = []
+
+
+def encode_gif_frame(frame, delay):
+    # lets PIL quantize and LZW-encode a single frame, then re-packs its global palette as a
+    # local one, so every frame can be appended to the stream on its own
+    stream = io.BytesIO()
+    frame.convert('RGB').quantize(256).save(stream, 'GIF')
+    data = stream.getvalue()
+
+    flags = data[10]
+    position = 13
+    palette = b''
+    palette_bits = 0
+    if flags & 0x80:
+        palette_bits = flags & 0x07
+        size = 3 << (palette_bits + 1)
+        palette = data[position:position + size]
+        position += size
+
+    while data[position] == 0x21:
+        position = skip_sub_blocks(data, position + 2)
+    assert data[position] == 0x2c
+
+    descriptor = bytearray(data[position:position + 10])
+    position += 10
+    if descriptor[9] & 0x80:
+        size = 3 << ((descriptor[9] & 0x07) + 1)
+        palette = data[position:position + size]
+        palette_bits = descriptor[9] & 0x07
+        position += size
+    descriptor[9] = (descriptor[9] & 0x40) | 0x80 | palette_bits
+    start = position
+    position = skip_sub_blocks(data, position + 1)
+
+    control = b'\x21\xf9\x04\x00' + struct.pack('<H', delay) + b'\x00\x00'
+    return control + bytes(descriptor) + palette + data[start:position]
+
+
+def skip_sub_blocks(data, position):
+    while data[position]:
+        position += data[position] + 1
+    return position + 1
@@ -0,0 +1,48 @@
+import os
+import sys
+from time import perf_counter
+
+# the modules live at the top of the repository, not in a package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+import bvh
+import ray_tracer
+from main import build_scene
+
+
+SAMPLE_COUNTS = (1, 4, 16)
+FILTERS = (ray_tracer.BOX, ray_tracer.TENT, ray_tracer.GAUSSIAN)
+REFERENCE_SAMPLES = 256
+
+
+def render(camera, objects, lights, depth, sampler):
+    start = perf_counter()
+    colors = ray_tracer.render_image(camera, objects, lights, depth, 0, backend='numpy', hdr=True, sampler=sampler)
+    return colors, perf_counter() - start
+
+
+def main():
+    # error of each filter against a heavily sampled render with the same filter, the jagged one-sample
+    # render is measured against the box reference
+    resolution_coef = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    depth = 3
+    camera, objects, lights = build_scene(resolution_coef, 'model.txt')
+    objects = bvh.BVH(objects)
+    plain, plain_time = render(camera, objects, lights, depth, None)
+    for pixel_filter in FILTERS:
+        reference, _ = render(camera, objects, lights, depth,
+                              ray_tracer.Sampler(REFERENCE_SAMPLES, pixel_filter, seed=1))
+        for samples in SAMPLE_COUNTS:
+            colors, elapsed = render(camera, objects, lights, depth, ray_tracer.Sampler(samples, pixel_filter))
+            rmse = np.sqrt(np.mean((np.clip(colors, 0, 1) - np.clip(reference, 0, 1)) ** 2))
+            print('{:>8} {:>3} samples: {:6.2f}s  rmse {:.4f}'.format(pixel_filter, samples, elapsed, rmse))
+        if pixel_filter == ray_tracer.BOX:
+            rmse = np.sqrt(np.mean((np.clip(plain, 0, 1) - np.clip(reference, 0, 1)) ** 2))
+            print('{:>8} {:>3} samples: {:6.2f}s  rmse {:.4f}'.format('none', 1, plain_time, rmse))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter
+
+
+# the modules live at the top of the repository, not in a package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# kept free of heavy imports, spawned workers import this module again
+MODULES = ('ray_tracer', 'tile_renderer', 'animation', 'streaming')
+HEAVY = ('numpy', 'PIL', 'pygame')
+REPEAT = 5
+
+
+def import_time(module):
+    # the cumulative microseconds python -X importtime reports for module, and the heavy packages it loaded
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            capture_output=True, text=True, cwd=ROOT)
+    total = None
+    loaded = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = line.split('|')
+        name = parts[2].strip()
+        if name == module:
+            total = int(parts[1])
+        if name in HEAVY:
+            loaded.add(name)
+    return total, sorted(loaded)
+
+
+def worker_task(tile):
+    import tile_renderer
+    return tile_renderer.render_tile(tile)
+
+
+def spawn_time():
+    # a spawn pool (the default on macOS and Windows) with the tile renderer's initializer and a
+    # single pixel to trace: the time until the first result is back
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import RawArray
+
+    import tile_renderer
+    from main import build_scene
+
+    camera, objects, lights = build_scene(0.1)
+    buffer = RawArray('B', camera.res_x * camera.res_y * 3)
+    start = perf_counter()
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=tile_renderer._init_worker,
+                             initargs=(camera, objects, lights, 1, 'scalar', buffer)) as pool:
+        pool.submit(worker_task, (0, 0, 1, 1)).result()
+    return perf_counter() - start
+
+
+def main():
+    for module in MODULES:
+        times = []
+        for _ in range(REPEAT):
+            total, loaded = import_time(module)
+            times.append(total)
+        print('import {:>14}: {:7.1f} ms  loads {}'.format(module, median(times) / 1000, ', '.join(loaded) or '-'))
+    print('spawned worker, first tile: {:.1f} ms'.format(median(spawn_time() for _ in range(REPEAT)) * 1000))
+
+
+if __name__ == '__main__':
+    main()
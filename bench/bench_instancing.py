@@ -0,0 +1,89 @@
+import os
+import sys
+from statistics import median
+from time import perf_counter
+
+# the modules live at the top of the repository, not in a package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import bvh
+import compiled
+import ray_tracer
+from main import build_scene
+from vector import Vector
+
+
+MODELS = ('model.txt', 'prismoid.txt')
+FRAMES = 20
+
+
+def rotating(file):
+    back = 240
+    down = -65
+    return ray_tracer.Model(Vector(0.45 * back - 5, down + 1, 3), 30,
+                            ray_tracer.Properties(Vector(0.3, 0.3, 1), 0.1, 0.9, 1.3, rotation=(0, 0.7, 0)), file=file)
+
+
+def rebuild_frames(model, rest, container):
+    # every frame: new triangles for the new rotation, then a new object container over everything
+    times = []
+    for frame in range(FRAMES):
+        start = perf_counter()
+        model.rotation = (0, 0.7 + frame * 0.1, 0)
+        container(rest + model.get_triangles())
+        times.append(perf_counter() - start)
+    return median(times)
+
+
+def delta_frames(model, rest, container):
+    # the triangles once, every frame only the instance moves and the container refreshes it
+    instance = model.get_instance()
+    scene = ray_tracer.Scene(None, container(rest + [instance]), [])
+    times = []
+    for frame in range(FRAMES):
+        start = perf_counter()
+        instance.move(rotation=(0, 0.7 + frame * 0.1, 0))
+        scene.update([instance])
+        times.append(perf_counter() - start)
+    return median(times)
+
+
+def render_check(resolution_coef, depth=5):
+    # the instanced model against its triangles in world space, on a few poses of the room
+    camera, objects, lights = build_scene(resolution_coef)
+    rest = [obj for obj in objects if type(obj) is not ray_tracer.Triangle]
+    model = rotating('model.txt')
+    model.properties = next(obj for obj in objects if type(obj) is ray_tracer.Triangle).properties
+    instance = model.get_instance()
+    for rotation in ((0, 0.7, 0), (0.3, 1.1, 0.2)):
+        model.rotation = rotation
+        instance.move(rotation=rotation)
+        start = perf_counter()
+        expected = ray_tracer.render_image(camera, rest + model.get_triangles(), lights, depth, 0).tobytes()
+        triangles_time = perf_counter() - start
+        start = perf_counter()
+        image = ray_tracer.render_image(camera, rest + [instance], lights, depth, 0).tobytes()
+        instance_time = perf_counter() - start
+        differing = sum(max(abs(a - b) for a, b in zip(expected[i:i + 3], image[i:i + 3])) > 1
+                        for i in range(0, len(image), 3))
+        print('rotation {}: {} of {} pixels off by more than 1, render {:.2f}s with triangles, {:.2f}s '
+              'instanced'.format(rotation, differing, len(image) // 3, triangles_time, instance_time))
+
+
+def main():
+    resolution_coef = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    _, objects, _ = build_scene(0.1)
+    rest = [obj for obj in objects if type(obj) is not ray_tracer.Triangle]
+    for file in MODELS:
+        for name, container in (('compiled', compiled.CompiledObjects), ('bvh', bvh.BVH)):
+            model = rotating(file)
+            rebuild = rebuild_frames(model, rest, container)
+            delta = delta_frames(rotating(file), rest, container)
+            print('{:>12} {:>8}: frame setup {:8.3f} ms rebuilt, {:6.3f} ms moved, {} triangles'.format(
+                file, name, rebuild * 1000, delta * 1000, len(model.get_triangles())))
+    render_check(resolution_coef)
+
+
+if __name__ == '__main__':
+    main()
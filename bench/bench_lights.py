@@ -0,0 +1,60 @@
+import os
+import random
+import sys
+from time import perf_counter
+
+# the modules live at the top of the repository, not in a package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+import bvh
+import ray_tracer
+from light_tree import LightTree
+from main import build_scene
+from vector import Vector
+
+
+LIGHT_COUNTS = (2, 16, 64, 256)
+
+
+def add_emitters(objects, lights, count, seed=3):
+    # small constant-color spheres with a light inside, spread over the room like the one in main.py
+    rng = random.Random(seed)
+    objects = list(objects)
+    lights = list(lights)
+    for _ in range(count):
+        origin = Vector(rng.uniform(20, 230), rng.uniform(-60, 70), rng.uniform(-85, 85))
+        color = Vector(rng.uniform(0.3, 1), rng.uniform(0.3, 1), rng.uniform(0.3, 1))
+        lights.append(ray_tracer.Light(origin, color, distance_coef=rng.uniform(5000, 40000)))
+        objects.append(ray_tracer.Sphere(origin, 2, ray_tracer.Properties(color, 0, 0.5, 1, constant_color=True)))
+    return objects, lights
+
+
+def render(camera, objects, lights, depth):
+    for light in lights:
+        light.reset_counters()
+    start = perf_counter()
+    image = ray_tracer.render_image(camera, objects, lights, depth, 0)
+    return np.asarray(image, dtype=np.int16), perf_counter() - start, sum(light.shadow_rays for light in lights)
+
+
+def main():
+    resolution_coef = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    depth = 3
+    camera, objects, lights = build_scene(resolution_coef, 'model.txt')
+    for count in LIGHT_COUNTS:
+        scene_objects, scene_lights = add_emitters(objects, lights, count)
+        scene_objects = bvh.BVH(scene_objects)
+        full, full_time, full_rays = render(camera, scene_objects, scene_lights, depth)
+        tree = LightTree(scene_lights)
+        culled, culled_time, culled_rays = render(camera, scene_objects, tree, depth)
+        diff = np.abs(full - culled)
+        print('{:>4} lights: every light {:6.2f}s {:7} shadow rays | tree {:6.2f}s {:7} shadow rays | '
+              'difference mean {:.2f} max {}'.format(len(scene_lights), full_time, full_rays, culled_time,
+                                                     culled_rays, diff.mean(), diff.max()))
+
+
+if __name__ == '__main__':
+    main()
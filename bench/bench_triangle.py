@@ -0,0 +1,80 @@
+import os
+import random
+import sys
+from time import perf_counter
+
+# the modules live at the top of the repository, not in a package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ray_tracer
+from ray_tracer import Vector, Ray, Plane, Triangle, Intersection, ZERO, EPS
+from main import build_scene
+
+
+MODELS = ('model.txt', 'prismoid.txt')
+
+
+class AreaSumTriangle(Triangle):
+    # the previous kernel: plane hit, then the three-cross-product area test
+    def __init__(self, p1, p2, p3, properties):
+        super().__init__(p1, p2, p3, properties)
+        self.plane = Plane(p1, self.normal, properties)
+
+    def is_point_inside(self, p):
+        if abs(p.sub_dot(self.p1, self.plane.n)) > EPS:
+            return False
+        p_p1 = self.p1 - p
+        p_p2 = self.p2 - p
+        p_p3 = self.p3 - p
+        sq = (abs(p_p1.cross(p_p2).len()) + abs(p_p2.cross(p_p3).len()) + abs(p_p3.cross(p_p1).len())) / 2
+        return abs(self.square - sq) <= EPS
+
+    def intersect(self, ray):
+        p = self.plane.intersect(ray)
+        if p.d < 0:
+            return p
+        if self.is_point_inside(p.p):
+            return p
+        return Intersection(ZERO, -1, ZERO, self)
+
+
+def kernel_benchmark(count=20000):
+    random.seed(7)
+    properties = ray_tracer.Properties()
+    corners = [Vector(random.uniform(-1, 1), random.uniform(-1, 1), random.uniform(4, 6)) for _ in range(3)]
+    rays = [Ray(Vector(0, 0, 0), Vector(random.uniform(-0.3, 0.3), random.uniform(-0.3, 0.3), 1).normal())
+            for _ in range(count)]
+    for cls in (AreaSumTriangle, Triangle):
+        triangle = cls(*corners, properties)
+        start = perf_counter()
+        hits = sum(triangle.intersect(ray).d > 0 for ray in rays)
+        elapsed = perf_counter() - start
+        print('{:>16}: {:6.2f} us per test, {} hits of {}'.format(cls.__name__, elapsed / count * 1e6, hits, count))
+
+
+def render_timing(resolution_coef, depth):
+    # the kernels agree on the picture, tests/test_triangle.py checks that
+    for model_file in MODELS:
+        for kernel in (AreaSumTriangle, Triangle):
+            camera, objects, lights = build_scene(resolution_coef, model_file)
+            objects = [kernel(obj.p1, obj.p2, obj.p3, obj.properties) if isinstance(obj, Triangle) else obj
+                       for obj in objects]
+            start = perf_counter()
+            ray_tracer.render_image(camera, objects, lights, depth, 0)
+            print('{:>13} {:>16}: rendered in {:.2f}s'.format(model_file, kernel.__name__, perf_counter() - start))
+
+        camera, objects, lights = build_scene(resolution_coef, model_file)
+        start = perf_counter()
+        ray_tracer.render_image(camera, objects, lights, depth, 0, backend='numpy')
+        print('{:>13} {:>16}: rendered in {:.2f}s'.format(model_file, 'numpy backend', perf_counter() - start))
+
+
+def main():
+    resolution_coef = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    kernel_benchmark()
+    render_timing(resolution_coef, depth=5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import os
+import sys
+from collections import Counter
+from time import perf_counter
+
+# the modules live at the top of the repository, not in a package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ray_tracer
+from main import build_scene
+
+
+COUNTED = ('Vector', 'Ray', 'Intersection')
+
+
+def count_allocations(camera, objects, lights, depth):
+    counts = Counter()
+
+    def profile(frame, event, arg):
+        if event == 'call' and frame.f_code.co_name == '__init__':
+            name = type(frame.f_locals['self']).__name__
+            if name in COUNTED:
+                counts[name] += 1
+
+    sys.setprofile(profile)
+    try:
+        render_pixels(camera, objects, lights, depth)
+    finally:
+        sys.setprofile(None)
+    return counts
+
+
+def render_pixels(camera, objects, lights, depth):
+    for y in range(camera.res_y):
+        for x in range(camera.res_x):
+            ray_tracer.trace(camera.get_ray(y, x), objects, lights, depth)
+
+
+def main():
+    resolution_coef = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    depth = 5
+    camera, objects, lights = build_scene(resolution_coef)
+    pixels = camera.res_x * camera.res_y
+
+    start = perf_counter()
+    render_pixels(camera, objects, lights, depth)
+    elapsed = perf_counter() - start
+
+    counts = count_allocations(camera, objects, lights, depth)
+    rays = counts['Ray']
+    print('{} pixels, {} rays, {:.2f} us per ray'.format(pixels, rays, elapsed / rays * 1e6))
+    for name in COUNTED:
+        print('{:>12}: {:8.2f} per ray {:8.2f} per pixel'.format(name, counts[name] / rays, counts[name] / pixels))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import tracemalloc
+from math import cos, sin, pi
+from time import perf_counter
+
+import numpy as np
+
+import bvh
+import compiled
+import packet_tracer
+import ray_tracer
+from ray_stats import RayStats, PRIMARY, SHADOW, REFLECTION, REFRACTION
+from ray_tracer import MAG, DISTANT, image_from_buffer
+from vector import Vector
+from main import build_scene
+
+
+WRITE_OUT = 'write_out'
+STAGES = (PRIMARY, SHADOW, REFLECTION, REFRACTION, WRITE_OUT)
+
+SCALAR = 'scalar'
+BVH = 'bvh'
+NUMPY = 'numpy'
+BACKENDS = (SCALAR, BVH, NUMPY)
+
+# peaks of a few KiB wobble by a handful of bytes between runs
+MEMORY_SLACK = 64 * 1024
+
+
+def room(resolution_coef):
+    return build_scene(resolution_coef, 'model.txt')
+
+
+def prismoid(resolution_coef):
+    return build_scene(resolution_coef, 'prismoid.txt')
+
+
+def sphere_field(resolution_coef, count=400):
+    rng = random.Random(1)
+    camera = ray_tracer.Camera(Vector(-60, 25, 0), Vector(1, -0.25, 0), 100, 50, 50, resolution_coef)
+    objects = [ray_tracer.Plane(Vector(0, -3, 0), Vector(0, 1, 0),
+                                ray_tracer.Properties(Vector(0.8, 0.8, 0.8), type=ray_tracer.SQUARED, scale=2))]
+    for _ in range(count):
+        properties = ray_tracer.Properties(Vector(rng.random(), rng.random(), rng.random()),
+                                           reflective=rng.choice((0, 0, 0.3)), refractive=rng.choice((0, 0, 0, 0.7)),
+                                           refractive_coef=1.5)
+        center = Vector(rng.uniform(0, 200), rng.uniform(-2, 8), rng.uniform(-80, 80))
+        objects.append(ray_tracer.Sphere(center, rng.uniform(1, 4), properties))
+    lights = [ray_tracer.Light(Vector(50, 150, 0), Vector(1, 1, 1), distance_coef=5000000),
+              ray_tracer.Light(Vector(1, -1, 0.3), Vector(0.3, 0.3, 0.3), type=DISTANT)]
+    return camera, objects, lights
+
+
+def torus(resolution_coef, rings=32, sides=16):
+    # a room with the model swapped for a finely tessellated torus, rings * sides * 2 triangles
+    camera, objects, lights = build_scene(resolution_coef, 'model.txt')
+    objects = [obj for obj in objects if not isinstance(obj, ray_tracer.Triangle)]
+    properties = ray_tracer.Properties(Vector(0.3, 0.3, 1), 0.3, 0.5, 1.3)
+    center = Vector(110, -20, -10)
+    big, small = 30, 10
+
+    def point(i, j):
+        a = 2 * pi * i / rings
+        b = 2 * pi * j / sides
+        r = big + small * cos(b)
+        return Vector(center.x + r * cos(a), center.y + small * sin(b), center.z + r * sin(a))
+
+    for i in range(rings):
+        for j in range(sides):
+            p00, p10 = point(i, j), point(i + 1, j)
+            p01, p11 = point(i, j + 1), point(i + 1, j + 1)
+            objects.append(ray_tracer.Triangle(p00, p10, p11, properties))
+            objects.append(ray_tracer.Triangle(p00, p11, p01, properties))
+    return camera, objects, lights
+
+
+# the plain object list is left out where a linear scan would take minutes
+SCENES = {
+    'room': (room, BACKENDS),
+    'prismoid': (prismoid, BACKENDS),
+    'sphere_field': (sphere_field, (BVH, NUMPY)),
+    'torus': (torus, (BVH, NUMPY)),
+}
+
+
+class StageTimer(RayStats):
+    # exclusive time per stage: entering a nested stage pauses the enclosing one. Given to render_image as
+    # its stats, the scalar tracer reports its branches through the RayStats hooks and every light times its
+    # shadow rays; the stores of the pixels count as primary, the encoding after the last pixel as write out
+    def __init__(self):
+        super().__init__()
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.rays = dict.fromkeys(STAGES[:-1], 0)
+        self.stack = []
+        self.mark = 0
+
+    def push(self, stage, rays=0):
+        now = perf_counter()
+        if self.stack:
+            self.times[self.stack[-1]] += now - self.mark
+        self.stack.append(stage)
+        self.mark = now
+        if rays:
+            self.rays[stage] += rays
+
+    def pop(self):
+        now = perf_counter()
+        self.times[self.stack.pop()] += now - self.mark
+        self.mark = now
+
+    def start(self, camera, objects, lights, depth):
+        self.max_depth = depth
+        self.lights = list(lights)
+        for light in self.lights:
+            light.reset_counters()
+            light.calculate_effect = self.timing(light.calculate_effect)
+        self.push(PRIMARY)
+
+    def timing(self, calculate_effect):
+        def timed(point, normal, obj, objects):
+            self.push(SHADOW)
+            effect = calculate_effect(point, normal, obj, objects)
+            self.pop()
+            return effect
+        return timed
+
+    def stop(self):
+        # render_image writes the image out after this, the caller pops the stage once it returns
+        self.pop()
+        self.push(WRITE_OUT)
+        for light in self.lights:
+            del light.calculate_effect
+        self.rays[SHADOW] += sum(light.shadow_rays for light in self.lights)
+
+    def pixel(self, x, y, rays=1):
+        self.rays[PRIMARY] += rays
+
+    def ray(self, kind):
+        self.push(kind, 1)
+
+    def ray_done(self, kind):
+        self.pop()
+
+
+class TimedPacketScene(packet_tracer.PacketScene):
+    def __init__(self, objects, lights, timer):
+        super().__init__(objects, lights)
+        self.timer = timer
+        self.expected = []
+
+    def trace(self, o, d, depth):
+        # shade spawns the reflected packet before the refracted one, see shade below
+        stage = self.expected[-1].pop(0) if self.expected and self.expected[-1] else PRIMARY
+        self.timer.push(stage, len(o) if depth else 0)
+        color = super().trace(o, d, depth)
+        self.timer.pop()
+        return color
+
+    def shade(self, d, point, normal, index, depth, distance):
+        kinds = []
+        if (self.reflective[index] != 0).any():
+            kinds.append(REFLECTION)
+        if (self.refractive[index] != 0).any():
+            kinds.append(REFRACTION)
+        self.expected.append(kinds)
+        color = super().shade(d, point, normal, index, depth, distance)
+        self.expected.pop()
+        return color
+
+    def light_effect(self, light, point, normal, index):
+        self.timer.push(SHADOW, len(point) if light.type in (MAG, DISTANT) else 0)
+        effect = super().light_effect(light, point, normal, index)
+        self.timer.pop()
+        return effect
+
+
+def prepare(scene, backend, resolution_coef):
+    camera, objects, lights = SCENES[scene][0](resolution_coef)
+    if backend == BVH:
+        objects = bvh.BVH(objects)
+    elif backend == SCALAR:
+        # compiled up front, render_image leaves the objects as they are when it is given stats
+        objects = compiled.compile_objects(objects)
+    return camera, objects, lights
+
+
+def render(camera, objects, lights, depth, backend):
+    return ray_tracer.render_image(camera, objects, lights, depth, 0,
+                                   backend=NUMPY if backend == NUMPY else SCALAR)
+
+
+def render_stages(camera, objects, lights, depth, backend):
+    timer = StageTimer()
+    if backend == NUMPY:
+        scene = TimedPacketScene(objects, lights, timer)
+        colors = scene.trace(*flat_primary_rays(camera), depth)
+        timer.push(WRITE_OUT)
+        image_from_buffer(packet_tracer.to_pixels(colors), camera.res_x, camera.res_y)
+        timer.pop()
+        return timer
+
+    ray_tracer.render_image(camera, objects, lights, depth, 0, stats=timer)
+    timer.pop()
+    return timer
+
+
+def flat_primary_rays(camera):
+    d = packet_tracer.primary_rays(camera).reshape(-1, 3)
+    return np.tile(packet_tracer.to_array(camera.o), (len(d), 1)), d
+
+
+def run_case(scene, backend, resolution_coef, depth, repeat):
+    camera, objects, lights = prepare(scene, backend, resolution_coef)
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        render(camera, objects, lights, depth, backend)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    timer = render_stages(camera, objects, lights, depth, backend)
+    rays = sum(timer.rays.values())
+
+    # a separate pass, tracemalloc slows the render down too much to time it
+    camera, objects, lights = prepare(scene, backend, resolution_coef)
+    tracemalloc.start()
+    render(camera, objects, lights, depth, backend)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'pixels': camera.res_x * camera.res_y,
+        'seconds': best,
+        'rays': rays,
+        'rays_per_second': rays / best,
+        'ray_counts': timer.rays,
+        'stage_seconds': timer.times,
+        'peak_memory': peak,
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for scene, backends in results['scenes'].items():
+        for backend, current in backends.items():
+            previous = baseline.get('scenes', {}).get(scene, {}).get(backend)
+            if previous is None:
+                continue
+            name = '{}/{}'.format(scene, backend)
+            if current['rays_per_second'] < previous['rays_per_second'] * (1 - threshold):
+                regressions.append('{}: {:.0f} rays/s, baseline {:.0f}'.format(
+                    name, current['rays_per_second'], previous['rays_per_second']))
+            if current['peak_memory'] > previous['peak_memory'] * (1 + threshold) + MEMORY_SLACK:
+                regressions.append('{}: peak memory {} bytes, baseline {}'.format(
+                    name, current['peak_memory'], previous['peak_memory']))
+    return regressions
+
+
+def report(scene, backend, result):
+    stages = ' '.join('{} {:.3f}'.format(stage, result['stage_seconds'][stage]) for stage in STAGES)
+    print('{:>13} {:>6}: {:7.2f}s {:9.0f} rays/s {:8.0f} KiB | {}'.format(
+        scene, backend, result['seconds'], result['rays_per_second'], result['peak_memory'] / 1024, stages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Renders fixed scenes with every backend and records rays per '
+                                                 'second, per-stage time and peak memory.')
+    parser.add_argument('--resolution', type=float, default=1, help='Camera res_coef of every scene')
+    parser.add_argument('--depth', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3, help='Timed renders per case, the best one is kept')
+    parser.add_argument('--scenes', nargs='+', choices=sorted(SCENES), default=list(SCENES))
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Allowed relative slowdown or memory growth before the run fails')
+    args = parser.parse_args()
+
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'resolution': args.resolution,
+        'depth': args.depth,
+        'scenes': {},
+    }
+    for scene in args.scenes:
+        for backend in SCENES[scene][1]:
+            if backend not in args.backends:
+                continue
+            result = run_case(scene, backend, args.resolution, args.depth, args.repeat)
+            results['scenes'].setdefault(scene, {})[backend] = result
+            report(scene, backend, result)
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get('resolution') != args.resolution or baseline.get('depth') != args.depth:
+            print('Baseline was recorded with other settings, the comparison is meaningless')
+            return 2
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print('Regression:', line)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,331 @@
+from ray_tracer import test_ray, occluded
+from compiled import CompiledObjects
+
+
+BINS = 12
+LEAF_SIZE = 4
+MAX_LEAF_SIZE = 16
+TRAVERSAL_COST = 1
+INTERSECTION_COST = 1
+HUGE = 1e30
+
+
+class Node:
+    def __init__(self, lo, hi, axis=0, left=None, right=None, objects=None):
+        self.lo = lo
+        self.hi = hi
+        self.axis = axis
+        self.left = left
+        self.right = right
+        self.objects = objects
+        # the objects of a leaf frozen into records, see compiled.py
+        self.compiled = None
+        self.parent = None
+
+
+class BVH:
+    def __init__(self, objects):
+        self.root = None
+        self.objects = []
+        self.bounded = []
+        self.planes = []
+        self.unbounded = CompiledObjects(())
+        self.leaves = {}
+        # set by ray_stats, whose counting intersects the compiled records would skip: leaves are then
+        # tested object by object
+        self.plain = False
+        self.rebuild(objects)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def rebuild(self, objects=None):
+        if objects is not None:
+            self.objects = list(objects)
+        self.bounded = []
+        self.planes = []
+        items = []
+        for obj in self.objects:
+            box = obj.bounds()
+            if box is None:
+                self.planes.append(obj)
+            else:
+                self.bounded.append(obj)
+                items.append(make_item(obj, box))
+        self.unbounded = CompiledObjects(self.planes)
+        self.root = build(items) if items else None
+        self.leaves = {}
+        if self.root is not None:
+            link(self.root, self.leaves)
+
+    @classmethod
+    def from_arrays(cls, objects, arrays):
+        # skips the build, arrays come from arrays() of an earlier tree over the same objects in the same order
+        tree = cls(())
+        tree.objects = list(objects)
+        for obj in tree.objects:
+            (tree.planes if obj.bounds() is None else tree.bounded).append(obj)
+        tree.unbounded = CompiledObjects(tree.planes)
+        nodes = [Node(tuple(box[:3]), tuple(box[3:]), axis)
+                 for box, axis in zip(arrays['bounds'].tolist(), arrays['axes'].tolist())]
+        members = arrays['members'].tolist()
+        for node, (left, right), (start, count) in zip(nodes, arrays['children'].tolist(), arrays['spans'].tolist()):
+            if left < 0:
+                node.objects = [tree.objects[index] for index in members[start:start + count]]
+            else:
+                node.left = nodes[left]
+                node.right = nodes[right]
+        if nodes:
+            tree.root = nodes[0]
+            link(tree.root, tree.leaves)
+        return tree
+
+    def arrays(self):
+        # the nodes in depth-first order: boxes, split axes, child positions, -1 for leaves, and the slice of
+        # members, positions in self.objects, each leaf holds
+        import numpy as np
+        nodes = []
+        position = {}
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            position[node] = len(nodes)
+            nodes.append(node)
+            if node.objects is None:
+                stack.append(node.right)
+                stack.append(node.left)
+        index = {obj: i for i, obj in enumerate(self.objects)}
+        children = []
+        spans = []
+        members = []
+        for node in nodes:
+            if node.objects is None:
+                children.append((position[node.left], position[node.right]))
+                spans.append((0, 0))
+            else:
+                children.append((-1, -1))
+                spans.append((len(members), len(node.objects)))
+                members += [index[obj] for obj in node.objects]
+        return {'bounds': np.array([node.lo + node.hi for node in nodes], dtype=np.float64).reshape(-1, 6),
+                'axes': np.array([node.axis for node in nodes], dtype=np.int64),
+                'children': np.array(children, dtype=np.int64).reshape(-1, 2),
+                'spans': np.array(spans, dtype=np.int64).reshape(-1, 2),
+                'members': np.array(members, dtype=np.int64)}
+
+    def refit(self):
+        self.unbounded.update(self.planes)
+        if self.root is not None:
+            refit(self.root)
+
+    def update(self, moved):
+        # refits only the leaves of the moved objects and the nodes above them, up to where a box stays
+        # the same; the tree keeps its shape, rebuild once objects have moved far from where it was built
+        self.unbounded.update(moved)
+        for obj in moved:
+            node = self.leaves.get(obj)
+            if node is None:
+                continue
+            node.compiled.update((obj,))
+            node.lo, node.hi = union([make_item(leaf_obj, leaf_obj.bounds()) for leaf_obj in node.objects])
+            node = node.parent
+            while node is not None:
+                lo = tuple(map(min, node.left.lo, node.right.lo))
+                hi = tuple(map(max, node.left.hi, node.right.hi))
+                if lo == node.lo and hi == node.hi:
+                    break
+                node.lo, node.hi = lo, hi
+                node = node.parent
+
+    def test_ray(self, ray, to_ignore=()):
+        intersection = test_ray(ray, self.planes if self.plain else self.unbounded, to_ignore)
+        if self.root is None:
+            return intersection
+
+        origin = (ray.o.x, ray.o.y, ray.o.z)
+        direction = (ray.d.x, ray.d.y, ray.d.z)
+        inverse = tuple(1 / c if c else HUGE for c in direction)
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            near = hit_box(node, origin, inverse)
+            if near is None or 0 < intersection.d < near:
+                continue
+            if node.objects is not None:
+                current_intersection = test_ray(ray, node.objects if self.plain else node.compiled, to_ignore)
+                if current_intersection.d > 0 and (intersection.d < 0 or current_intersection.d < intersection.d):
+                    intersection = current_intersection
+            elif direction[node.axis] < 0:
+                stack.append(node.left)
+                stack.append(node.right)
+            else:
+                stack.append(node.right)
+                stack.append(node.left)
+        return intersection
+
+    def occluded(self, ray, max_distance=None, to_ignore=(), skip_refractive=True):
+        blocker = occluded(ray, self.planes if self.plain else self.unbounded, max_distance, to_ignore,
+                           skip_refractive)
+        if blocker is not None or self.root is None:
+            return blocker
+
+        limit = HUGE if max_distance is None else max_distance
+        origin = (ray.o.x, ray.o.y, ray.o.z)
+        inverse = tuple(1 / c if c else HUGE for c in (ray.d.x, ray.d.y, ray.d.z))
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            near = hit_box(node, origin, inverse)
+            if near is None or near >= limit:
+                continue
+            if node.objects is not None:
+                blocker = occluded(ray, node.objects if self.plain else node.compiled, max_distance, to_ignore,
+                                   skip_refractive)
+                if blocker is not None:
+                    return blocker
+            else:
+                stack.append(node.left)
+                stack.append(node.right)
+        return None
+
+
+def hit_box(node, origin, inverse):
+    t_min = 0
+    t_max = HUGE
+    for axis in range(3):
+        t1 = (node.lo[axis] - origin[axis]) * inverse[axis]
+        t2 = (node.hi[axis] - origin[axis]) * inverse[axis]
+        if t1 > t2:
+            t1, t2 = t2, t1
+        if t1 > t_min:
+            t_min = t1
+        if t2 < t_max:
+            t_max = t2
+        if t_min > t_max:
+            return None
+    return t_min
+
+
+def make_item(obj, box):
+    lo, hi = box
+    lo = (lo.x, lo.y, lo.z)
+    hi = (hi.x, hi.y, hi.z)
+    centroid = tuple((a + b) / 2 for a, b in zip(lo, hi))
+    return obj, lo, hi, centroid
+
+
+def union(items):
+    lo = tuple(min(item[1][axis] for item in items) for axis in range(3))
+    hi = tuple(max(item[2][axis] for item in items) for axis in range(3))
+    return lo, hi
+
+
+def area(lo, hi):
+    dx, dy, dz = (max(h - l, 0) for l, h in zip(lo, hi))
+    return 2 * (dx * dy + dy * dz + dz * dx)
+
+
+def build(items):
+    lo, hi = union(items)
+    if len(items) <= LEAF_SIZE:
+        return Node(lo, hi, objects=[item[0] for item in items])
+
+    split = find_split(items, lo, hi)
+    if split is not None and split[0] >= len(items) * INTERSECTION_COST and len(items) <= MAX_LEAF_SIZE:
+        return Node(lo, hi, objects=[item[0] for item in items])
+    if split is None:
+        axis = max(range(3), key=lambda a: hi[a] - lo[a])
+        items = sorted(items, key=lambda item: item[3][axis])
+        middle = len(items) // 2
+        left, right = items[:middle], items[middle:]
+    else:
+        cost, axis, left, right = split
+    return Node(lo, hi, axis, build(left), build(right))
+
+
+def find_split(items, lo, hi):
+    parent_area = area(lo, hi) or 1
+    best = None
+    best_cost = None
+    for axis in range(3):
+        c_lo = min(item[3][axis] for item in items)
+        c_hi = max(item[3][axis] for item in items)
+        if c_hi - c_lo <= 0:
+            continue
+        scale = BINS / (c_hi - c_lo)
+
+        bins = [None] * BINS
+        for item in items:
+            b = min(int((item[3][axis] - c_lo) * scale), BINS - 1)
+            if bins[b] is None:
+                bins[b] = [1, item[1], item[2]]
+            else:
+                count, b_lo, b_hi = bins[b]
+                bins[b] = [count + 1, tuple(map(min, b_lo, item[1])), tuple(map(max, b_hi, item[2]))]
+
+        for i in range(1, BINS):
+            left = merge_bins(bins[:i])
+            right = merge_bins(bins[i:])
+            if left is None or right is None:
+                continue
+            cost = TRAVERSAL_COST + INTERSECTION_COST * (
+                left[0] * area(left[1], left[2]) + right[0] * area(right[1], right[2])) / parent_area
+            if best_cost is None or cost < best_cost:
+                best_cost = cost
+                best = (axis, i, c_lo, scale)
+
+    if best is None:
+        return None
+
+    axis, i, c_lo, scale = best
+    left = []
+    right = []
+    for item in items:
+        if min(int((item[3][axis] - c_lo) * scale), BINS - 1) < i:
+            left.append(item)
+        else:
+            right.append(item)
+    return best_cost, axis, left, right
+
+
+def merge_bins(bins):
+    count = 0
+    lo = None
+    hi = None
+    for b in bins:
+        if b is None:
+            continue
+        if lo is None:
+            lo, hi = b[1], b[2]
+        else:
+            lo = tuple(map(min, lo, b[1]))
+            hi = tuple(map(max, hi, b[2]))
+        count += b[0]
+    if not count:
+        return None
+    return count, lo, hi
+
+
+def link(node, leaves):
+    if node.objects is not None:
+        node.compiled = CompiledObjects(node.objects)
+        for obj in node.objects:
+            leaves[obj] = node
+        return
+    for child in (node.left, node.right):
+        child.parent = node
+        link(child, leaves)
+
+
+def refit(node):
+    if node.objects is not None:
+        items = [make_item(obj, obj.bounds()) for obj in node.objects]
+        node.lo, node.hi = union(items)
+        node.compiled.update(node.objects)
+    else:
+        refit(node.left)
+        refit(node.right)
+        node.lo = tuple(map(min, node.left.lo, node.right.lo))
+        node.hi = tuple(map(max, node.left.hi, node.right.hi))
@@ -0,0 +1,253 @@
+from math import sqrt
+
+from ray_tracer import EPS, DET_EPS, EDGE_EPS, ZERO, Sphere, Plane, Triangle, Intersection
+
+
+SPHERE = 0
+PLANE = 1
+TRIANGLE = 2
+OTHER = 3
+
+
+class CompiledObjects:
+    # a frozen copy of a plain object list: spheres, planes and triangles become flat tuples of floats,
+    # each type tested in a loop of its own without a method call or an Intersection per miss; the
+    # arithmetic is that of the intersect methods, so images stay byte for byte the same. Groups with a
+    # test_ray of their own, instances or a BVH, are asked with to_ignore passed on, anything else, meshes
+    # or subclasses with their own intersect, the usual way. After moving objects pass them to update;
+    # materials are read off the objects, update_properties needs nothing more.
+    def __init__(self, objects):
+        self.objects = list(objects)
+        self.spheres = []
+        self.planes = []
+        self.triangles = []
+        self.groups = []
+        self.other = []
+        # where the record of each object is, so that update can replace it
+        self.positions = {}
+        for obj in self.objects:
+            kind = type(obj)
+            if kind in RECORDS:
+                records = self.records(kind)
+                self.positions[obj] = (kind, len(records))
+                records.append(RECORDS[kind](obj))
+            elif hasattr(obj, 'test_ray'):
+                self.groups.append(obj)
+            else:
+                self.other.append(obj)
+
+    def records(self, kind):
+        if kind is Sphere:
+            return self.spheres
+        if kind is Plane:
+            return self.planes
+        return self.triangles
+
+    def update(self, moved):
+        # new records for objects whose geometry changed in place, the rest is left as it is;
+        # groups refresh what they keep about them themselves
+        for obj in moved:
+            position = self.positions.get(obj)
+            if position is None:
+                continue
+            kind, index = position
+            self.records(kind)[index] = RECORDS[kind](obj)
+        for group in self.groups:
+            if hasattr(group, 'update'):
+                group.update(moved)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def test_ray(self, ray, to_ignore=()):
+        o = ray.o
+        d = ray.d
+        ox, oy, oz = o.x, o.y, o.z
+        dx, dy, dz = d.x, d.y, d.z
+        best = -1
+        best_obj = None
+        best_kind = None
+        best_uv = None
+
+        for cx, cy, cz, r2, obj in self.spheres:
+            c_o_x = ox - cx
+            c_o_y = oy - cy
+            c_o_z = oz - cz
+            b = -(dx * c_o_x + dy * c_o_y + dz * c_o_z)
+            discriminant = r2 - ((c_o_x * c_o_x + c_o_y * c_o_y + c_o_z * c_o_z) - b ** 2)
+            if discriminant < 0:
+                continue
+            root = sqrt(discriminant)
+            d1 = b - root
+            d2 = b + root
+            if d1 > 0 and (d2 > d1 or d2 < 0):
+                t = d1
+            elif d2 > 0 and (d1 > d2 or d1 < 0):
+                t = d2
+            else:
+                continue
+            if (best < 0 or t < best) and obj not in to_ignore:
+                best, best_obj, best_kind = t, obj, SPHERE
+
+        for px, py, pz, nx, ny, nz, obj in self.planes:
+            cs = nx * dx + ny * dy + nz * dz
+            if -EPS < cs < EPS:
+                continue
+            t = ((px - ox) * nx + (py - oy) * ny + (pz - oz) * nz) / cs
+            if t > 0 and (best < 0 or t < best) and obj not in to_ignore:
+                best, best_obj, best_kind = t, obj, PLANE
+
+        for p1x, p1y, p1z, e1x, e1y, e1z, e2x, e2y, e2z, obj in self.triangles:
+            p_x = dy * e2z - dz * e2y
+            p_y = dz * e2x - dx * e2z
+            p_z = dx * e2y - dy * e2x
+            det = e1x * p_x + e1y * p_y + e1z * p_z
+            if -DET_EPS < det < DET_EPS:
+                continue
+            inv_det = 1 / det
+            s_x = ox - p1x
+            s_y = oy - p1y
+            s_z = oz - p1z
+            u = (s_x * p_x + s_y * p_y + s_z * p_z) * inv_det
+            if u < -EDGE_EPS or u > 1 + EDGE_EPS:
+                continue
+            q_x = s_y * e1z - s_z * e1y
+            q_y = s_z * e1x - s_x * e1z
+            q_z = s_x * e1y - s_y * e1x
+            v = (dx * q_x + dy * q_y + dz * q_z) * inv_det
+            if v < -EDGE_EPS or u + v > 1 + EDGE_EPS:
+                continue
+            t = (e2x * q_x + e2y * q_y + e2z * q_z) * inv_det
+            if t > 0 and (best < 0 or t < best) and obj not in to_ignore:
+                best, best_obj, best_kind, best_uv = t, obj, TRIANGLE, (u, v)
+
+        intersection = None
+        for group in self.groups:
+            if group in to_ignore:
+                continue
+            current = group.test_ray(ray, to_ignore)
+            if current.d > 0 and (best < 0 or current.d < best):
+                best, best_obj, best_kind, intersection = current.d, current.obj, OTHER, current
+
+        for obj in self.other:
+            if obj in to_ignore:
+                continue
+            current = obj.intersect(ray)
+            if current.d > 0 and (best < 0 or current.d < best):
+                best, best_obj, best_kind, intersection = current.d, obj, OTHER, current
+
+        # only the nearest hit gets its point and normal
+        if best_kind is None:
+            return Intersection(ZERO, -1, ZERO, None)
+        if best_kind == OTHER:
+            return intersection
+        point = o.add_scaled(d, best)
+        if best_kind == SPHERE:
+            return Intersection(point, best, best_obj.c.direction_to(point), best_obj)
+        if best_kind == PLANE:
+            return Intersection(point, best, best_obj.n if best_obj.n.dot(d) < 0 else best_obj.back_normal,
+                                best_obj)
+        normal = best_obj.normal if d.dot(best_obj.normal) < 0 else best_obj.back_normal
+        return Intersection(point, best, normal, best_obj, best_uv)
+
+    def occluded(self, ray, max_distance=None, to_ignore=(), skip_refractive=True):
+        o = ray.o
+        d = ray.d
+        ox, oy, oz = o.x, o.y, o.z
+        dx, dy, dz = d.x, d.y, d.z
+        limit = float('inf') if max_distance is None else max_distance
+
+        # shadow rays pass through refractive objects, looked up on the object at each hit so that
+        # update_properties needs no new records
+        for cx, cy, cz, r2, obj in self.spheres:
+            c_o_x = ox - cx
+            c_o_y = oy - cy
+            c_o_z = oz - cz
+            b = -(dx * c_o_x + dy * c_o_y + dz * c_o_z)
+            discriminant = r2 - ((c_o_x * c_o_x + c_o_y * c_o_y + c_o_z * c_o_z) - b ** 2)
+            if discriminant < 0:
+                continue
+            root = sqrt(discriminant)
+            d1 = b - root
+            d2 = b + root
+            if d1 > 0 and (d2 > d1 or d2 < 0):
+                t = d1
+            elif d2 > 0 and (d1 > d2 or d1 < 0):
+                t = d2
+            else:
+                continue
+            if t < limit and obj not in to_ignore and not (skip_refractive and obj.refractive):
+                return obj
+
+        for px, py, pz, nx, ny, nz, obj in self.planes:
+            cs = nx * dx + ny * dy + nz * dz
+            if -EPS < cs < EPS:
+                continue
+            t = ((px - ox) * nx + (py - oy) * ny + (pz - oz) * nz) / cs
+            if 0 < t < limit and obj not in to_ignore and not (skip_refractive and obj.refractive):
+                return obj
+
+        for p1x, p1y, p1z, e1x, e1y, e1z, e2x, e2y, e2z, obj in self.triangles:
+            p_x = dy * e2z - dz * e2y
+            p_y = dz * e2x - dx * e2z
+            p_z = dx * e2y - dy * e2x
+            det = e1x * p_x + e1y * p_y + e1z * p_z
+            if -DET_EPS < det < DET_EPS:
+                continue
+            inv_det = 1 / det
+            s_x = ox - p1x
+            s_y = oy - p1y
+            s_z = oz - p1z
+            u = (s_x * p_x + s_y * p_y + s_z * p_z) * inv_det
+            if u < -EDGE_EPS or u > 1 + EDGE_EPS:
+                continue
+            q_x = s_y * e1z - s_z * e1y
+            q_y = s_z * e1x - s_x * e1z
+            q_z = s_x * e1y - s_y * e1x
+            v = (dx * q_x + dy * q_y + dz * q_z) * inv_det
+            if v < -EDGE_EPS or u + v > 1 + EDGE_EPS:
+                continue
+            t = (e2x * q_x + e2y * q_y + e2z * q_z) * inv_det
+            if 0 < t < limit and obj not in to_ignore and not (skip_refractive and obj.refractive):
+                return obj
+
+        for group in self.groups:
+            if group in to_ignore:
+                continue
+            blocker = group.occluded(ray, max_distance, to_ignore, skip_refractive)
+            if blocker is not None:
+                return blocker
+
+        for obj in self.other:
+            if obj in to_ignore or (skip_refractive and obj.refractive):
+                continue
+            t = obj.intersect(ray).d
+            if 0 < t < limit:
+                return obj
+        return None
+
+
+def sphere_record(obj):
+    return obj.c.x, obj.c.y, obj.c.z, obj.r ** 2, obj
+
+
+def plane_record(obj):
+    return obj.p.x, obj.p.y, obj.p.z, obj.n.x, obj.n.y, obj.n.z, obj
+
+
+def triangle_record(obj):
+    return obj.p1.x, obj.p1.y, obj.p1.z, obj.e1.x, obj.e1.y, obj.e1.z, obj.e2.x, obj.e2.y, obj.e2.z, obj
+
+
+RECORDS = {Sphere: sphere_record, Plane: plane_record, Triangle: triangle_record}
+
+
+def compile_objects(objects):
+    # objects that bring their own test_ray are kept as they are: an already compiled list, or a BVH, which
+    # compiles each of its leaves itself
+    if hasattr(objects, 'test_ray'):
+        return objects
+    return CompiledObjects(objects)
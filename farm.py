@@ -0,0 +1,339 @@
+import argparse
+import multiprocessing
+import os
+import pickle
+import queue
+import socket
+from collections import deque
+from copy import deepcopy
+from multiprocessing import Process
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+from threading import Thread
+from time import monotonic
+
+import image_output
+import tile_renderer
+from tile_renderer import TILE_SIZE, CENTER_OUT, make_tiles, write_region
+
+
+# every message is a pickle, so only workers and coordinators that share the key may talk to each other,
+# a secret given as RAY_FARM_KEY or --key; keep the port off untrusted networks all the same
+KEY_VARIABLE = 'RAY_FARM_KEY'
+# a tile not back after this many seconds is handed to someone else
+TIMEOUT = 60
+# tiles a worker holds at once, so it never waits for the next one
+PREFETCH = 2
+POLL = 0.1
+
+
+class WorkerLink:
+    def __init__(self, connection):
+        self.connection = connection
+        self.scene = None
+        self.tiles = {}
+        # a tile of it timed out, it gets nothing more until it answers again
+        self.late = False
+
+
+class Coordinator:
+    # hands the tiles of a frame to whichever workers connect (see run_worker): the scene is pickled once
+    # per frame and sent once to each worker, tiles are pulled a few at a time and, once none are left,
+    # idle workers steal a copy of the oldest tile still out; tiles of lost or timed out workers go back
+    # in the queue, the first copy of a tile to come back is used. Without an authkey a random one is made,
+    # start_local_workers passes it on
+    def __init__(self, address=('localhost', 0), authkey=None, timeout=TIMEOUT, prefetch=PREFETCH):
+        self.authkey = authkey or os.urandom(32)
+        # authenticated in a thread per connection, see admit
+        self.listener = Listener(address)
+        self.address = self.listener.address
+        self.timeout = timeout
+        self.prefetch = prefetch
+        self.workers = []
+        self.incoming = queue.Queue()
+        # (link, message) from every worker, message None once its connection is gone
+        self.results = queue.Queue()
+        self.scene_id = 0
+        self.closed = False
+        Thread(target=self.accept, daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def accept(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except OSError:
+                return
+            if self.closed:
+                connection.close()
+                self.listener.close()
+                return
+            Thread(target=self.admit, args=(connection,), daemon=True).start()
+
+    def admit(self, connection):
+        # what Listener does with an authkey, but a client that never answers only holds up its own thread
+        try:
+            deliver_challenge(connection, self.authkey)
+            answer_challenge(connection, self.authkey)
+        except (EOFError, OSError, multiprocessing.AuthenticationError):
+            connection.close()
+            return
+        link = WorkerLink(connection)
+        self.incoming.put(link)
+        # a worker that stops halfway through a result only holds up this thread, not the render; the
+        # connection is closed here and only here, see hang_up
+        while True:
+            try:
+                self.results.put((link, connection.recv()))
+            except (EOFError, OSError):
+                connection.close()
+                self.results.put((link, None))
+                return
+
+    def close(self):
+        for link in self.workers:
+            try:
+                link.connection.send(('stop',))
+            except OSError:
+                pass
+            hang_up(link.connection)
+        self.workers = []
+        # wakes accept, which closes the listener itself, for the same reason as in hang_up
+        self.closed = True
+        try:
+            socket.create_connection(self.address).close()
+        except OSError:
+            self.listener.close()
+
+    def add_workers(self, block=False):
+        # with block, waits for as long as it takes the first worker to connect
+        try:
+            while True:
+                self.workers.append(self.incoming.get(block and not self.workers))
+        except queue.Empty:
+            pass
+
+    def drop(self, link, pending, done):
+        if link not in self.workers:
+            return
+        self.workers.remove(link)
+        for tile in link.tiles:
+            if tile not in done and tile not in pending:
+                pending.appendleft(tile)
+        hang_up(link.connection)
+
+    def send(self, link, message, pending, done):
+        try:
+            link.connection.send(message)
+            return True
+        except OSError:
+            self.drop(link, pending, done)
+            return False
+
+    def next_tile(self, link, pending, done, stolen):
+        while pending:
+            tile = pending.popleft()
+            if tile not in done:
+                return tile
+        # nothing left to hand out: help with the tile that has been out the longest
+        oldest = None
+        for other in self.workers:
+            for tile, started in other.tiles.items():
+                if tile in done or tile in stolen or tile in link.tiles:
+                    continue
+                if oldest is None or started < oldest[1]:
+                    oldest = tile, started
+        if oldest is None:
+            return None
+        stolen.add(oldest[0])
+        return oldest[0]
+
+    def render_buffer(self, camera, objects, lights, depth=2, tile_size=TILE_SIZE, order=CENTER_OUT,
+                      backend='scalar', termination=None, gamma=1, sampler=None, verbose=0):
+        if backend == 'scalar':
+            import compiled
+            objects = compiled.compile_objects(objects)
+        self.scene_id += 1
+        scene_id = self.scene_id
+        # the arguments of the tile renderer's worker initializer, workers return tile_bytes without a buffer
+        payload = pickle.dumps((camera, objects, lights, depth, backend, None, termination, gamma, sampler),
+                               pickle.HIGHEST_PROTOCOL)
+
+        buffer = bytearray(camera.res_x * camera.res_y * 3)
+        tiles = make_tiles(camera.res_x, camera.res_y, tile_size, order)
+        pending = deque(tiles)
+        done = set()
+        stolen = set()
+        while len(done) < len(tiles):
+            self.add_workers(block=True)
+            now = monotonic()
+            for link in list(self.workers):
+                for tile, started in list(link.tiles.items()):
+                    if now - started > self.timeout:
+                        del link.tiles[tile]
+                        link.late = True
+                        if tile not in done and tile not in pending:
+                            pending.appendleft(tile)
+                if link.late:
+                    continue
+                if link.scene != scene_id:
+                    if not self.send(link, ('scene', scene_id, payload), pending, done):
+                        continue
+                    link.scene = scene_id
+                while len(link.tiles) < self.prefetch:
+                    tile = self.next_tile(link, pending, done, stolen)
+                    if tile is None:
+                        break
+                    # held by the link before it is sent, a failed send puts it back in the queue
+                    link.tiles[tile] = now
+                    if not self.send(link, ('tile', scene_id, tile), pending, done):
+                        break
+
+            try:
+                link, message = self.results.get(timeout=POLL)
+            except queue.Empty:
+                continue
+            while True:
+                if message is None:
+                    self.drop(link, pending, done)
+                else:
+                    self.receive(link, message, scene_id, buffer, camera.res_x, done, len(tiles), verbose)
+                try:
+                    link, message = self.results.get_nowait()
+                except queue.Empty:
+                    break
+
+        # copies still out belong to this frame, whatever comes back for them is ignored
+        for link in self.workers:
+            link.tiles.clear()
+        return buffer
+
+    def receive(self, link, message, scene_id, buffer, res_x, done, count, verbose):
+        _, result_scene, tile, data = message
+        if link.scene == result_scene:
+            link.tiles.pop(tile, None)
+        link.late = False
+        if result_scene != scene_id or tile in done:
+            return
+        write_region(buffer, res_x, tile, data)
+        done.add(tile)
+        if verbose and len(done) % max(count // 10, 1) == 0:
+            print(len(done) / count)
+
+    def render(self, camera, objects, lights, depth=2, output=image_output.PIL, **settings):
+        # like render_image, settings are those of render_buffer
+        buffer = self.render_buffer(camera, objects, lights, depth, **settings)
+        return image_output.convert(buffer, camera.res_x, camera.res_y, output)
+
+    def animate(self, scene, frame_count, update=None, depth=2, **settings):
+        # frames one after another, each split across the workers; update works as in animation.animate
+        for frame_index in range(frame_count):
+            frame = deepcopy(scene)
+            if update is not None:
+                frame = update(frame, frame_index) or frame
+            yield frame_index, self.render(frame.camera, frame.objects, frame.lights, depth, **settings)
+
+
+def hang_up(connection):
+    # ends the reads of the thread of the connection, which then closes it; closed from another thread, its
+    # file descriptor could go to a new connection while that read is still under way
+    try:
+        sock = socket.socket(fileno=connection.fileno())
+    except OSError:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    finally:
+        sock.detach()
+
+
+def run_worker(address, authkey):
+    # renders tiles for a coordinator until it says stop or goes away
+    connection = Client(address, authkey=authkey)
+    scene_id = None
+    try:
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                return
+            if message[0] == 'stop':
+                return
+            if message[0] == 'scene':
+                _, scene_id, payload = message
+                tile_renderer._init_worker(*pickle.loads(payload))
+            elif message[0] == 'tile' and message[1] == scene_id:
+                tile = message[2]
+                try:
+                    connection.send(('done', scene_id, tile, tile_renderer.tile_bytes(tile)))
+                except OSError:
+                    return
+    finally:
+        connection.close()
+
+
+def start_local_workers(address, count, authkey):
+    # stand-ins for remote hosts, worker processes on this machine
+    workers = [Process(target=run_worker, args=(address, authkey), daemon=True) for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def farm_key(key=None):
+    key = key or os.environ.get(KEY_VARIABLE)
+    if not key:
+        raise SystemExit('Give the shared secret with --key or {}'.format(KEY_VARIABLE))
+    return key.encode()
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Renders a scene file across worker processes on any number '
+                                                 'of hosts.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='Coordinate the render of a scene file')
+    serve.add_argument('scene')
+    serve.add_argument('--address', default='localhost:6000',
+                       help='host:port workers connect to, 0.0.0.0:port for workers on other hosts')
+    serve.add_argument('--local-workers', type=int, default=0, help='Worker processes to start on this host')
+    serve.add_argument('--timeout', type=float, default=TIMEOUT)
+    serve.add_argument('-o', '--output', help='Image file, overrides render.output of the scene')
+    work = commands.add_parser('work', help='Render tiles for a coordinator')
+    work.add_argument('address', help='host:port of the coordinator')
+    for command in (serve, work):
+        command.add_argument('--key', help='Shared secret, {} by default'.format(KEY_VARIABLE))
+    args = parser.parse_args()
+
+    authkey = farm_key(args.key)
+    if args.command == 'work':
+        run_worker(parse_address(args.address), authkey)
+        return
+
+    import ray_tracer
+    import scene_file
+    scene, settings = scene_file.load_scene(args.scene)
+    sampler = None
+    if settings['samples'] > 1:
+        sampler = ray_tracer.Sampler(settings['samples'], settings['pixel_filter'])
+    with Coordinator(parse_address(args.address), authkey, args.timeout) as coordinator:
+        host, port = coordinator.address
+        print('Waiting for workers on {}:{}'.format(host, port))
+        start_local_workers(('localhost', port), args.local_workers, authkey)
+        image = coordinator.render(scene.camera, scene.objects, scene.lights, settings['depth'],
+                                   backend=settings['backend'], sampler=sampler, verbose=1)
+    image.save(args.output or settings['output'])
+
+
+if __name__ == '__main__':
+    main()
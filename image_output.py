@@ -0,0 +1,30 @@
+# adapters from a packed RGB buffer (rows of res_x * 3 bytes) to what the caller renders into; each one
+# imports its library when it is first used, so the tracer and its workers never load PIL or pygame
+
+PIL = 'pil'
+PYGAME = 'pygame'
+BUFFER = 'buffer'
+
+
+def to_pil(data, res_x, res_y):
+    from PIL import Image
+    return Image.frombuffer('RGB', (res_x, res_y), data, 'raw', 'RGB', 0, 1)
+
+
+def to_pygame(data, res_x, res_y):
+    import pygame.image
+    return pygame.image.frombuffer(data, (res_x, res_y), 'RGB')
+
+
+def to_buffer(data, res_x, res_y):
+    # the bytes themselves, without a copy
+    return memoryview(data).cast('B')
+
+
+ADAPTERS = {PIL: to_pil, PYGAME: to_pygame, BUFFER: to_buffer}
+
+
+def convert(data, res_x, res_y, output=PIL):
+    if output not in ADAPTERS:
+        raise ValueError('Unknown output: {}'.format(output))
+    return ADAPTERS[output](data, res_x, res_y)
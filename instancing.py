@@ -0,0 +1,137 @@
+from vector import Vector, rot
+from ray_tracer import ZERO, Ray, Intersection
+import compiled
+from bvh import HUGE, hit_box
+
+
+DET_MIN = 1e-12
+
+
+class Transform:
+    # p -> rot(p * coef, rotation) + center, the placement of Model.transformed_points, kept as a matrix
+    # and its inverse; the matrix is built from vector.rot itself, quirks of rotz included
+    def __init__(self, center=Vector(0, 0, 0), coef=1, rotation=(0, 0, 0)):
+        self.center = center
+        self.coef = coef
+        self.rotation = tuple(rotation)
+        a = rot(Vector(coef, 0, 0), rotation=self.rotation)
+        b = rot(Vector(0, coef, 0), rotation=self.rotation)
+        c = rot(Vector(0, 0, coef), rotation=self.rotation)
+        m = (a.x, b.x, c.x,
+             a.y, b.y, c.y,
+             a.z, b.z, c.z)
+        cofactors = (m[4] * m[8] - m[5] * m[7], m[5] * m[6] - m[3] * m[8], m[3] * m[7] - m[4] * m[6],
+                     m[2] * m[7] - m[1] * m[8], m[0] * m[8] - m[2] * m[6], m[1] * m[6] - m[0] * m[7],
+                     m[1] * m[5] - m[2] * m[4], m[2] * m[3] - m[0] * m[5], m[0] * m[4] - m[1] * m[3])
+        det = m[0] * cofactors[0] + m[1] * cofactors[1] + m[2] * cofactors[2]
+        if abs(det) < DET_MIN:
+            raise ValueError('Transform with coef {} and rotation {} is singular'.format(coef, self.rotation))
+        self.matrix = m
+        # the inverse is the transposed cofactors over det, the cofactors themselves map normals
+        self.inverse = tuple(cofactors[3 * (i % 3) + i // 3] / det for i in range(9))
+        self.normal_matrix = tuple(value / det for value in cofactors)
+
+    def point(self, p):
+        m = self.matrix
+        c = self.center
+        return Vector(m[0] * p.x + m[1] * p.y + m[2] * p.z + c.x,
+                      m[3] * p.x + m[4] * p.y + m[5] * p.z + c.y,
+                      m[6] * p.x + m[7] * p.y + m[8] * p.z + c.z)
+
+    def local_ray(self, ray):
+        # the ray in object space with a unit direction, and how much longer that direction is,
+        # local distances divided by it are world distances
+        m = self.inverse
+        o = ray.o - self.center
+        d = ray.d
+        direction = Vector(m[0] * d.x + m[1] * d.y + m[2] * d.z,
+                           m[3] * d.x + m[4] * d.y + m[5] * d.z,
+                           m[6] * d.x + m[7] * d.y + m[8] * d.z)
+        scale = direction.len()
+        origin = Vector(m[0] * o.x + m[1] * o.y + m[2] * o.z,
+                        m[3] * o.x + m[4] * o.y + m[5] * o.z,
+                        m[6] * o.x + m[7] * o.y + m[8] * o.z)
+        return Ray(origin, direction.inormal()), scale
+
+    def normal(self, n):
+        m = self.normal_matrix
+        return Vector(m[0] * n.x + m[1] * n.y + m[2] * n.z,
+                      m[3] * n.x + m[4] * n.y + m[5] * n.z,
+                      m[6] * n.x + m[7] * n.y + m[8] * n.z).inormal()
+
+
+class Instance:
+    # objects built once in their own space and placed by a Transform: rays are taken into object space
+    # instead of every vertex into world space, so moving an instance costs the same for any number of
+    # objects. Hits are reported on the inner objects, with world points and normals. Goes into object
+    # lists, a BVH or CompiledObjects like any object; the numpy backend does not take it.
+    def __init__(self, objects, transform=None):
+        self.objects = compiled.compile_objects(objects)
+        # for code that looks at the instance as a whole, render_cache.crosses say; shadow rays of the
+        # tracer go through occluded, which skips the refractive objects inside one by one
+        self.refractive = all(obj.refractive for obj in self.objects)
+        self.local_bounds = None
+        boxes = [obj.bounds() for obj in self.objects]
+        if boxes and None not in boxes:
+            self.local_bounds = (Vector(min(lo.x for lo, hi in boxes), min(lo.y for lo, hi in boxes),
+                                        min(lo.z for lo, hi in boxes)),
+                                 Vector(max(hi.x for lo, hi in boxes), max(hi.y for lo, hi in boxes),
+                                        max(hi.z for lo, hi in boxes)))
+        self.box = None
+        # the box as tuples, rays that miss it are not taken into object space
+        self.lo = None
+        self.hi = None
+        self.place(transform or Transform())
+
+    def __repr__(self):
+        return 'Instance[{} objects at {}]'.format(len(self.objects), self.transform.center)
+
+    def place(self, transform):
+        self.transform = transform
+        if self.local_bounds is None:
+            return
+        lo, hi = self.local_bounds
+        corners = [transform.point(Vector(x, y, z))
+                   for x in (lo.x, hi.x) for y in (lo.y, hi.y) for z in (lo.z, hi.z)]
+        self.lo = (min(p.x for p in corners), min(p.y for p in corners), min(p.z for p in corners))
+        self.hi = (max(p.x for p in corners), max(p.y for p in corners), max(p.z for p in corners))
+        self.box = Vector(*self.lo), Vector(*self.hi)
+
+    def near(self, ray):
+        # where the ray enters the box, None when it misses; unbounded instances are always entered
+        if self.lo is None:
+            return 0
+        d = ray.d
+        inverse = (1 / d.x if d.x else HUGE, 1 / d.y if d.y else HUGE, 1 / d.z if d.z else HUGE)
+        return hit_box(self, (ray.o.x, ray.o.y, ray.o.z), inverse)
+
+    def move(self, center=None, coef=None, rotation=None):
+        # a new placement, whatever is not given stays; pass the instance to Scene.update afterwards
+        transform = self.transform
+        self.place(Transform(transform.center if center is None else center,
+                             transform.coef if coef is None else coef,
+                             transform.rotation if rotation is None else rotation))
+
+    def bounds(self):
+        return self.box
+
+    def intersect(self, ray):
+        return self.test_ray(ray)
+
+    def test_ray(self, ray, to_ignore=()):
+        if self.near(ray) is None:
+            return Intersection(ZERO, -1, ZERO, None)
+        local, scale = self.transform.local_ray(ray)
+        hit = self.objects.test_ray(local, to_ignore)
+        if hit.d <= 0:
+            return Intersection(ZERO, -1, ZERO, None)
+        d = hit.d / scale
+        return Intersection(ray.o.add_scaled(ray.d, d), d, self.transform.normal(hit.n), hit.obj, hit.uv)
+
+    def occluded(self, ray, max_distance=None, to_ignore=(), skip_refractive=True):
+        near = self.near(ray)
+        if near is None or (max_distance is not None and near >= max_distance):
+            return None
+        local, scale = self.transform.local_ray(ray)
+        return self.objects.occluded(local, None if max_distance is None else max_distance * scale, to_ignore,
+                                     skip_refractive)
@@ -0,0 +1,116 @@
+from heapq import heappush, heappop
+from itertools import count
+from math import sqrt
+
+from vector import Vector
+from ray_tracer import MAG, AMBIENT
+
+
+MAX_LIGHTS = 8
+# a MAG light adds color * AMBIENT wherever its intensity stays at or below AMBIENT, so culling
+# at this cutoff only loses the shadows of the culled lights
+CUTOFF = AMBIENT
+HUGE = 1e30
+
+
+class Node:
+    def __init__(self, lo, hi, power, brightness, ambient, left=None, right=None, light=None):
+        self.lo = lo
+        self.hi = hi
+        self.power = power
+        self.brightness = brightness
+        self.ambient = ambient
+        self.left = left
+        self.right = right
+        self.light = light
+
+
+class LightTree:
+    def __init__(self, lights, max_lights=MAX_LIGHTS, cutoff=CUTOFF):
+        self.max_lights = max_lights
+        self.cutoff = cutoff
+        self.root = None
+        self.lights = []
+        self.other = []
+        self.rebuild(lights)
+
+    def __iter__(self):
+        return iter(self.lights)
+
+    def __len__(self):
+        return len(self.lights)
+
+    def rebuild(self, lights=None):
+        if lights is not None:
+            self.lights = list(lights)
+        point_lights = [light for light in self.lights if light.type == MAG]
+        self.other = [light for light in self.lights if light.type != MAG]
+        self.root = build(point_lights) if point_lights else None
+
+    def shade(self, point, normal, obj, objects):
+        # at most max_lights shadow rays, to the lights with the largest estimated contribution;
+        # the next ones are added unshadowed and whole subtrees under the cutoff as their ambient sum
+        effect = Vector(0, 0, 0)
+        for light in self.other:
+            effect.iadd(light.calculate_effect(point, normal, obj, objects))
+        if self.root is None:
+            return effect
+
+        exponent = 2 - obj.reflective / 5
+        order = count()
+        heap = []
+        shadowed = 0
+        nodes = (self.root,)
+        while True:
+            for node in nodes:
+                intensity = bound(node, point, exponent)
+                if intensity <= self.cutoff:
+                    effect.iadd(node.ambient)
+                else:
+                    heappush(heap, (-intensity * node.brightness, next(order), node))
+            if not heap:
+                return effect
+
+            # a leaf's estimate is its own, everything else in the heap is a bound on a whole subtree,
+            # so lights come out strongest first
+            node = heappop(heap)[2]
+            if node.light is None:
+                nodes = (node.left, node.right)
+                continue
+            nodes = ()
+            if shadowed < self.max_lights:
+                effect.iadd(node.light.calculate_effect(point, normal, obj, objects))
+                shadowed += 1
+            else:
+                effect.iadd(node.light.illumination(point, normal, obj))
+
+
+def bound(node, point, exponent):
+    # the highest intensity any light inside the node's box can reach at point
+    d2 = 0
+    for p, lo, hi in zip((point.x, point.y, point.z), node.lo, node.hi):
+        if p < lo:
+            d2 += (lo - p) ** 2
+        elif p > hi:
+            d2 += (p - hi) ** 2
+    if d2 == 0:
+        return HUGE
+    return node.power / (12.5 * sqrt(d2) ** exponent)
+
+
+def build(lights):
+    positions = [(light.o.x, light.o.y, light.o.z) for light in lights]
+    lo = tuple(min(p[axis] for p in positions) for axis in range(3))
+    hi = tuple(max(p[axis] for p in positions) for axis in range(3))
+    power = max(light.distance_coef for light in lights)
+    brightness = max(max(light.color.x, light.color.y, light.color.z) for light in lights)
+    ambient = Vector(0, 0, 0)
+    for light in lights:
+        ambient.iadd(light.color * AMBIENT)
+
+    if len(lights) == 1:
+        return Node(lo, hi, power, brightness, ambient, light=lights[0])
+    axis = max(range(3), key=lambda a: hi[a] - lo[a])
+    lights = sorted(lights, key=lambda light: (light.o.x, light.o.y, light.o.z)[axis])
+    middle = len(lights) // 2
+    return Node(lo, hi, power, brightness, ambient, build(lights[:middle]), build(lights[middle:]))
@@ -1,30 +1,20 @@
-from PIL import Image
+import os
 from time import time
 
 from vector import Vector
 import ray_tracer
+import bvh
+import animation
+import streaming
 
 
-def main():
-    frame_count = 1
+def build_scene(resolution_coef=25, model_file='model.txt'):
     width = 50
     height = width
     screen_distance = width * 2
-    depth = 5
 
     m = screen_distance
 
-    resolution_coef = 25
-    min_frame_width = 4000
-    min_frame_height = 4000
-
-    to_show = True
-    to_complete_loop = False
-    verbose = 1
-
-    render_start_time = time()
-    frame_start_time = 0
-
     camera = ray_tracer.Camera(Vector(-m / 2, 0, 0), Vector(1, 0, 0), screen_distance, width, height, resolution_coef)
 
     right = 90
@@ -63,8 +53,7 @@ def main():
         ray_tracer.Sphere(Vector(0.45 * back - 5, down + 1 + 30 * 2 - 10, 3), r3, properties[8])
     ]
 
-    pi = 3.141569
-    model = ray_tracer.Model(Vector(0.45 * back - 5, down + 1, 3), 30, ray_tracer.Properties(Vector(0.3, 0.3, 1), 0.1, 0.9, 1.3, rotation=(0, 0.7, 0)), file='model.txt')
+    model = ray_tracer.Model(Vector(0.45 * back - 5, down + 1, 3), 30, ray_tracer.Properties(Vector(0.3, 0.3, 1), 0.1, 0.9, 1.3, rotation=(0, 0.7, 0)), file=model_file)
     triags = model.get_triangles()
     objects += triags
 
@@ -75,36 +64,77 @@ def main():
     lights.append(ray_tracer.Light(Vector(back - 40, 0, left + 50), Vector(1, 1, 1), distance_coef=coef / 15))
     objects.append(ray_tracer.Sphere(lights[-1].o, 5, ray_tracer.Properties(Vector(1, 1, 1), 0, 0.5, 1, constant_color=True)))
 
-    frames = []
-    for frame_index in range(0, frame_count):
-        # k = frame_index
-        if verbose:
-            frame_start_time = time()
-            print('Frame_{} started'.format(frame_index))
+    return camera, objects, lights
 
-        frame = ray_tracer.render_image(camera, objects, lights, depth, verbose)
-        if camera.res_x < min_frame_width or camera.res_y < min_frame_height:
-            frame = frame.resize((min_frame_width, min_frame_height), Image.NEAREST)
 
-        if to_show:
-            frame.show()
-        if verbose:
-            frame_finish_time = time()
-            print('Frame_{} finished in {:.2f}'.format(frame_index, frame_finish_time - frame_start_time))
-        frame.save('frame{}.png'.format(frame_index))
+def update_scene(scene, frame_index):
+    # k = frame_index
+    return scene
 
-        if to_complete_loop:
-            frame.save('frame{}.png'.format(frame_count * 2 - frame_index - 1))
 
-    if to_complete_loop:
-        if verbose:
-            print('Completing loop')
+def render_frames(scene, frame_count, depth, backend, processes, termination, sampler, size, to_complete_loop,
+                  to_show, verbose):
+    writer = animation.PNGSequenceWriter('frame{}.png', size, loop=to_complete_loop)
+    # writer = animation.GIFWriter('render.gif', 100, size, loop=to_complete_loop)
+
+    # a single frame is split into tiles across the processes, an animation renders whole frames in parallel
+    # and each of them in one piece
+    processes = processes or os.cpu_count()
+    frame_processes, tile_processes = (1, processes) if frame_count == 1 else (processes, None)
+    frame_start_time = time()
+    with writer:
+        for frame_index, frame in animation.animate(scene, frame_count, update_scene, depth, frame_processes,
+                                                    backend=backend, tile_processes=tile_processes,
+                                                    termination=termination, sampler=sampler):
+            if verbose:
+                frame_finish_time = time()
+                print('Frame_{} finished in {:.2f}'.format(frame_index, frame_finish_time - frame_start_time))
+                frame_start_time = frame_finish_time
+            writer.write(frame)
+            if to_show:
+                frame.show()
 
-        frames = frames + frames[-1:-len(frames) - 1:-1]
-        for i in range(frame_count, len(frames)):
-            frames[i].save('frame{}.png'.format(i))
+
+def main():
+    frame_count = 1
+    depth = 5
+
+    resolution_coef = 25
+    min_frame_width = 4000
+    min_frame_height = 4000
+
+    to_show = True
+    to_complete_loop = False
+    verbose = 1
+    backend = 'scalar'  # or 'numpy'
+    processes = None  # number of render processes, None uses every core for tiles or frames alike
+    termination = None  # ray_tracer.Termination(min_weight=0.01) ends faint branches early, scalar only
+    sampler = None  # ray_tracer.Sampler(16, ray_tracer.GAUSSIAN) antialiases with 16 samples per pixel
+    # 'poster.png' or 'poster.tif' renders a single frame in strips straight into that file, upscaled on the way,
+    # for outputs too big to hold in memory
+    stream_output = None
+
+    render_start_time = time()
+
+    camera, objects, lights = build_scene(resolution_coef)
+    scene = ray_tracer.Scene(camera, bvh.BVH(objects), lights)
+
+    size = None
+    if camera.res_x < min_frame_width or camera.res_y < min_frame_height:
+        size = (min_frame_width, min_frame_height)
+
+    if stream_output:
+        writer = streaming.open_writer(stream_output, camera.res_x, camera.res_y, size)
+        streaming.render_strips(camera, scene.objects, lights, writer, depth, backend=backend,
+                                processes=processes or os.cpu_count(), termination=termination, sampler=sampler,
+                                verbose=verbose)
+    else:
+        render_frames(scene, frame_count, depth, backend, processes, termination, sampler, size, to_complete_loop,
+                      to_show, verbose)
 
     if verbose:
+        if to_complete_loop:
+            print('Loop completed')
         render_finish_time = time()
         print('Render finished in {:.2f}'.format(render_finish_time - render_start_time))
 
@@ -0,0 +1,409 @@
+import os
+import json
+
+import numpy as np
+
+from vector import Vector
+from ray_tracer import Intersection, ZERO, DET_EPS, EDGE_EPS
+
+
+CHUNK = 256
+BLOCK_LINES = 1 << 16
+CACHE_SUFFIX = '.meshcache'
+# everything intersect needs, in the order Mesh builds it
+ARRAYS = ('vertices', 'faces', 'p0', 'e1', 'e2', 'normals', 'chunk_lo', 'chunk_hi')
+
+
+class Mesh:
+    def __init__(self, vertices, faces, properties, center=Vector(0, 0, 0), coef=1, rotation=(0, 0, 0)):
+        vertices = transform(np.asarray(vertices, dtype=np.float64), center, coef, rotation)
+        faces = np.asarray(faces, dtype=np.int32)
+
+        p0 = vertices[faces[:, 0]]
+        order = np.argsort(morton_codes((p0 + vertices[faces[:, 1]] + vertices[faces[:, 2]]) / 3), kind='stable')
+        self.vertices = vertices
+        self.faces = faces[order]
+
+        self.p0 = vertices[self.faces[:, 0]]
+        self.e1 = vertices[self.faces[:, 1]] - self.p0
+        self.e2 = vertices[self.faces[:, 2]] - self.p0
+        normals = np.cross(self.e1, self.e2)
+        lengths = np.linalg.norm(normals, axis=1)
+        lengths[lengths == 0] = 1
+        self.normals = normals / lengths[:, None]
+
+        corners = np.stack([self.p0, self.p0 + self.e1, self.p0 + self.e2], axis=1)
+        chunks = (len(self.faces) + CHUNK - 1) // CHUNK
+        lo = corners.min(axis=1)
+        hi = corners.max(axis=1)
+        self.chunk_lo = np.array([lo[i * CHUNK:(i + 1) * CHUNK].min(axis=0) for i in range(chunks)]).reshape(-1, 3)
+        self.chunk_hi = np.array([hi[i * CHUNK:(i + 1) * CHUNK].max(axis=0) for i in range(chunks)]).reshape(-1, 3)
+
+        self.update_properties(properties)
+
+    @classmethod
+    def from_model(cls, model):
+        vertices = [(p.x, p.y, p.z) for p in model.points]
+        faces = [(link[0], link[i], link[i + 1]) for link in model.links for i in range(1, len(link) - 1)]
+        return cls(vertices, np.array(faces).reshape(-1, 3), model.properties, model.center, model.coef,
+                   model.rotation)
+
+    @classmethod
+    def from_file(cls, path, properties, center=Vector(0, 0, 0), coef=1, rotation=(0, 0, 0), cache=True):
+        vertices, faces = load_mesh(path, cache)
+        return cls(vertices, faces, properties, center, coef, rotation)
+
+    @classmethod
+    def from_arrays(cls, arrays, properties):
+        # skips the transform, sorting and chunking, arrays come from an earlier mesh's arrays()
+        mesh = cls.__new__(cls)
+        for name in ARRAYS:
+            setattr(mesh, name, arrays[name])
+        mesh.update_properties(properties)
+        return mesh
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in ARRAYS}
+
+    def update_properties(self, properties=None):
+        if properties:
+            props = properties
+        else:
+            props = self.properties
+
+        self.color = props.color
+        self.reflective = props.reflective
+        self.refractive_coef = props.refractive_coef
+        self.refractive = props.refractive
+        self.constant_color = props.constant_color
+        self.texture = props.texture
+        self.type = props.type
+        self.scale = props.scale
+        self.properties = props
+
+    def __repr__(self):
+        return 'Mesh[{} faces]'.format(len(self.faces))
+
+    def bounds(self):
+        if not len(self.faces):
+            return None
+        lo = self.chunk_lo.min(axis=0)
+        hi = self.chunk_hi.max(axis=0)
+        return Vector(*map(float, lo)), Vector(*map(float, hi))
+
+    def intersect(self, ray):
+        return self.test_ray(ray)
+
+    def test_ray(self, ray, to_ignore=()):
+        # a face in to_ignore, the one a shadow or secondary ray starts on, is skipped, the rest of
+        # the mesh is tested as usual
+        ignored = [obj.index for obj in to_ignore if type(obj) is Face and obj.mesh is self]
+        o = np.array([ray.o.x, ray.o.y, ray.o.z])
+        d = np.array([ray.d.x, ray.d.y, ray.d.z])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1 / np.where(d == 0, 1e-30, d)
+            t1 = (self.chunk_lo - o) * inverse
+            t2 = (self.chunk_hi - o) * inverse
+        near = np.minimum(t1, t2).max(axis=1)
+        far = np.maximum(t1, t2).min(axis=1)
+        candidates = np.nonzero(far >= np.maximum(near, 0))[0]
+
+        best = np.inf
+        face = -1
+        uv = None
+        for chunk in candidates[np.argsort(near[candidates])]:
+            if near[chunk] > best:
+                break
+            start = chunk * CHUNK
+            t, u, v = moller_trumbore(o, d, self.p0[start:start + CHUNK], self.e1[start:start + CHUNK],
+                                      self.e2[start:start + CHUNK])
+            for index in ignored:
+                if start <= index < start + len(t):
+                    t[index - start] = np.inf
+            i = int(np.argmin(t))
+            if t[i] < best:
+                best = float(t[i])
+                face = start + i
+                uv = (float(u[i]), float(v[i]))
+
+        if face < 0:
+            return Intersection(ZERO, -1, ZERO, self)
+        n = self.normals[face]
+        if n @ d > 0:
+            n = -n
+        return Intersection(ray.o.add_scaled(ray.d, best), best, Vector(*map(float, n)), Face(self, face), uv)
+
+    def occluded(self, ray, max_distance=None, to_ignore=(), skip_refractive=True):
+        if skip_refractive and self.refractive:
+            return None
+        hit = self.test_ray(ray, to_ignore)
+        if hit.d > 0 and (max_distance is None or hit.d < max_distance):
+            return hit.obj
+        return None
+
+
+class Face:
+    # what a hit on a mesh reports as its object: the mesh's material, and which face was hit, so that
+    # rays leaving the face ignore that face and not the whole mesh
+    __slots__ = ('mesh', 'index')
+
+    def __init__(self, mesh, index):
+        self.mesh = mesh
+        self.index = index
+
+    def __getattr__(self, name):
+        if name in Face.__slots__:
+            raise AttributeError(name)
+        return getattr(self.mesh, name)
+
+    def __eq__(self, other):
+        return type(other) is Face and other.mesh is self.mesh and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.mesh), self.index))
+
+    def __repr__(self):
+        return 'Face[{} of {}]'.format(self.index, self.mesh)
+
+
+def moller_trumbore(o, d, p0, e1, e2):
+    p = np.cross(d, e2)
+    det = np.einsum('ij,ij->i', e1, p)
+    valid = np.abs(det) >= DET_EPS
+    inv_det = 1 / np.where(valid, det, 1)
+    s = o - p0
+    u = np.einsum('ij,ij->i', s, p) * inv_det
+    q = np.cross(s, e1)
+    v = (q @ d) * inv_det
+    t = np.einsum('ij,ij->i', e2, q) * inv_det
+    hit = valid & (u >= -EDGE_EPS) & (v >= -EDGE_EPS) & (u + v <= 1 + EDGE_EPS) & (t > 0)
+    return np.where(hit, t, np.inf), u, v
+
+
+def transform(vertices, center, coef, rotation):
+    # same as vector.rot, including its rotz
+    dx, dy, dz = rotation
+    cx, sx = np.cos(dx), np.sin(dx)
+    cy, sy = np.cos(dy), np.sin(dy)
+    cz, sz = np.cos(dz), np.sin(dz)
+    rx = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    ry = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    rz = np.array([[cz, -sz, 0], [-sz, cz, 0], [0, 0, 1]])
+    matrix = rz @ ry @ rx
+    return (vertices * coef) @ matrix.T + np.array([center.x, center.y, center.z])
+
+
+def morton_codes(points):
+    if not len(points):
+        return np.zeros(0, dtype=np.int64)
+    lo = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - lo, 1e-12)
+    cells = ((points - lo) / extent * 1023).astype(np.int64)
+    code = np.zeros(len(points), dtype=np.int64)
+    for axis in range(3):
+        code |= spread_bits(cells[:, axis]) << axis
+    return code
+
+
+def spread_bits(x):
+    x = (x | (x << 16)) & 0x030000FF
+    x = (x | (x << 8)) & 0x0300F00F
+    x = (x | (x << 4)) & 0x030C30C3
+    x = (x | (x << 2)) & 0x09249249
+    return x
+
+
+def load_mesh(path, cache=True):
+    cache_dir = path + CACHE_SUFFIX
+    stamp = source_stamp(path)
+    if cache and os.path.isdir(cache_dir):
+        try:
+            with open(os.path.join(cache_dir, 'stamp.json')) as fin:
+                if json.load(fin) == stamp:
+                    return (np.load(os.path.join(cache_dir, 'vertices.npy'), mmap_mode='r'),
+                            np.load(os.path.join(cache_dir, 'faces.npy'), mmap_mode='r'))
+        except (OSError, ValueError):
+            pass
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.obj':
+        vertices, faces = load_obj(path)
+    elif extension == '.ply':
+        vertices, faces = load_ply(path)
+    else:
+        vertices, faces = load_model_text(path)
+
+    if cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(os.path.join(cache_dir, 'vertices.npy'), vertices)
+        np.save(os.path.join(cache_dir, 'faces.npy'), faces)
+        with open(os.path.join(cache_dir, 'stamp.json'), 'w') as fout:
+            json.dump(stamp, fout)
+    return vertices, faces
+
+
+def source_stamp(path):
+    info = os.stat(path)
+    return [info.st_size, info.st_mtime_ns]
+
+
+def read_blocks(path):
+    with open(path, 'rb') as fin:
+        while True:
+            lines = fin.readlines(BLOCK_LINES * 32)
+            if not lines:
+                return
+            yield lines
+
+
+def fan(polygons):
+    # polygons: lists of vertex indices, fan-triangulated around their first vertex
+    faces = []
+    by_size = {}
+    for polygon in polygons:
+        by_size.setdefault(len(polygon), []).append(polygon)
+    for size, group in by_size.items():
+        if size < 3:
+            continue
+        group = np.array(group, dtype=np.int64)
+        for i in range(1, size - 1):
+            faces.append(group[:, [0, i, i + 1]])
+    if not faces:
+        return np.zeros((0, 3), dtype=np.int32)
+    return np.concatenate(faces).astype(np.int32)
+
+
+def load_obj(path):
+    vertex_blocks = []
+    face_blocks = []
+    vertex_count = 0
+    for lines in read_blocks(path):
+        vertex_lines = [line for line in lines if line.startswith(b'v ')]
+        face_lines = [line for line in lines if line.startswith(b'f ')]
+        if vertex_lines:
+            block = parse_numbers(vertex_lines, np.float64, 3)
+            if block is None:
+                block = np.array([line.split()[1:4] for line in vertex_lines], dtype=np.float64)
+            vertex_blocks.append(block)
+        if face_lines:
+            block = None
+            if all(b'/' not in line for line in face_lines):
+                block = parse_numbers(face_lines, np.int64, 3)
+            if block is not None and (block > 0).all():
+                face_blocks.append(block - 1)
+            else:
+                face_blocks.append(parse_faces(lines, vertex_count))
+        vertex_count += len(vertex_lines)
+
+    vertices = np.concatenate(vertex_blocks) if vertex_blocks else np.zeros((0, 3))
+    faces = np.concatenate(face_blocks).astype(np.int32) if face_blocks else np.zeros((0, 3), dtype=np.int32)
+    return vertices, faces
+
+
+def parse_numbers(lines, dtype, width):
+    # fast path for blocks where every line holds exactly 'width' plain numbers
+    data = np.fromstring(b' '.join(line[2:] for line in lines), dtype=dtype, sep=' ')
+    if data.size != len(lines) * width:
+        return None
+    return data.reshape(-1, width)
+
+
+def parse_faces(lines, vertex_count):
+    polygons = []
+    for line in lines:
+        if line.startswith(b'v '):
+            vertex_count += 1
+        elif line.startswith(b'f '):
+            polygon = []
+            for token in line.split()[1:]:
+                index = int(token.split(b'/', 1)[0])
+                polygon.append(index - 1 if index > 0 else vertex_count + index)
+            polygons.append(polygon)
+    return fan(polygons)
+
+
+def load_ply(path):
+    with open(path, 'rb') as fin:
+        if fin.readline().strip() != b'ply':
+            raise ValueError('{} is not a PLY file'.format(path))
+        fmt = None
+        elements = []
+        while True:
+            line = fin.readline()
+            if not line:
+                raise ValueError('{} has no end_header'.format(path))
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == b'format':
+                fmt = words[1].decode()
+            elif words[0] == b'element':
+                elements.append((words[1].decode(), int(words[2]), []))
+            elif words[0] == b'property':
+                elements[-1][2].append([word.decode() for word in words[1:]])
+            elif words[0] == b'end_header':
+                break
+
+        vertices = np.zeros((0, 3))
+        faces = np.zeros((0, 3), dtype=np.int32)
+        for name, count, properties in elements:
+            if fmt == 'ascii':
+                rows = [fin.readline().split() for _ in range(count)]
+                if name == 'vertex':
+                    names = [p[-1] for p in properties]
+                    columns = [names.index(axis) for axis in ('x', 'y', 'z')]
+                    vertices = np.array([[float(row[c]) for c in columns] for row in rows])
+                elif name == 'face':
+                    faces = fan([[int(i) for i in row[1:1 + int(row[0])]] for row in rows])
+            else:
+                endian = '<' if fmt == 'binary_little_endian' else '>'
+                if name == 'face':
+                    faces = read_binary_faces(fin, count, properties[0], endian)
+                else:
+                    dtype = np.dtype([(p[-1], endian + PLY_TYPES[p[0]]) for p in properties])
+                    data = np.fromfile(fin, dtype=dtype, count=count)
+                    if name == 'vertex':
+                        vertices = np.stack([data['x'], data['y'], data['z']], axis=1).astype(np.float64)
+    return vertices, faces
+
+
+PLY_TYPES = {
+    'char': 'i1', 'uchar': 'u1', 'short': 'i2', 'ushort': 'u2', 'int': 'i4', 'uint': 'u4',
+    'float': 'f4', 'double': 'f8', 'int8': 'i1', 'uint8': 'u1', 'int16': 'i2', 'uint16': 'u2',
+    'int32': 'i4', 'uint32': 'u4', 'float32': 'f4', 'float64': 'f8',
+}
+
+
+def read_binary_faces(fin, count, prop, endian):
+    # 'list <count type> <index type> vertex_indices'; all-triangle meshes are read in one go
+    count_type = np.dtype(endian + PLY_TYPES[prop[1]])
+    index_type = np.dtype(endian + PLY_TYPES[prop[2]])
+    start = fin.tell()
+    triangles = np.dtype([('n', count_type), ('i', index_type, 3)])
+    data = np.fromfile(fin, dtype=triangles, count=count)
+    if len(data) == count and (data['n'] == 3).all():
+        return data['i'].astype(np.int32)
+
+    fin.seek(start)
+    polygons = []
+    for _ in range(count):
+        n = int(np.fromfile(fin, dtype=count_type, count=1)[0])
+        polygons.append(np.fromfile(fin, dtype=index_type, count=n).tolist())
+    return fan(polygons)
+
+
+def load_model_text(path):
+    # the 'p x y z' / 'l i j k ...' format of Model, with the same flipped y
+    vertices = []
+    polygons = []
+    for lines in read_blocks(path):
+        for line in lines:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == b'p':
+                x, y, z = map(float, words[1:4])
+                vertices.append((x, -y, z))
+            elif words[0] == b'l':
+                polygons.append([int(index) - 1 for index in words[1:]])
+    return np.array(vertices, dtype=np.float64).reshape(-1, 3), fan(polygons)
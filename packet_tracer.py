@@ -0,0 +1,311 @@
+import numpy as np
+
+from ray_tracer import (EPS, DET_EPS, EDGE_EPS, AMBIENT, BACKGROUND, MAG, DISTANT, Sphere, Plane, Triangle,
+                        encode_colors)
+
+
+PACKET_SIZE = 1 << 16
+
+SPHERE = 0
+PLANE = 1
+TRIANGLE = 2
+
+
+def to_array(vec):
+    return np.array([vec.x, vec.y, vec.z], dtype=np.float64)
+
+
+def dot(a, b):
+    return np.einsum('ij,ij->i', a, b)
+
+
+def normalize(a):
+    length = np.sqrt(dot(a, a))
+    length[length == 0] = 1
+    return a / length[:, None]
+
+
+class PacketScene:
+    def __init__(self, objects, lights):
+        self.objects = list(objects)
+        self.lights = list(lights)
+
+        count = len(self.objects)
+        self.color = np.zeros((count, 3))
+        self.reflective = np.zeros(count)
+        self.refractive = np.zeros(count)
+        self.refractive_coef = np.ones(count)
+        self.constant_color = np.zeros(count, dtype=bool)
+        self.texture_index = np.full(count, -1, dtype=np.int64)
+        self.textures = []
+
+        self.shapes = []
+        for i, obj in enumerate(self.objects):
+            self.color[i] = to_array(obj.color)
+            self.reflective[i] = obj.reflective
+            self.refractive[i] = obj.refractive
+            self.refractive_coef[i] = obj.refractive_coef
+            self.constant_color[i] = obj.properties.constant_color
+            texture = obj.texture
+            if texture is not None:
+                if texture not in self.textures:
+                    self.textures.append(texture)
+                self.texture_index[i] = self.textures.index(texture)
+
+            if isinstance(obj, Sphere):
+                self.shapes.append((i, SPHERE, (to_array(obj.c), float(obj.r))))
+            elif isinstance(obj, Plane):
+                self.shapes.append((i, PLANE, (to_array(obj.p), to_array(obj.n))))
+            elif isinstance(obj, Triangle):
+                self.shapes.append((i, TRIANGLE, (to_array(obj.p1), to_array(obj.e1), to_array(obj.e2),
+                                                  to_array(obj.normal))))
+            else:
+                raise TypeError('Packet backend does not support {}'.format(type(obj).__name__))
+
+    def intersect(self, o, d, to_ignore=None, skip_refractive=False):
+        count = len(o)
+        best = np.full(count, -1.0)
+        index = np.full(count, -1, dtype=np.int64)
+        for i, kind, data in self.shapes:
+            if skip_refractive and self.refractive[i]:
+                continue
+            if kind == SPHERE:
+                t = intersect_spheres(o, d, *data)
+            elif kind == PLANE:
+                t = intersect_planes(o, d, *data)
+            else:
+                t = intersect_triangles(o, d, *data)
+            closer = (t > 0) & ((index < 0) | (t < best))
+            if to_ignore is not None:
+                closer &= to_ignore != i
+            best[closer] = t[closer]
+            index[closer] = i
+        return best, index
+
+    def normals(self, o, d, t, index):
+        point = o + d * t[:, None]
+        normal = np.zeros_like(point)
+        for i, kind, data in self.shapes:
+            mask = index == i
+            if not mask.any():
+                continue
+            if kind == SPHERE:
+                normal[mask] = normalize(point[mask] - data[0])
+            else:
+                n = data[1] if kind == PLANE else data[3]
+                # two-sided: the normal always faces the incoming ray
+                cs = d[mask] @ n
+                normal[mask] = np.where(cs[:, None] > 0, -n, n)
+        return point, normal
+
+    def trace(self, o, d, depth):
+        color = np.tile(to_array(BACKGROUND), (len(o), 1))
+        if not depth:
+            return color
+
+        t, index = self.intersect(o, d)
+        hit = np.nonzero(index >= 0)[0]
+        if not len(hit):
+            return color
+        o, d, t, index = o[hit], d[hit], t[hit], index[hit]
+
+        constant = self.constant_color[index]
+        color[hit[constant]] = self.color[index[constant]]
+        shade = ~constant
+        if shade.any():
+            point, normal = self.normals(o[shade], d[shade], t[shade], index[shade])
+            color[hit[shade]] = self.shade(d[shade], point, normal, index[shade], depth, t[shade])
+        return color
+
+    def shade(self, d, point, normal, index, depth, distance):
+        color = self.color[index].copy()
+        texture_index = self.texture_index[index]
+        for i, texture in enumerate(self.textures):
+            mask = texture_index == i
+            if mask.any():
+                color[mask] = texture.colors(color[mask], point[mask], distance[mask])
+
+        light_effect = np.zeros_like(point)
+        for light in self.lights:
+            light_effect += self.light_effect(light, point, normal, index)
+
+        reflective = self.reflective[index]
+        refractive = self.refractive[index]
+        reflected_color = np.zeros_like(point)
+        refracted_color = np.zeros_like(point)
+
+        mask = reflective != 0
+        if mask.any():
+            n = normal[mask]
+            reflected = normalize(d[mask] - n * 2 * dot(d[mask], n)[:, None])
+            reflected_color[mask] = self.trace(point[mask] + reflected * EPS, reflected, depth - 1)
+            reflected_color[mask] *= reflective[mask, None]
+
+        mask = refractive != 0
+        if mask.any():
+            n = normal[mask]
+            rd = d[mask]
+            cs = dot(rd, n)
+            inside = cs >= 0
+            n = np.where(inside[:, None], -n, n)
+            cs = np.abs(cs)
+            coef = self.refractive_coef[index[mask]]
+            ratio = np.where(inside, coef, 1 / coef)
+            k = 1 - ratio * ratio * (1 - cs * cs)
+            passing = k >= 0
+            if passing.any():
+                ratio, cs, k = ratio[passing], cs[passing], k[passing]
+                refracted = rd[passing] * ratio[:, None] + n[passing] * (ratio * cs - np.sqrt(k))[:, None]
+                origin = point[mask][passing] + refracted * EPS
+                rows = np.nonzero(mask)[0][passing]
+                refracted_color[rows] = self.trace(origin, refracted, depth - 1)
+
+        color *= light_effect * ((1 - refractive) * (1 - reflective))[:, None]
+        color += reflected_color + refracted_color * refractive[:, None]
+        return color
+
+    def light_effect(self, light, point, normal, index):
+        light_color = to_array(light.color)
+        if light.type == MAG:
+            p_o = to_array(light.o) - point
+            length = np.sqrt(dot(p_o, p_o))
+            direction = normalize(p_o)
+
+            t, blocker = self.intersect(point + direction, direction, index, skip_refractive=True)
+            shadowed = (blocker >= 0) & (t < length)
+
+            reflection_coef = self.reflective[index]
+            with np.errstate(divide='ignore'):
+                intensity = light.distance_coef / (12.5 * length ** (2 - reflection_coef / 5))
+            cs = dot(normal, direction)
+            power = cs * intensity
+            lit = power > AMBIENT
+            power = np.where(lit, power, AMBIENT)
+            power[lit] += reflection_coef[lit] * cs[lit] ** (100 * reflection_coef[lit])
+
+            effect = light_color * power[:, None]
+            effect[shadowed] = 0
+            effect[length == 0] = light_color
+            return effect
+
+        elif light.type == DISTANT:
+            direction = -to_array(light.o.normal())
+            t, blocker = self.intersect(point + direction * 0.0001, np.tile(direction, (len(point), 1)), index)
+            effect = light_color * (-(normal @ to_array(light.o)))[:, None]
+            effect[blocker >= 0] = 0
+            return effect
+
+        return np.zeros_like(point)
+
+
+def intersect_spheres(o, d, c, r):
+    c_o = o - c
+    b = -dot(d, c_o)
+    discriminant = r ** 2 - (dot(c_o, c_o) - b ** 2)
+    root = np.sqrt(np.maximum(discriminant, 0))
+    d1 = b - root
+    d2 = b + root
+    t = np.where((d1 > 0) & ((d2 > d1) | (d2 < 0)), d1,
+                 np.where((d2 > 0) & ((d1 > d2) | (d1 < 0)), d2, -1.0))
+    t[discriminant < 0] = -1
+    return t
+
+
+def intersect_planes(o, d, p, n):
+    cs = d @ n
+    parallel = np.abs(cs) < EPS
+    cs[parallel] = 1
+    t = (p - o) @ n / cs
+    t[parallel] = -1
+    return t
+
+
+def intersect_triangles(o, d, p1, e1, e2, n):
+    p = np.cross(d, e2)
+    det = p @ e1
+    valid = np.abs(det) >= DET_EPS
+    inv_det = 1 / np.where(valid, det, 1)
+    s = o - p1
+    u = dot(s, p) * inv_det
+    q = np.cross(s, e1)
+    v = dot(d, q) * inv_det
+    t = q @ e2 * inv_det
+    hit = valid & (u >= -EDGE_EPS) & (u <= 1 + EDGE_EPS) & (v >= -EDGE_EPS) & (u + v <= 1 + EDGE_EPS) & (t > 0)
+    return np.where(hit, t, -1.0)
+
+
+def primary_rays(camera, box=None):
+    x0, y0, x1, y1 = box or (0, 0, camera.res_x, camera.res_y)
+    # matches render_image, which calls camera.get_ray(y, x)
+    rows = np.arange(y0, y1, dtype=np.float64)[:, None, None]
+    cols = np.arange(x0, x1, dtype=np.float64)[None, :, None]
+    d = ray_directions(camera, rows, cols)
+    return d / np.linalg.norm(d, axis=2)[:, :, None]
+
+
+def ray_directions(camera, rows, cols):
+    # unnormalized directions of camera.get_ray(rows, cols), the arrays need a trailing axis of 1
+    dx = to_array(camera.ort1) * rows * camera.w / camera.res_x
+    dy = to_array(camera.ort2) * cols * camera.h / camera.res_y
+    return to_array(camera.left_upper) - dx - dy
+
+
+def sampled_rays(camera, sampler, indices):
+    # directions of every sample of the pixels, sample by sample for each pixel, and the filter weights
+    dy, dx, weights = sampler.offset_arrays(indices)
+    rows = (indices // camera.res_x)[:, None] + dy
+    cols = (indices % camera.res_x)[:, None] + dx
+    d = ray_directions(camera, rows[:, :, None], cols[:, :, None]).reshape(-1, 3)
+    return d / np.linalg.norm(d, axis=1)[:, None], weights
+
+
+def filter_samples(colors, weights):
+    # the weighted sum in the order sample_pixel adds them up, so both backends round alike
+    colors = colors.reshape(len(weights), -1, 3)
+    color = np.zeros((len(weights), 3))
+    total = np.zeros(len(weights))
+    for sample in range(weights.shape[1]):
+        color += colors[:, sample] * weights[:, sample, None]
+        total += weights[:, sample]
+    return color * (1 / total)[:, None]
+
+
+def to_pixels(colors, gamma=1):
+    return encode_colors(colors, gamma)
+
+
+def render_region(scene, camera, depth=2, box=None, verbose=0, packet_size=PACKET_SIZE, gamma=1, hdr=False,
+                  sampler=None):
+    x0, y0, x1, y1 = box or (0, 0, camera.res_x, camera.res_y)
+    shape = (y1 - y0, x1 - x0, 3)
+    origin = to_array(camera.o)
+    if sampler is None:
+        directions = primary_rays(camera, box).reshape(-1, 3)
+        step = packet_size
+    else:
+        indices = (np.arange(y0, y1)[:, None] * camera.res_x + np.arange(x0, x1)[None, :]).reshape(-1)
+        # a packet holds every sample of its pixels, which are filtered down right after
+        step = max(packet_size // sampler.samples, 1)
+    count = shape[0] * shape[1]
+    colors = np.empty((count, 3))
+    for start in range(0, count, step):
+        if verbose:
+            print(start / count)
+        if sampler is None:
+            d = directions[start:start + step]
+        else:
+            d, weights = sampled_rays(camera, sampler, indices[start:start + step])
+        o = np.tile(origin, (len(d), 1))
+        packet = scene.trace(o, d, depth)
+        colors[start:start + step] = packet if sampler is None else filter_samples(packet, weights)
+    if verbose:
+        print('1.0')
+    if hdr:
+        return colors.astype(np.float32).reshape(shape)
+    return to_pixels(colors, gamma).reshape(shape)
+
+
+def render_pixels(camera, objects, lights, depth=2, verbose=0, packet_size=PACKET_SIZE, gamma=1, hdr=False,
+                  sampler=None):
+    return render_region(PacketScene(objects, lights), camera, depth, None, verbose, packet_size, gamma, hdr,
+                         sampler)
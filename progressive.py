@@ -0,0 +1,68 @@
+from ray_tracer import trace, color_bytes, image_from_buffer
+
+
+STEPS = (8, 4, 2, 1)
+THRESHOLD = 0.1
+# sub-pixel offsets added next to the pixel's own (0, 0) sample in the adaptive pass
+SUBSAMPLES = ((0.5, 0), (0, 0.5), (0.5, 0.5))
+
+
+def fill_block(buffer, res_x, res_y, x, y, size, pixel):
+    width = min(size, res_x - x)
+    row = pixel * width
+    for block_y in range(y, min(y + size, res_y)):
+        start = (block_y * res_x + x) * 3
+        buffer[start:start + width * 3] = row
+
+
+def progressive_passes(camera, objects, lights, depth=2, steps=STEPS, threshold=THRESHOLD, subsamples=SUBSAMPLES,
+                       pygame_mode=False):
+    res_x = camera.res_x
+    res_y = camera.res_y
+    colors = [None] * (res_x * res_y)
+    buffer = bytearray(res_x * res_y * 3)
+
+    for step in steps:
+        for y in range(0, res_y, step):
+            for x in range(0, res_x, step):
+                index = y * res_x + x
+                if colors[index] is None:
+                    colors[index] = trace(camera.get_ray(y, x), objects, lights, depth)
+                fill_block(buffer, res_x, res_y, x, y, step, color_bytes(colors[index]))
+        yield image_from_buffer(bytes(buffer), res_x, res_y, pygame_mode)
+
+    if steps[-1] != 1 or not subsamples:
+        return
+
+    refine = []
+    for y in range(res_y):
+        for x in range(res_x):
+            color = colors[y * res_x + x]
+            for nx, ny in ((x + 1, y), (x, y + 1)):
+                if nx < res_x and ny < res_y and differs(color, colors[ny * res_x + nx], threshold):
+                    refine.append((x, y))
+                    refine.append((nx, ny))
+    refine = sorted(set(refine), key=lambda p: (p[1], p[0]))
+    if not refine:
+        return
+
+    for x, y in refine:
+        color = colors[y * res_x + x].copy()
+        for dx, dy in subsamples:
+            color.iadd(trace(camera.get_ray(y + dy, x + dx), objects, lights, depth))
+        color.imul(1 / (len(subsamples) + 1))
+        start = (y * res_x + x) * 3
+        buffer[start:start + 3] = color_bytes(color)
+    yield image_from_buffer(bytes(buffer), res_x, res_y, pygame_mode)
+
+
+def differs(a, b, threshold):
+    return abs(a.x - b.x) > threshold or abs(a.y - b.y) > threshold or abs(a.z - b.z) > threshold
+
+
+def render_progressive(camera, objects, lights, depth=2, callback=None, **kwargs):
+    image = None
+    for index, image in enumerate(progressive_passes(camera, objects, lights, depth, **kwargs)):
+        if callback:
+            callback(image, index)
+    return image
@@ -0,0 +1,137 @@
+from collections import Counter
+from time import perf_counter
+
+import numpy as np
+
+
+PRIMARY = 'primary'
+SHADOW = 'shadow'
+REFLECTION = 'reflection'
+REFRACTION = 'refraction'
+RAY_KINDS = (PRIMARY, SHADOW, REFLECTION, REFRACTION)
+
+
+class RayStats:
+    # pass one to render_image(stats=...) to count what a frame does; while it is attached every
+    # object gets a counting intersect, so nothing is paid for it when no collector is passed
+    def __init__(self):
+        self.rays = dict.fromkeys(RAY_KINDS, 0)
+        self.depths = Counter()
+        self.tests = Counter()
+        self.hits = Counter()
+        self.nearest = Counter()
+        self.total_internal_reflections = 0
+        self.max_depth = 0
+        self.res_x = 0
+        self.res_y = 0
+        self.cost = []
+        self.objects = []
+        self.container = None
+        self.lights = []
+        self.pixel_tests = 0
+        self.total_tests = 0
+
+    def start(self, camera, objects, lights, depth):
+        self.max_depth = depth
+        self.res_x = camera.res_x
+        self.res_y = camera.res_y
+        self.cost = [0] * (camera.res_x * camera.res_y)
+        self.objects = list(objects)
+        # a BVH tests its leaves through compiled records, which never call the counting intersect
+        self.container = objects if hasattr(objects, 'plain') else None
+        if self.container is not None:
+            self.container.plain = True
+        self.lights = list(lights)
+        for light in self.lights:
+            light.reset_counters()
+        for obj in self.objects:
+            obj.intersect = self.counting(obj, obj.intersect)
+
+    def counting(self, obj, intersect):
+        def counted(ray):
+            self.total_tests += 1
+            self.tests[obj] += 1
+            intersection = intersect(ray)
+            if intersection.d > 0:
+                self.hits[obj] += 1
+            return intersection
+        return counted
+
+    def stop(self):
+        for obj in self.objects:
+            del obj.intersect
+        if self.container is not None:
+            self.container.plain = False
+        self.rays[SHADOW] += sum(light.shadow_rays for light in self.lights)
+
+    def pixel(self, x, y, rays=1):
+        self.rays[PRIMARY] += rays
+        self.cost[y * self.res_x + x] = self.total_tests - self.pixel_tests
+        self.pixel_tests = self.total_tests
+
+    def ray(self, kind):
+        self.rays[kind] += 1
+
+    def ray_done(self, kind):
+        # the branch ray(kind) announced is traced, for collectors that time the kinds
+        pass
+
+    def heatmap(self, scale=None):
+        # intersection tests per pixel, black through red and yellow to white at scale (the busiest pixel)
+        from image_output import to_pil
+
+        scale = scale or max(self.cost) or 1
+        data = bytearray()
+        for cost in self.cost:
+            level = min(cost / scale, 1) * 3
+            data += bytes((int(min(level, 1) * 255), int(min(max(level - 1, 0), 1) * 255),
+                           int(min(max(level - 2, 0), 1) * 255)))
+        return to_pil(bytes(data), self.res_x, self.res_y)
+
+    def report(self, top=10):
+        pixels = len(self.cost) or 1
+        total = sum(self.rays.values())
+        lines = ['{} rays, {:.2f} per pixel'.format(total, total / pixels)]
+        for kind in RAY_KINDS:
+            lines.append('{:>12}: {}'.format(kind, self.rays[kind]))
+        lines.append('total internal reflections: {}'.format(self.total_internal_reflections))
+        lines.append('rays by recursion level: {}'.format(
+            ', '.join('{}: {}'.format(self.max_depth - depth, self.depths[depth])
+                      for depth in sorted(self.depths, reverse=True))))
+        lines.append('{} intersection tests, {:.1f} per pixel'.format(self.total_tests, self.total_tests / pixels))
+        # hits on a mesh are reported per face
+        nearest = Counter()
+        for obj, count in self.nearest.items():
+            nearest[getattr(obj, 'mesh', obj)] += count
+        for obj, tests in self.tests.most_common(top):
+            lines.append('{:>8} tests {:>8} hits {:>8} nearest  {}'.format(
+                tests, self.hits[obj], nearest[obj], describe(obj, self.objects)))
+        return '\n'.join(lines)
+
+
+def describe(obj, objects):
+    return '#{} {}'.format(objects.index(obj), type(obj).__name__)
+
+
+def termination_report(camera, objects, lights, depth, termination):
+    # renders the frame with and without path termination and sets the rays saved against the error
+    from ray_tracer import render_image
+
+    results = []
+    for current in (None, termination):
+        stats = RayStats()
+        start = perf_counter()
+        image = render_image(camera, objects, lights, depth, 0, stats=stats, termination=current)
+        results.append((np.asarray(image, dtype=np.int16), sum(stats.rays.values()), perf_counter() - start))
+
+    (full, full_rays, full_time), (cut, cut_rays, cut_time) = results
+    diff = np.abs(full - cut)
+    mse = np.mean(diff.astype(np.float64) ** 2)
+    psnr = 10 * np.log10(255 ** 2 / mse) if mse else float('inf')
+    return '\n'.join([
+        'rays: {} -> {} ({:.1%} saved), {} branches cut, {} ended by roulette'.format(
+            full_rays, cut_rays, 1 - cut_rays / full_rays, termination.cut, termination.killed),
+        'time: {:.2f}s -> {:.2f}s'.format(full_time, cut_time),
+        'difference: mean {:.3f}, max {}, {:.2%} of pixels changed, PSNR {:.1f} dB'.format(
+            diff.mean(), diff.max(), np.any(diff, axis=2).mean(), psnr),
+    ])
@@ -1,16 +1,28 @@
-from PIL import Image
-from pygame import Surface
-from vector import *
+from array import array
+from math import sin, sqrt
+from random import Random
+
+import image_output
+from vector import Vector, rot, rotx, roty, rotz
 
 
 EPS = 0.0001
+DET_EPS = 1e-12
+EDGE_EPS = 1e-9
 AMBIENT = 0.1
 BACKGROUND = Vector(AMBIENT, AMBIENT, AMBIENT)
+ZERO = Vector(0, 0, 0)
 MAG = 1
 ANDY = 2
 DISTANT = 3
 FILL = 4
 SQUARED = 5
+BOX = 'box'
+TENT = 'tent'
+GAUSSIAN = 'gaussian'
+# half the width of each reconstruction filter in pixels, samples are spread over the whole filter
+FILTER_RADIUS = {BOX: 0.5, TENT: 1, GAUSSIAN: 1.5}
+GAUSSIAN_ALPHA = 2
 
 
 def sign(x):
@@ -25,6 +37,8 @@ def g(x, y, z):
 
 
 class Ray:
+    __slots__ = ('o', 'd')
+
     def __init__(self, origin, direction):
         self.o = origin
         self.d = direction
@@ -35,7 +49,7 @@ class Ray:
 
 class Properties:
     def __init__(self, color=Vector(0, 0, 0), reflective=0, refractive=0, refractive_coef=1, type=FILL, scale=1,
-                 rotation=(0, 0, 0), constant_color=False):
+                 rotation=(0, 0, 0), constant_color=False, texture=None):
         self.color = color
         self.reflective = reflective
         self.refractive = refractive
@@ -44,6 +58,15 @@ class Properties:
         self.scale = scale
         self.rotation = rotation
         self.constant_color = constant_color
+        # any textures.Texture, see plane_texture for SQUARED
+        self.texture = texture
+
+    def plane_texture(self):
+        # on planes SQUARED is a shorthand for textures.Squared(scale), other objects leave it alone
+        if self.texture is None and self.type == SQUARED:
+            from textures import Squared
+            return Squared(self.scale)
+        return self.texture
 
     def cp(self):
         return Properties(self.color,
@@ -53,7 +76,8 @@ class Properties:
                           self.type,
                           self.scale,
                           self.rotation,
-                          self.constant_color)
+                          self.constant_color,
+                          self.texture)
 
 
 class Sphere:
@@ -66,6 +90,8 @@ class Sphere:
         self.reflective = props.reflective
         self.refractive_coef = props.refractive_coef
         self.refractive = props.refractive
+        self.constant_color = props.constant_color
+        self.texture = props.texture
         self.properties = props
 
     def update_properties(self, properties=None):
@@ -78,50 +104,61 @@ class Sphere:
         self.reflective = props.reflective
         self.refractive_coef = props.refractive_coef
         self.refractive = props.refractive
+        self.constant_color = props.constant_color
+        self.texture = props.texture
         self.properties = props
     
     def intersect(self, ray):
-        c_o = ray.o - self.c
+        o = ray.o
+        direction = ray.d
+        c_o_x = o.x - self.c.x
+        c_o_y = o.y - self.c.y
+        c_o_z = o.z - self.c.z
+        b = -(direction.x * c_o_x + direction.y * c_o_y + direction.z * c_o_z)
         r_ = self.r  # modify this for weird forms of sphere
-        discriminant = r_ ** 2 - (c_o.dot(c_o) - ray.d.dot(c_o) ** 2)
+        discriminant = r_ ** 2 - ((c_o_x * c_o_x + c_o_y * c_o_y + c_o_z * c_o_z) - b ** 2)
         if discriminant < 0:
-            return Intersection(Vector(0, 0, 0), -1, Vector(0, 0, 0), self)
+            return Intersection(ZERO, -1, ZERO, self)
         else:
-            b = -ray.d.dot(c_o)
-            d1 = b - sqrt(discriminant)
-            d2 = b + sqrt(discriminant)
+            root = sqrt(discriminant)
+            d1 = b - root
+            d2 = b + root
             
             if d1 > 0 and (d2 > d1 or d2 < 0):
                 d = d1
             elif d2 > 0 and (d1 > d2 or d1 < 0):
                 d = d2
             else:
-                return Intersection(Vector(0, 0, 0), -1, Vector(0, 0, 0), self)
+                return Intersection(ZERO, -1, ZERO, self)
 
-            point = ray.o + ray.d * d
-            intersection = Intersection(point, d, self.normal(point), self)
-            return intersection
+            point = o.add_scaled(direction, d)
+            return Intersection(point, d, self.c.direction_to(point), self)
     
     def normal(self, other):
-        return (other - self.c).normal()
+        return self.c.direction_to(other)
+
+    def bounds(self):
+        r = Vector(self.r, self.r, self.r)
+        return self.c - r, self.c + r
 
 
 class Plane:
     def __init__(self, point, normal, properties):
         self.p = point
         self.n = normal
+        self.back_normal = normal * -1
 
         props = properties
         self.color = props.color
         self.reflective = props.reflective
         self.refractive_coef = props.refractive_coef
         self.refractive = props.refractive
+        self.constant_color = props.constant_color
+        self.texture = props.plane_texture()
         self.type = props.type
         self.scale = props.scale
         self.properties = props
 
-        self.stable_normal = False
-
     def update_properties(self, properties=None):
         if properties:
             props = properties
@@ -132,6 +169,8 @@ class Plane:
         self.reflective = props.reflective
         self.refractive_coef = props.refractive_coef
         self.refractive = props.refractive
+        self.constant_color = props.constant_color
+        self.texture = props.plane_texture()
         self.type = props.type
         self.scale = props.scale
         self.properties = props
@@ -139,20 +178,18 @@ class Plane:
     def __repr__(self):
         return 'Plane[{}, {}]'.format(self.p, self.n)
 
-    def intersect(self, ray, stabilized=False):
-        cs = self.n.dot(ray.d)
-        if abs(cs) < EPS or cs > 0:
-            if self.stable_normal or stabilized:
-                return Intersection(Vector(0, 0, 0), -1, Vector(0, 0, 0), self)
-            else:
-                self.n *= -1
-                ret = self.intersect(ray, True)
-                if ret.d > 0:
-                    self.stable_normal = True
-                return ret
+    def bounds(self):
+        return None
 
-        cs = (self.p - ray.o).dot(self.n) / cs
-        return Intersection(ray.o + ray.d * cs, cs, self.n, self)
+    def intersect(self, ray):
+        # two-sided, the returned normal faces the ray
+        cs = self.n.dot(ray.d)
+        if abs(cs) < EPS:
+            return Intersection(ZERO, -1, ZERO, self)
+        d = self.p.sub_dot(ray.o, self.n) / cs
+        if d <= 0:
+            return Intersection(ZERO, -1, ZERO, self)
+        return Intersection(ray.o.add_scaled(ray.d, d), d, self.n if cs < 0 else self.back_normal, self)
 
 
 class Triangle:
@@ -160,19 +197,23 @@ class Triangle:
         self.p1 = p1
         self.p2 = p2
         self.p3 = p3
-        self.normal = (p2-p1).cross(p3-p1).normal()
-        self.plane = Plane(p1, self.normal, properties)
+        self.e1 = p2 - p1
+        self.e2 = p3 - p1
+        self.normal = self.e1.cross(self.e2).normal()
+        self.back_normal = self.normal * -1
 
         props = properties
         self.color = props.color
         self.reflective = props.reflective
         self.refractive_coef = props.refractive_coef
         self.refractive = props.refractive
+        self.constant_color = props.constant_color
+        self.texture = props.texture
         self.type = props.type
         self.scale = props.scale
         self.properties = props
         
-        self.square = (p2 - p1).cross(p3 - p1).len() / 2
+        self.square = self.e1.cross(self.e2).len() / 2
 
     def update_properties(self, properties=None):
         if properties:
@@ -184,6 +225,8 @@ class Triangle:
         self.reflective = props.reflective
         self.refractive_coef = props.refractive_coef
         self.refractive = props.refractive
+        self.constant_color = props.constant_color
+        self.texture = props.texture
         self.type = props.type
         self.scale = props.scale
         self.properties = props
@@ -191,39 +234,78 @@ class Triangle:
     def __repr__(self):
         return 'Triangle[{}, {}, {}]'.format(self.p1, self.p2, self.p3)
 
+    def bounds(self):
+        lo = Vector(min(self.p1.x, self.p2.x, self.p3.x) - EPS,
+                    min(self.p1.y, self.p2.y, self.p3.y) - EPS,
+                    min(self.p1.z, self.p2.z, self.p3.z) - EPS)
+        hi = Vector(max(self.p1.x, self.p2.x, self.p3.x) + EPS,
+                    max(self.p1.y, self.p2.y, self.p3.y) + EPS,
+                    max(self.p1.z, self.p2.z, self.p3.z) + EPS)
+        return lo, hi
+
+    def barycentric(self, p):
+        # (u, v) with p = p1 + e1 * u + e2 * v
+        s = p - self.p1
+        d11 = self.e1.dot(self.e1)
+        d12 = self.e1.dot(self.e2)
+        d22 = self.e2.dot(self.e2)
+        s1 = s.dot(self.e1)
+        s2 = s.dot(self.e2)
+        det = d11 * d22 - d12 * d12
+        if det == 0:
+            return -1, -1
+        return (d22 * s1 - d12 * s2) / det, (d11 * s2 - d12 * s1) / det
+
     def is_point_inside(self, p):
-        if abs((p - self.p1).dot(self.plane.n)) > EPS:
-            return False
-        
-        p_p1 = self.p1 - p
-        p_p2 = self.p2 - p
-        p_p3 = self.p3 - p
-        sq = (abs(p_p1.cross(p_p2).len()) + abs(p_p2.cross(p_p3).len()) + abs(p_p3.cross(p_p1).len())) / 2
-        if abs(self.square - sq) > EPS:
+        if abs(p.sub_dot(self.p1, self.normal)) > EPS:
             return False
-        else:
-            return True
+        u, v = self.barycentric(p)
+        return u >= -EDGE_EPS and v >= -EDGE_EPS and u + v <= 1 + EDGE_EPS
     
     def intersect(self, ray):
-        p = self.plane.intersect(ray)
-        if p.d == -1:
-            self.plane.n *= -1
-            p = self.plane.intersect(ray)
-        if p.d < 0:
-            return p
-
-        if self.is_point_inside(p.p):
-            return p
-        else:
-            return Intersection(Vector(0, 0, 0), -1, Vector(0, 0, 0), self)
+        # Moller-Trumbore, nothing on the triangle is modified
+        o = ray.o
+        d = ray.d
+        e1 = self.e1
+        e2 = self.e2
+        p_x = d.y * e2.z - d.z * e2.y
+        p_y = d.z * e2.x - d.x * e2.z
+        p_z = d.x * e2.y - d.y * e2.x
+        det = e1.x * p_x + e1.y * p_y + e1.z * p_z
+        if -DET_EPS < det < DET_EPS:
+            return Intersection(ZERO, -1, ZERO, self)
+        inv_det = 1 / det
+
+        s_x = o.x - self.p1.x
+        s_y = o.y - self.p1.y
+        s_z = o.z - self.p1.z
+        u = (s_x * p_x + s_y * p_y + s_z * p_z) * inv_det
+        if u < -EDGE_EPS or u > 1 + EDGE_EPS:
+            return Intersection(ZERO, -1, ZERO, self)
+
+        q_x = s_y * e1.z - s_z * e1.y
+        q_y = s_z * e1.x - s_x * e1.z
+        q_z = s_x * e1.y - s_y * e1.x
+        v = (d.x * q_x + d.y * q_y + d.z * q_z) * inv_det
+        if v < -EDGE_EPS or u + v > 1 + EDGE_EPS:
+            return Intersection(ZERO, -1, ZERO, self)
+
+        t = (e2.x * q_x + e2.y * q_y + e2.z * q_z) * inv_det
+        if t <= 0:
+            return Intersection(ZERO, -1, ZERO, self)
+        normal = self.normal if d.dot(self.normal) < 0 else self.back_normal
+        return Intersection(o.add_scaled(d, t), t, normal, self, (u, v))
 
 
 class Intersection:
-    def __init__(self, point, distance, normal, obj):
+    __slots__ = ('p', 'd', 'n', 'obj', 'uv')
+
+    def __init__(self, point, distance, normal, obj, uv=None):
         self.p = point
         self.d = distance
         self.n = normal
         self.obj = obj
+        self.uv = uv
     
     def __eq__(self, other):
         return self.p == other.p and self.d == other.d and self.n == other.n and self.obj == other.obj
@@ -242,36 +324,80 @@ class Light:
         self.color = color
         self.type = type
         self.distance_coef = distance_coef
+        self.shadow_rays = 0
+        self.shadow_blocked = 0
+
+    def reset_counters(self):
+        self.shadow_rays = 0
+        self.shadow_blocked = 0
     
-    def calculate_effect(self, point, normal, obj, objects):
+    def shadow_ray(self, point):
+        if self.type == MAG:
+            direction = self.o - point
+            length = direction.len()
+            if length == 0:
+                return None
+            direction.inormal()
+            return Ray(point + direction, direction), length, True
+        elif self.type == DISTANT:
+            p_o = self.o.normal() * -1
+            return Ray(point.add_scaled(p_o, 0.0001), p_o), None, False
+        return None
+
+    def illumination(self, point, normal, obj):
         if self.type == MAG:
-            p_o = self.o - point
-            if p_o.len() == 0:
+            direction = self.o - point
+            length = direction.len()
+            if length == 0:
                 return self.color
-            
-            intersection = test_ray(Ray(point + p_o.normal(), p_o.normal()), objects, [obj])
-            dist = intersection.d            
-            if dist != -1 and dist < p_o.len() and not intersection.obj.refractive:
-                return Vector(0, 0, 0)
-            else:
-                reflection_coef = obj.reflective
-                intensity = self.distance_coef / (12.5 * p_o.len() ** (2 - reflection_coef / 5))
-                power = max(normal.dot(p_o.normal() * intensity), AMBIENT)
-                if power != AMBIENT:
-                    power = power + reflection_coef * normal.dot(p_o.normal()) ** (100 * reflection_coef)
-                return self.color * power
+
+            direction.inormal()
+            reflection_coef = obj.reflective
+            intensity = self.distance_coef / (12.5 * length ** (2 - reflection_coef / 5))
+            power = max(normal.dot(direction * intensity), AMBIENT)
+            if power != AMBIENT:
+                power = power + reflection_coef * normal.dot(direction) ** (100 * reflection_coef)
+            return self.color * power
 
         elif self.type == DISTANT:
-            p_o = self.o.normal() * -1
-            intersection = test_ray(Ray(point + p_o * 0.0001, p_o), objects, [obj])
-            if intersection.d != -1:
+            return self.color * (-self.o.dot(normal))
+        return Vector(0, 0, 0)
+
+    def calculate_effect(self, point, normal, obj, objects):
+        shadow = self.shadow_ray(point)
+        if shadow is not None:
+            ray, max_distance, skip_refractive = shadow
+            self.shadow_rays += 1
+            if occluded(ray, objects, max_distance, (obj,), skip_refractive):
+                self.shadow_blocked += 1
                 return Vector(0, 0, 0)
-            else:
-                return self.color * (-self.o.dot(normal))
+        return self.illumination(point, normal, obj)
+
+
+def occluded(ray, objects, max_distance=None, to_ignore=(), skip_refractive=True):
+    if hasattr(objects, 'occluded'):
+        return objects.occluded(ray, max_distance, to_ignore, skip_refractive)
+    for obj in objects:
+        if obj in to_ignore:
+            continue
+        if hasattr(obj, 'occluded'):
+            # a group, an instance or a BVH, skips the hit object inside it
+            blocker = obj.occluded(ray, max_distance, to_ignore, skip_refractive)
+            if blocker is not None:
+                return blocker
+            continue
+        if skip_refractive and obj.refractive:
+            continue
+        d = obj.intersect(ray).d
+        if d > 0 and (max_distance is None or d < max_distance):
+            return obj
+    return None
 
 
 def test_ray(ray, objects, to_ignore=()):
-    intersection = Intersection(Vector(0, 0, 0), -1, Vector(0, 0, 0), None)
+    if hasattr(objects, 'test_ray'):
+        return objects.test_ray(ray, to_ignore)
+    intersection = Intersection(ZERO, -1, ZERO, None)
     for obj in objects:
         if obj in to_ignore:
             continue
@@ -287,75 +413,259 @@ def get_color(color):
     return tuple(map(lambda x: min(255, int(x * 255)), [color.x, color.y, color.z]))
 
 
-def trace(ray, objects, lights, depth=1):
+def color_bytes(color):
+    return bytes(max(0, c) for c in get_color(color))
+
+
+def encode_colors(colors, gamma=1):
+    # float colors of any shape to uint8, truncated and clamped like get_color and putpixel
+    import numpy as np
+
+    colors = np.asarray(colors, dtype=np.float64)
+    if gamma != 1:
+        colors = np.maximum(colors, 0) ** (1 / gamma)
+    return np.clip(np.trunc(colors * 255), 0, 255).astype(np.uint8)
+
+
+def save_pfm(path, colors):
+    # float32 colors in the portable float map format, which compositors read as linear HDR
+    import numpy as np
+
+    colors = np.asarray(colors, dtype='<f4')
+    height, width = colors.shape[:2]
+    with open(path, 'wb') as fout:
+        fout.write('PF\n{} {}\n-1.0\n'.format(width, height).encode())
+        fout.write(colors[::-1].tobytes())
+
+
+def image_from_buffer(data, res_x, res_y, pygame_mode=False, output=image_output.PIL):
+    return image_output.convert(data, res_x, res_y, image_output.PYGAME if pygame_mode else output)
+
+
+def surface_color(obj, point, distance=0):
+    texture = obj.texture
+    if texture is None:
+        return obj.color
+    return texture.color(obj.color, point, distance)
+
+
+def reflect_ray(ray, intersection):
+    reflected_vector = ray.d.reflect(intersection.n).inormal()
+    return Ray(intersection.p.add_scaled(reflected_vector, EPS), reflected_vector)
+
+
+def refract_ray(ray, intersection):
+    normal = intersection.n
+    cs = ray.d.dot(normal)
+
+    coef_from = 1
+    coef_to = intersection.obj.refractive_coef
+    if cs < 0:
+        cs *= -1
+    else:
+        normal = normal * -1
+        coef_from, coef_to = coef_to, coef_from
+
+    ratio = coef_from / coef_to
+    k = 1 - ratio * ratio * (1 - cs * cs)
+    if k < 0:
+        return None
+    refracted_vector = ray.d.scaled_sum(ratio, normal, ratio * cs - sqrt(k))
+    return Ray(intersection.p.add_scaled(refracted_vector, EPS), refracted_vector)
+
+
+def shade(intersection, light_effect, reflected_color=None, refracted_color=None):
+    obj = intersection.obj
+    color = surface_color(obj, intersection.p, intersection.d)
+
+    # light_effect is a fresh vector, so the final color is accumulated in place
+    color = light_effect.imul(1 - obj.refractive).imul(1 - obj.reflective).imul_vector(color)
+    if reflected_color is not None:
+        color.iadd_scaled(reflected_color, obj.reflective)
+    if refracted_color is not None:
+        color.iadd_scaled(refracted_color, obj.refractive)
+
+    return color  # * abs(g(point.x * COEF, point.y * COEF, point.z * COEF)) visual effects
+
+
+class Termination:
+    # ends secondary branches whose share of the pixel color is too small to matter:
+    # below min_weight a branch is treated like the depth limit, past roulette_depth bounces a branch
+    # lighter than roulette_weight survives with probability weight / roulette_weight and is scaled up
+    def __init__(self, min_weight=0.01, roulette_depth=None, roulette_weight=0.1, seed=0):
+        self.min_weight = min_weight
+        self.roulette_depth = roulette_depth
+        self.roulette_weight = roulette_weight
+        self.seed = seed
+        self.random = Random(seed)
+        self.max_depth = 0
+        self.cut = 0
+        self.killed = 0
+
+    def start(self, depth):
+        self.max_depth = depth
+        self.cut = 0
+        self.killed = 0
+
+    def copy(self):
+        # same settings with a random state of its own, for another thread
+        other = Termination(self.min_weight, self.roulette_depth, self.roulette_weight, self.seed)
+        other.max_depth = self.max_depth
+        return other
+
+    def pixel(self, index):
+        # a seed per pixel keeps the image the same whatever order the pixels are traced in
+        self.random.seed(self.seed * 1000003 + index)
+
+    def branch(self, weight, depth):
+        if weight < self.min_weight:
+            self.cut += 1
+            return None
+        if self.roulette_depth is not None and self.max_depth - depth >= self.roulette_depth \
+                and weight < self.roulette_weight:
+            survival = weight / self.roulette_weight
+            if self.random.random() >= survival:
+                self.killed += 1
+                return 0
+            return 1 / survival
+        return 1
+
+
+M32 = 0xffffffff
+
+
+def mix32(x):
+    # an integer hash that works the same on ints and uint64 arrays
+    x ^= x >> 16
+    x = (x * 0x7feb352d) & M32
+    x ^= x >> 15
+    x = (x * 0x846ca68b) & M32
+    x ^= x >> 16
+    return x
+
+
+class Sampler:
+    # stratified jittered supersampling: samples (rounded to a square) per pixel, one inside each cell of a grid
+    # laid over the filter's footprint and weighted by the filter; the jitter is a hash of the seed, pixel and
+    # sample, so every backend and tile order traces the very same rays
+    def __init__(self, samples=4, pixel_filter=GAUSSIAN, seed=0):
+        if pixel_filter not in FILTER_RADIUS:
+            raise ValueError('Unknown pixel filter: {}'.format(pixel_filter))
+        self.side = max(int(round(samples ** 0.5)), 1)
+        self.samples = self.side ** 2
+        self.pixel_filter = pixel_filter
+        self.radius = FILTER_RADIUS[pixel_filter]
+        self.seed = seed
+
+    def weights(self, u, v):
+        # u and v are offsets from the pixel center, floats or arrays
+        import numpy as np
+
+        if self.pixel_filter == TENT:
+            return (1 - abs(u) / self.radius) * (1 - abs(v) / self.radius)
+        if self.pixel_filter == GAUSSIAN:
+            return np.exp(-GAUSSIAN_ALPHA * (u * u + v * v))
+        return np.ones_like(u)
+
+    def offsets(self, index):
+        # (dy, dx, weight) of every sample of a pixel, measured like the arguments of camera.get_ray
+        side = self.side
+        base = mix32((index + self.seed * 0x9e3779b9) & M32)
+        result = []
+        for sample in range(self.samples):
+            i, j = divmod(sample, side)
+            u = ((i + (mix32((base + 2 * sample) & M32) + 0.5) / 4294967296) / side * 2 - 1) * self.radius
+            v = ((j + (mix32((base + 2 * sample + 1) & M32) + 0.5) / 4294967296) / side * 2 - 1) * self.radius
+            result.append((u + 0.5, v + 0.5, float(self.weights(u, v))))
+        return result
+
+    def offset_arrays(self, indices):
+        # offsets for an array of pixel indices, (len(indices), samples) arrays of dy, dx and weight
+        import numpy as np
+
+        side = self.side
+        base = mix32((indices.astype(np.uint64)[:, None] + self.seed * 0x9e3779b9 % (M32 + 1)) & M32)
+        sample = np.arange(self.samples, dtype=np.uint64)[None, :]
+        i = (sample // side).astype(np.float64)
+        j = (sample % side).astype(np.float64)
+        u = ((i + (mix32((base + 2 * sample) & M32) + 0.5) / 4294967296) / side * 2 - 1) * self.radius
+        v = ((j + (mix32((base + 2 * sample + 1) & M32) + 0.5) / 4294967296) / side * 2 - 1) * self.radius
+        return u + 0.5, v + 0.5, self.weights(u, v)
+
+
+def sample_pixel(camera, y, x, objects, lights, depth, sampler, stats=None, termination=None):
+    # the filtered average of the pixel's samples, accumulated as they are traced
+    color = Vector(0, 0, 0)
+    total = 0
+    for dy, dx, weight in sampler.offsets(y * camera.res_x + x):
+        color.iadd_scaled(trace(camera.get_ray(y + dy, x + dx), objects, lights, depth, stats, termination), weight)
+        total += weight
+    return color.imul(1 / total)
+
+
+def trace(ray, objects, lights, depth=1, stats=None, termination=None, weight=1):
     if not depth:
         return BACKGROUND
+    if stats is not None:
+        stats.depths[depth] += 1
     intersection = test_ray(ray, objects)
     if intersection.d == -1:
         return BACKGROUND
-    
-    obj = intersection.obj
-    point = intersection.p
-    color = obj.color
-    light_effect = Vector(0, 0, 0)
-    reflected_color = Vector(0, 0, 0)
-    refracted_color = Vector(0, 0, 0)
-
-    if obj.properties.constant_color:
-        return color
-
-    '''
-    # YOU CAN ADD SOME TEXTURES HERE! it was a nice mistake
-    if isinstance(obj, Sphere) and obj == objects[0]:
-        point = point + intersection.n.normal()*obj.r*abs(g(point.x * coef, point.y * coef, point.z * coef))
-        intersection.d = (point - ray.o).len()
-        intersection.p = point
-    '''
-
-    if isinstance(obj, Plane) and obj.type == SQUARED:
-        def f(n):
-            return sign(sin(n / obj.scale))
-        x = f(point.x)
-        y = f(point.y)
-        z = f(point.z)
-        color *= sign(g(x, y, z))
-
-    for light in lights:
-        light_effect += light.calculate_effect(intersection.p, intersection.n, obj, objects)
-    
-    if depth and obj.reflective:
-        reflected_vector = (ray.d - intersection.n * 2 * ray.d.dot(intersection.n)).normal()
-        reflected_ray = Ray(intersection.p + reflected_vector * EPS, reflected_vector)
-        reflected_color = trace(reflected_ray, objects, lights, depth - 1)
-        reflected_color *= intersection.obj.reflective
-
-    if depth and obj.refractive:
-        normal = intersection.n
-        cs = ray.d.dot(normal)
-        
-        coef_from = 1
-        coef_to = obj.refractive_coef
-        if cs < 0:
-            cs *= -1
-        else:
-            normal = normal * -1
-            coef_from, coef_to = coef_to, coef_from
-
-        ratio = coef_from / coef_to
-        k = 1 - ratio * ratio * (1 - cs * cs)
-        if k < 0:
-            pass
-        else:
-            refracted_vector = ray.d * ratio + normal * (ratio * cs - sqrt(k))
-            refracted_ray = Ray(intersection.p + refracted_vector * EPS, refracted_vector)
-            refracted_color = trace(refracted_ray, objects, lights, depth - 1)
-    color *= light_effect * (1 - obj.refractive) * (1 - obj.reflective)
-    color += reflected_color + refracted_color * obj.refractive
-
-    return color  # * abs(g(point.x * COEF, point.y * COEF, point.z * COEF)) visual effects
 
+    obj = intersection.obj
+    if stats is not None:
+        stats.nearest[obj] += 1
+    if obj.constant_color:
+        return obj.color
 
-def render_image(camera=None, objects=None, lights=None, depth=2, verbose=1, scene=None, pygame_mode=False):
+    if hasattr(lights, 'shade'):
+        light_effect = lights.shade(intersection.p, intersection.n, obj, objects)
+    else:
+        light_effect = Vector(0, 0, 0)
+        for light in lights:
+            light_effect.iadd(light.calculate_effect(intersection.p, intersection.n, obj, objects))
+
+    reflected_color = None
+    refracted_color = None
+    if obj.reflective:
+        reflected_color = trace_branch(reflect_ray(ray, intersection), objects, lights, depth, stats, termination,
+                                       weight * obj.reflective, 'reflection')
+    if obj.refractive:
+        refracted_ray = refract_ray(ray, intersection)
+        if refracted_ray is not None:
+            refracted_color = trace_branch(refracted_ray, objects, lights, depth, stats, termination,
+                                           weight * obj.refractive, 'refraction')
+        elif stats is not None:
+            stats.total_internal_reflections += 1
+
+    return shade(intersection, light_effect, reflected_color, refracted_color)
+
+
+def trace_branch(ray, objects, lights, depth, stats, termination, weight, kind):
+    factor = 1
+    if termination is not None:
+        factor = termination.branch(weight, depth)
+        if factor is None:
+            return BACKGROUND
+        if not factor:
+            return None
+    if stats is not None and depth > 1:
+        stats.ray(kind)
+        color = trace(ray, objects, lights, depth - 1, stats, termination, weight * factor)
+        stats.ray_done(kind)
+    else:
+        color = trace(ray, objects, lights, depth - 1, stats, termination, weight * factor)
+    if factor != 1:
+        color = color * factor
+    return color
+
+
+def render_image(camera=None, objects=None, lights=None, depth=2, verbose=1, scene=None, pygame_mode=False,
+                 backend='scalar', processes=None, tile_order='center', stats=None, termination=None, threads=None,
+                 gamma=1, hdr=False, sampler=None, output=image_output.PIL):
+    # output picks the result, see image_output: a PIL image, a pygame surface or the raw bytes;
+    # sampler=Sampler(...) antialiases with several filtered samples per pixel;
+    # hdr=True returns the unclamped linear colors as a float32 (res_y, res_x, 3) array instead of an image
     if None in [camera, objects, lights]:
         if scene is None:
             return
@@ -363,26 +673,77 @@ def render_image(camera=None, objects=None, lights=None, depth=2, verbose=1, sce
             camera = scene.camera
             objects = scene.objects
             lights = scene.lights
-    if pygame_mode:
-        img = Surface((camera.res_x, camera.res_y))
-    else:
-        img = Image.new('RGB', (camera.res_x, camera.res_y))
-    
-    for y in range(camera.res_y):
-        if verbose:
-            if y % (camera.res_y // 10) == 0:
-                print(y / camera.res_y)
-        for x in range(camera.res_x):
-            ray = camera.get_ray(y, x)
-            color = trace(ray, objects, lights, depth)
-            if pygame_mode:
-                img.set_at((x, y), get_color(color))
-            else:
-                img.putpixel((x, y), get_color(color))
-    
+    if stats is not None and (processes or threads or backend != 'scalar'):
+        raise ValueError('Ray statistics are only collected by the serial scalar backend')
+    if termination is not None and backend != 'scalar':
+        raise ValueError('Path termination is only supported by the scalar backend')
+    if hdr and (processes or threads):
+        raise ValueError('HDR output is only produced by serial renders')
+    if backend == 'scalar' and stats is None:
+        # statistics count the calls to every object's intersect, which the compiled loops skip
+        import compiled
+        objects = compiled.compile_objects(objects)
+    if threads:
+        # only pays off on free-threaded builds, or with the numpy backend which releases the GIL
+        import tile_renderer
+        if termination is not None:
+            termination.start(depth)
+        data = tile_renderer.render_tiles_threaded(camera, objects, lights, depth, threads, order=tile_order,
+                                                   backend=backend, verbose=verbose, termination=termination,
+                                                   gamma=gamma, sampler=sampler)
+        return image_from_buffer(data, camera.res_x, camera.res_y, pygame_mode, output)
+    if processes:
+        import tile_renderer
+        data = tile_renderer.render_tiles(camera, objects, lights, depth, processes, order=tile_order,
+                                          backend=backend, verbose=verbose, termination=termination, gamma=gamma,
+                                          sampler=sampler)
+        return image_from_buffer(data, camera.res_x, camera.res_y, pygame_mode, output)
+    if backend == 'numpy':
+        import packet_tracer
+        pixels = packet_tracer.render_pixels(camera, objects, lights, depth, verbose, gamma=gamma, hdr=hdr,
+                                              sampler=sampler)
+        if hdr:
+            return pixels
+        return image_from_buffer(pixels, camera.res_x, camera.res_y, pygame_mode, output)
+    elif backend != 'scalar':
+        raise ValueError('Unknown backend: {}'.format(backend))
+
+    colors = array('d', bytes(camera.res_x * camera.res_y * 3 * 8))
+    if stats is not None:
+        stats.start(camera, objects, lights, depth)
+    if termination is not None:
+        termination.start(depth)
+    try:
+        index = 0
+        for y in range(camera.res_y):
+            if verbose:
+                if y % (camera.res_y // 10) == 0:
+                    print(y / camera.res_y)
+            for x in range(camera.res_x):
+                if termination is not None:
+                    termination.pixel(y * camera.res_x + x)
+                if sampler is None:
+                    color = trace(camera.get_ray(y, x), objects, lights, depth, stats, termination)
+                else:
+                    color = sample_pixel(camera, y, x, objects, lights, depth, sampler, stats, termination)
+                if stats is not None:
+                    stats.pixel(x, y, sampler.samples if sampler is not None else 1)
+                colors[index] = color.x
+                colors[index + 1] = color.y
+                colors[index + 2] = color.z
+                index += 3
+    finally:
+        if stats is not None:
+            stats.stop()
+
     if verbose:
         print('1.0')
-    return img
+    import numpy as np
+
+    colors = np.frombuffer(colors, dtype=np.float64).reshape(camera.res_y, camera.res_x, 3)
+    if hdr:
+        return colors.astype(np.float32)
+    return image_from_buffer(encode_colors(colors, gamma), camera.res_x, camera.res_y, pygame_mode, output)
 
 
 class Camera:
@@ -400,9 +761,15 @@ class Camera:
         self.left_upper = self.o + self.d * distance + self.ort1 * width / 2 + self.ort2 * height / 2
     
     def get_ray(self, x, y):
-        dx = self.ort1 * x * self.w / self.res_x
-        dy = self.ort2 * y * self.h / self.res_y
-        return Ray(self.o, (self.left_upper - dx - dy).normal())
+        ort1 = self.ort1
+        ort2 = self.ort2
+        left_upper = self.left_upper
+        kx = self.w / self.res_x
+        ky = self.h / self.res_y
+        direction = Vector(left_upper.x - ort1.x * x * kx - ort2.x * y * ky,
+                           left_upper.y - ort1.y * x * kx - ort2.y * y * ky,
+                           left_upper.z - ort1.z * x * kx - ort2.z * y * ky)
+        return Ray(self.o, direction.inormal())
 
     def update(self):
         self.ort1 = Vector(-self.d.y, abs(self.d.x), 0).normal()
@@ -419,6 +786,17 @@ class Scene:
     
     def move(self, delta):
         self.bias += delta
+
+    def compile(self):
+        # the same scene with a plain object list frozen into per-type records, see compiled.py
+        import compiled
+        return Scene(self.camera, compiled.compile_objects(self.objects), self.lights, self.bias)
+
+    def update(self, moved):
+        # after objects were moved in place (Instance.move, a new sphere center, ...), refreshes what the
+        # object container keeps about those objects only: compiled records, BVH boxes
+        if hasattr(self.objects, 'update'):
+            self.objects.update(moved)
     
     def rotate_camera(self, delta):
         self.camera.direction = rotx(roty(rotz(self.camera.direction, delta.z), delta.y), delta.x)
@@ -460,17 +838,27 @@ class Model:
         self.rotation = props.rotation
         self.properties = props
     
-    def get_triangles(self):
+    def transformed_points(self):
+        return [rot(point * self.coef, rotation=self.rotation) + self.center for point in self.points]
+
+    def get_triangles(self, points=None):
+        if points is None:
+            points = self.transformed_points()
         triangles = []
         for link in self.links:
-            p0 = rot(self.points[link[0]] * self.coef, rotation=self.rotation) + self.center
+            p0 = points[link[0]]
             for i in range(1, len(link) - 1):
-                p1 = rot(self.points[link[i]] * self.coef, rotation=self.rotation) + self.center
-                p2 = rot(self.points[link[i + 1]] * self.coef, rotation=self.rotation) + self.center
-                triangle = Triangle(p0, p1, p2, self.properties)
+                triangle = Triangle(p0, points[link[i]], points[link[i + 1]], self.properties)
                 triangles.append(triangle)
         return triangles
 
+    def get_instance(self):
+        # the triangles once in model space, placed by center, coef and rotation; a new pose for a frame
+        # is instance.move(rotation=...) instead of a new set of triangles
+        import instancing
+        return instancing.Instance(self.get_triangles(self.points),
+                                   instancing.Transform(self.center, self.coef, self.rotation))
+
 
 def generate_box_for_spheres(objects, indents=(0, 0, 0, 0, 0, 0), indent=None):
     if indent:
@@ -521,7 +909,7 @@ def main():
     p1 = Vector(0, 0, 0)
     p2 = Vector(0, 3, 0)
     p3 = Vector(0, 0, 5)
-    t = Triangle(p1, p2, p3, Vector(1, 1, 1))
+    t = Triangle(p1, p2, p3, Properties(Vector(1, 1, 1)))
     p = Vector(0, 1, 1)
     print(t.is_point_inside(p))
 
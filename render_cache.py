@@ -0,0 +1,201 @@
+from vector import Vector
+from ray_tracer import (BACKGROUND, test_ray, occluded, reflect_ray, refract_ray, shade, color_bytes,
+                        image_from_buffer)
+
+
+class PathNode:
+    __slots__ = ('ray', 'intersection', 'blocked', 'reflected', 'refracted')
+
+    def __init__(self, ray):
+        self.ray = ray
+        self.intersection = None
+        self.blocked = ()
+        self.reflected = None
+        self.refracted = None
+
+
+def structure(obj):
+    # material values that change which secondary rays get spawned, or where they go; for a group,
+    # an instance or a BVH, those of everything in it
+    if hasattr(obj, 'objects'):
+        return tuple(structure(member) for member in obj.objects)
+    return bool(obj.reflective), bool(obj.refractive), obj.refractive_coef, obj.constant_color
+
+
+def members(group):
+    for obj in group.objects:
+        if hasattr(obj, 'objects'):
+            yield from members(obj)
+        else:
+            yield obj
+
+
+class RenderCache:
+    def __init__(self, camera, objects, lights, depth=2):
+        self.camera = camera
+        self.objects = objects
+        self.lights = lights
+        self.depth = depth
+
+        self.paths = []
+        self.buffer = bytearray()
+        self.touched = {}
+        self.pixel_objects = []
+        self.structures = {}
+        # hits and blockers come back as the objects inside groups, pixels are kept by the group
+        self.owners = {}
+        self.reshaded = 0
+        self.retraced = 0
+
+    def render(self, pygame_mode=False):
+        camera = self.camera
+        count = camera.res_x * camera.res_y
+        self.paths = [None] * count
+        self.buffer = bytearray(count * 3)
+        self.touched = {}
+        self.pixel_objects = [None] * count
+        self.structures = {obj: structure(obj) for obj in self.objects}
+        self.owners = {member: obj for obj in self.objects if hasattr(obj, 'objects') for member in members(obj)}
+        for pixel in range(count):
+            self.retrace(pixel)
+        self.reshaded = 0
+        self.retraced = count
+        return self.image(pygame_mode)
+
+    def update(self, changed, geometry=False, pygame_mode=False):
+        changed = list(changed)
+        moved = list(changed) if geometry else []
+        for obj in changed:
+            key = structure(obj)
+            if key != self.structures.get(obj):
+                self.structures[obj] = key
+                if obj not in moved:
+                    moved.append(obj)
+
+        if moved and hasattr(self.objects, 'update'):
+            self.objects.update(moved)
+        elif moved and hasattr(self.objects, 'refit'):
+            self.objects.refit()
+
+        stale = set()
+        for obj in changed:
+            stale.update(self.touched.get(obj, ()))
+        retrace = set()
+        if moved:
+            for obj in moved:
+                retrace.update(self.touched.get(obj, ()))
+            for pixel, node in enumerate(self.paths):
+                if pixel not in retrace and any(self.crosses(node, obj) for obj in moved):
+                    retrace.add(pixel)
+
+        for pixel in retrace:
+            self.retrace(pixel)
+        for pixel in stale - retrace:
+            self.write(pixel, self.color(self.paths[pixel]))
+        self.reshaded = len(stale - retrace)
+        self.retraced = len(retrace)
+        return self.image(pygame_mode)
+
+    def image(self, pygame_mode=False):
+        return image_from_buffer(bytes(self.buffer), self.camera.res_x, self.camera.res_y, pygame_mode)
+
+    def write(self, pixel, color):
+        self.buffer[pixel * 3:pixel * 3 + 3] = color_bytes(color)
+
+    def retrace(self, pixel):
+        for obj in self.pixel_objects[pixel] or ():
+            self.touched[obj].discard(pixel)
+        self.pixel_objects[pixel] = set()
+
+        y, x = divmod(pixel, self.camera.res_x)
+        node = self.record(self.camera.get_ray(y, x), self.depth, pixel)
+        self.paths[pixel] = node
+        self.write(pixel, self.color(node))
+
+    def owner(self, obj):
+        # the top level object a hit or blocker belongs to: a face counts for its mesh, anything in a
+        # group for the group
+        obj = getattr(obj, 'mesh', obj)
+        return self.owners.get(obj, obj)
+
+    def touch(self, obj, pixel):
+        obj = self.owner(obj)
+        self.touched.setdefault(obj, set()).add(pixel)
+        self.pixel_objects[pixel].add(obj)
+
+    def record(self, ray, depth, pixel):
+        if not depth:
+            return PathNode(None)
+        node = PathNode(ray)
+        intersection = test_ray(ray, self.objects)
+        if intersection.d == -1:
+            return node
+        node.intersection = intersection
+        obj = intersection.obj
+        self.touch(obj, pixel)
+        if obj.constant_color:
+            return node
+
+        blocked = []
+        for light in self.lights:
+            blocker = None
+            shadow = light.shadow_ray(intersection.p)
+            if shadow is not None:
+                shadow_ray, max_distance, skip_refractive = shadow
+                blocker = occluded(shadow_ray, self.objects, max_distance, (obj,), skip_refractive)
+                if blocker is not None:
+                    self.touch(blocker, pixel)
+            blocked.append(blocker)
+        node.blocked = blocked
+
+        if obj.reflective:
+            node.reflected = self.record(reflect_ray(ray, intersection), depth - 1, pixel)
+        if obj.refractive:
+            refracted_ray = refract_ray(ray, intersection)
+            if refracted_ray is not None:
+                node.refracted = self.record(refracted_ray, depth - 1, pixel)
+        return node
+
+    def color(self, node):
+        intersection = node.intersection
+        if intersection is None:
+            return BACKGROUND
+        obj = intersection.obj
+        if obj.constant_color:
+            return obj.color
+
+        light_effect = Vector(0, 0, 0)
+        for light, blocker in zip(self.lights, node.blocked):
+            if blocker is None:
+                light_effect.iadd(light.illumination(intersection.p, intersection.n, obj))
+
+        reflected_color = self.color(node.reflected) if node.reflected is not None else None
+        refracted_color = self.color(node.refracted) if node.refracted is not None else None
+        return shade(intersection, light_effect, reflected_color, refracted_color)
+
+    def crosses(self, node, obj):
+        if node is None or node.ray is None:
+            return False
+        intersection = node.intersection
+        d = obj.intersect(node.ray).d
+        if d > 0 and (intersection is None or d < intersection.d):
+            return True
+        if intersection is None:
+            return False
+
+        if obj is not self.owner(intersection.obj):
+            for light in self.lights:
+                shadow = light.shadow_ray(intersection.p)
+                if shadow is None:
+                    continue
+                shadow_ray, max_distance, skip_refractive = shadow
+                if hasattr(obj, 'occluded'):
+                    if obj.occluded(shadow_ray, max_distance, (), skip_refractive) is not None:
+                        return True
+                    continue
+                if skip_refractive and obj.refractive:
+                    continue
+                d = obj.intersect(shadow_ray).d
+                if d > 0 and (max_distance is None or d < max_distance):
+                    return True
+        return self.crosses(node.reflected, obj) or self.crosses(node.refracted, obj)
@@ -0,0 +1,246 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+import ray_tracer
+from vector import Vector
+
+
+BUNDLE_VERSION = 5
+CACHE_SUFFIX = '.scenecache'
+BVH_KEY = 'bvh'
+# names the bundle of the latest version of the scene
+LATEST_FILE = 'latest'
+
+MATERIAL_TYPES = {'fill': ray_tracer.FILL, 'squared': ray_tracer.SQUARED}
+LIGHT_TYPES = {'mag': ray_tracer.MAG, 'distant': ray_tracer.DISTANT}
+RENDER_DEFAULTS = {
+    'depth': 2,
+    'backend': 'scalar',
+    'processes': None,
+    'accelerator': 'bvh',
+    'max_lights': None,
+    'samples': 1,
+    'pixel_filter': ray_tracer.GAUSSIAN,
+    'output': 'render.png',
+}
+
+
+def read_description(path):
+    if os.path.splitext(path)[1].lower() == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError('TOML scene files need Python 3.11 or newer, use JSON instead')
+        with open(path, 'rb') as fin:
+            return tomllib.load(fin)
+    with open(path) as fin:
+        return json.load(fin)
+
+
+def load_scene(path, cache=True):
+    # returns the Scene and the render settings of a JSON or TOML scene file; the triangles of models and
+    # meshes and the BVH over all objects are kept as arrays in a bundle next to the file and memory-mapped
+    # on later loads, only data, never code. The objects are still made on every load, one Python object
+    # per triangle of a model: a mesh is the cheaper kind for big models
+    description = read_description(path)
+    base = os.path.dirname(os.path.abspath(path))
+    bundle = bundle_dir(path, description, base) if cache else None
+
+    camera = make_camera(description['camera'])
+    lights = [make_light(spec) for spec in description.get('lights', ())]
+    settings = dict(RENDER_DEFAULTS)
+    settings.update(description.get('render', {}))
+    if settings['accelerator'] not in ('bvh', None, 'none'):
+        raise ValueError('Unknown accelerator: {}'.format(settings['accelerator']))
+    materials = {name: make_properties(spec, base) for name, spec in description.get('materials', {}).items()}
+    objects = []
+    for index, spec in enumerate(description.get('objects', ())):
+        objects += make_objects(spec, str(index), materials, base, bundle)
+    if settings['accelerator'] == 'bvh':
+        objects = make_bvh(objects, bundle)
+    if settings['max_lights']:
+        import light_tree
+        lights = light_tree.LightTree(lights, settings['max_lights'])
+    return ray_tracer.Scene(camera, objects, lights), settings
+
+
+def make_bvh(objects, bundle):
+    import bvh
+
+    built = []
+
+    def build():
+        built.append(bvh.BVH(objects))
+        return built[0].arrays()
+    arrays = cached(bundle, BVH_KEY, build)
+    return built[0] if built else bvh.BVH.from_arrays(objects, arrays)
+
+
+def vector(values):
+    return Vector(*map(float, values))
+
+
+def make_camera(spec):
+    return ray_tracer.Camera(vector(spec['origin']), vector(spec['direction']), spec['distance'], spec['width'],
+                             spec['height'], spec.get('resolution', 1))
+
+
+def make_properties(spec, base):
+    texture = make_texture(spec['texture'], base) if 'texture' in spec else None
+    return ray_tracer.Properties(vector(spec.get('color', (0, 0, 0))), spec.get('reflective', 0),
+                                 spec.get('refractive', 0), spec.get('refractive_coef', 1),
+                                 MATERIAL_TYPES[spec.get('type', 'fill')], spec.get('scale', 1),
+                                 tuple(spec.get('rotation', (0, 0, 0))), spec.get('constant_color', False), texture)
+
+
+def make_texture(spec, base):
+    import textures
+
+    kind = spec['type']
+    other = vector(spec.get('other', (0, 0, 0)))
+    if kind == 'squared':
+        return textures.Squared(spec.get('scale', 1))
+    if kind == 'checker':
+        return textures.Checker(spec.get('scale', 1), other)
+    if kind == 'noise':
+        return textures.Noise(spec.get('scale', 1), other, spec.get('octaves', 4), spec.get('seed', 0))
+    if kind == 'image':
+        return textures.ImageTexture(os.path.join(base, spec['file']), spec.get('size', 1),
+                                     vector(spec.get('origin', (0, 0, 0))), vector(spec.get('u_axis', (1, 0, 0))),
+                                     vector(spec.get('v_axis', (0, 0, 1))),
+                                     spec.get('pixel_angle', textures.PIXEL_ANGLE))
+    raise ValueError('Unknown texture type: {}'.format(kind))
+
+
+def material(spec, materials, base):
+    value = spec.get('material', {})
+    if isinstance(value, str):
+        return materials[value]
+    return make_properties(value, base)
+
+
+def make_light(spec):
+    return ray_tracer.Light(vector(spec['origin']), vector(spec.get('color', (1, 1, 1))),
+                            LIGHT_TYPES[spec.get('type', 'mag')], spec.get('distance_coef', 200000))
+
+
+def make_objects(spec, key, materials, base, bundle):
+    kind = spec['type']
+    properties = material(spec, materials, base)
+    if kind == 'sphere':
+        return [ray_tracer.Sphere(vector(spec['center']), spec['radius'], properties)]
+    if kind == 'plane':
+        return [ray_tracer.Plane(vector(spec['point']), vector(spec['normal']), properties)]
+    if kind == 'triangle':
+        return [ray_tracer.Triangle(*map(vector, spec['points']), properties)]
+
+    path = os.path.join(base, spec['file'])
+    center = vector(spec.get('center', (0, 0, 0)))
+    scale = spec.get('scale', 1)
+    if 'rotation' in spec:
+        properties = properties.cp()
+        properties.rotation = tuple(spec['rotation'])
+
+    if kind == 'model':
+        def build():
+            model = ray_tracer.Model(center, scale, properties, file=path)
+            corners = [(p.x, p.y, p.z) for t in model.get_triangles() for p in (t.p1, t.p2, t.p3)]
+            return {'corners': np.array(corners, dtype=np.float64).reshape(-1, 3, 3)}
+        corners = cached(bundle, key, build)['corners']
+        return [ray_tracer.Triangle(vector(p1), vector(p2), vector(p3), properties) for p1, p2, p3 in corners.tolist()]
+
+    if kind == 'mesh':
+        import mesh
+
+        def build():
+            return mesh.Mesh.from_file(path, properties, center, scale, properties.rotation).arrays()
+        return [mesh.Mesh.from_arrays(cached(bundle, key, build), properties)]
+
+    raise ValueError('Unknown object type: {}'.format(kind))
+
+
+def bundle_dir(path, description, base):
+    # keyed by the scene itself and the size and mtime of every file it refers to
+    digest = hashlib.sha256(str(BUNDLE_VERSION).encode())
+    digest.update(json.dumps(description, sort_keys=True).encode())
+    for spec in description.get('objects', ()):
+        if 'file' in spec:
+            info = os.stat(os.path.join(base, spec['file']))
+            digest.update('{} {} {}'.format(spec['file'], info.st_size, info.st_mtime_ns).encode())
+    return os.path.join(path + CACHE_SUFFIX, digest.hexdigest()[:16])
+
+
+def open_bundle(bundle):
+    # the bundle the scene had before this one is stale and removed, other bundles next to it are kept
+    if os.path.isdir(bundle):
+        return
+    cache_dir, name = os.path.split(bundle)
+    latest = os.path.join(cache_dir, LATEST_FILE)
+    try:
+        with open(latest) as fin:
+            stale = os.path.basename(fin.read().strip())
+    except OSError:
+        stale = ''
+    if stale and stale != name:
+        shutil.rmtree(os.path.join(cache_dir, stale), ignore_errors=True)
+    os.makedirs(bundle)
+    with open(latest, 'w') as fout:
+        fout.write(name)
+
+
+def cached(bundle, key, build):
+    if bundle is None:
+        return build()
+    marker = os.path.join(bundle, key + '.json')
+    if os.path.exists(marker):
+        try:
+            with open(marker) as fin:
+                names = json.load(fin)
+            return {name: np.load(os.path.join(bundle, '{}.{}.npy'.format(key, name)), mmap_mode='r')
+                    for name in names}
+        except (OSError, ValueError):
+            pass
+
+    arrays = build()
+    open_bundle(bundle)
+    for name, array in arrays.items():
+        np.save(os.path.join(bundle, '{}.{}.npy'.format(key, name)), array)
+    with open(marker, 'w') as fout:
+        json.dump(sorted(arrays), fout)
+    return arrays
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Renders a JSON or TOML scene file.')
+    parser.add_argument('scene')
+    parser.add_argument('-o', '--output', help='Image file, overrides render.output of the scene')
+    parser.add_argument('--depth', type=int)
+    parser.add_argument('--backend', choices=('scalar', 'numpy'))
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--samples', type=int, help='Samples per pixel, more than one antialiases')
+    parser.add_argument('--no-cache', action='store_true', help='Neither read nor write the scene bundle')
+    parser.add_argument('--show', action='store_true')
+    args = parser.parse_args()
+
+    scene, settings = load_scene(args.scene, not args.no_cache)
+    for name in ('output', 'depth', 'backend', 'processes', 'samples'):
+        if getattr(args, name) is not None:
+            settings[name] = getattr(args, name)
+
+    sampler = None
+    if settings['samples'] > 1:
+        sampler = ray_tracer.Sampler(settings['samples'], settings['pixel_filter'])
+    image = ray_tracer.render_image(scene=scene, depth=settings['depth'], verbose=1, backend=settings['backend'],
+                                    processes=settings['processes'], sampler=sampler)
+    image.save(settings['output'])
+    if args.show:
+        image.show()
+
+
+if __name__ == '__main__':
+    main()
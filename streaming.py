@@ -0,0 +1,227 @@
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import tile_renderer
+
+
+STRIP_HEIGHT = 16
+# compressed PNG data is written out in chunks of about this size
+IDAT_SIZE = 1 << 16
+TIFF_TILE_SIZE = 256
+# upscaled rows are passed on this many at a time, a strip can turn into thousands of them
+EMIT_ROWS = 64
+
+
+class StreamWriter:
+    # takes the rows of a width x height image strip by strip, top to bottom, and passes them on
+    # scaled to size with nearest neighbour; sink is a path or a binary file-like object
+    def __init__(self, sink, width, height, size=None):
+        self.owned = isinstance(sink, (str, bytes, os.PathLike))
+        self.sink = open(sink, 'wb') if self.owned else sink
+        self.width = width
+        self.height = height
+        self.out_width, self.out_height = size or (width, height)
+        # by pixel centers like Image.resize(size, Image.NEAREST), which only differs on exact ties
+        self.columns = (np.arange(self.out_width) * 2 + 1) * width // (2 * self.out_width)
+        self.source_row = 0
+        self.out_row = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        elif self.owned:
+            self.sink.close()
+
+    def source_of(self, row):
+        return (row * 2 + 1) * self.height // (2 * self.out_height)
+
+    def write(self, pixels):
+        # pixels is a (rows, width, 3) uint8 array, the next rows of the image
+        end = self.source_row + len(pixels)
+        last = self.out_row
+        while last < self.out_height and self.source_of(last) < end:
+            last += 1
+        if last > self.out_row:
+            sources = self.source_of(np.arange(self.out_row, last)) - self.source_row
+            for start in range(0, len(sources), EMIT_ROWS):
+                self.emit(pixels[sources[start:start + EMIT_ROWS]][:, self.columns])
+            self.out_row = last
+        self.source_row = end
+
+    def close(self):
+        if self.closed:
+            return
+        if self.out_row != self.out_height:
+            raise ValueError('Only {} of {} rows were written'.format(self.out_row, self.out_height))
+        self.finish()
+        self.closed = True
+        if self.owned:
+            self.sink.close()
+
+    def emit(self, rows):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+class PNGWriter(StreamWriter):
+    def __init__(self, sink, width, height, size=None, level=6):
+        super().__init__(sink, width, height, size)
+        self.compressor = zlib.compressobj(level)
+        self.pending = bytearray()
+        self.sink.write(b'\x89PNG\r\n\x1a\n')
+        self.chunk(b'IHDR', struct.pack('>IIBBBBB', self.out_width, self.out_height, 8, 2, 0, 0, 0))
+
+    def chunk(self, kind, data):
+        self.sink.write(struct.pack('>I', len(data)) + kind + data +
+                        struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+    def emit(self, rows):
+        # every scanline starts with filter type 0
+        lines = np.zeros((len(rows), self.out_width * 3 + 1), dtype=np.uint8)
+        lines[:, 1:] = rows.reshape(len(rows), -1)
+        self.pending += self.compressor.compress(lines.tobytes())
+        if len(self.pending) >= IDAT_SIZE:
+            self.chunk(b'IDAT', bytes(self.pending))
+            self.pending = bytearray()
+
+    def finish(self):
+        self.pending += self.compressor.flush()
+        self.chunk(b'IDAT', bytes(self.pending))
+        self.chunk(b'IEND', b'')
+
+
+class TIFFWriter(StreamWriter):
+    # an uncompressed tiled TIFF; the tiles all have the same size, so the directory with their offsets
+    # goes in front and nothing has to be seeked back to, a row of tiles is held until it is complete
+    def __init__(self, sink, width, height, size=None, tile_size=TIFF_TILE_SIZE):
+        super().__init__(sink, width, height, size)
+        self.tile_size = tile_size
+        self.across = (self.out_width + tile_size - 1) // tile_size
+        down = (self.out_height + tile_size - 1) // tile_size
+        self.band = np.zeros((tile_size, self.across * tile_size, 3), dtype=np.uint8)
+        self.band_rows = 0
+
+        count = self.across * down
+        tile_bytes = tile_size * tile_size * 3
+        entries = 11
+        extra = 8 + 2 + entries * 12 + 4
+        bits_offset = extra
+        offsets_offset = bits_offset + 6
+        counts_offset = offsets_offset + 4 * count
+        data_offset = counts_offset + 4 * count
+        if data_offset + count * tile_bytes >= 1 << 32:
+            raise ValueError('Image too large for a classic TIFF, write a PNG instead')
+
+        def entry(tag, kind, values, offset):
+            if len(values) == 1:
+                if kind == 3:
+                    return struct.pack('<HHIHH', tag, kind, 1, values[0], 0)
+                return struct.pack('<HHII', tag, kind, 1, values[0])
+            return struct.pack('<HHII', tag, kind, len(values), offset)
+
+        offsets = [data_offset + i * tile_bytes for i in range(count)]
+        header = bytearray(b'II*\x00' + struct.pack('<I', 8) + struct.pack('<H', entries))
+        header += entry(256, 4, [self.out_width], 0)
+        header += entry(257, 4, [self.out_height], 0)
+        header += entry(258, 3, [8, 8, 8], bits_offset)
+        header += entry(259, 3, [1], 0)
+        header += entry(262, 3, [2], 0)
+        header += entry(277, 3, [3], 0)
+        header += entry(284, 3, [1], 0)
+        header += entry(322, 4, [tile_size], 0)
+        header += entry(323, 4, [tile_size], 0)
+        header += entry(324, 4, offsets, offsets_offset)
+        header += entry(325, 4, [tile_bytes] * count, counts_offset)
+        header += struct.pack('<I', 0)
+        header += struct.pack('<3H', 8, 8, 8)
+        if count > 1:
+            header += struct.pack('<{}I'.format(count), *offsets)
+            header += struct.pack('<{}I'.format(count), *[tile_bytes] * count)
+        else:
+            header += bytes(8)
+        self.sink.write(bytes(header))
+
+    def emit(self, rows):
+        start = 0
+        while start < len(rows):
+            take = min(self.tile_size - self.band_rows, len(rows) - start)
+            self.band[self.band_rows:self.band_rows + take, :self.out_width] = rows[start:start + take]
+            self.band_rows += take
+            start += take
+            if self.band_rows == self.tile_size:
+                self.flush_band()
+
+    def flush_band(self):
+        self.band[self.band_rows:] = 0
+        size = self.tile_size
+        for tx in range(self.across):
+            self.sink.write(self.band[:, tx * size:(tx + 1) * size].tobytes())
+        self.band_rows = 0
+
+    def finish(self):
+        if self.band_rows:
+            self.flush_band()
+
+
+def open_writer(path, width, height, size=None):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.png':
+        return PNGWriter(path, width, height, size)
+    if extension in ('.tif', '.tiff'):
+        return TIFFWriter(path, width, height, size)
+    raise ValueError('Streaming output has to be .png or .tif, not {}'.format(extension))
+
+
+def render_strips(camera, objects, lights, writer, depth=2, strip_height=STRIP_HEIGHT, backend='scalar',
+                  processes=None, termination=None, gamma=1, sampler=None, verbose=0):
+    # renders the image a strip of rows at a time into writer (see open_writer), so memory follows
+    # the strip height and the output size never has to fit in memory; processes render strips
+    # ahead of the writer, at most two per process
+    if backend == 'scalar':
+        import compiled
+        objects = compiled.compile_objects(objects)
+    elif backend != 'numpy':
+        raise ValueError('Unknown backend: {}'.format(backend))
+    # a strip is a full-width tile of the tile renderer, rendered by its workers into bytes of its own
+    strips = [(0, y, camera.res_x, min(y + strip_height, camera.res_y))
+              for y in range(0, camera.res_y, strip_height)]
+    init = (camera, objects, lights, depth, backend, None, termination, gamma, sampler)
+
+    def write(done, strip, data):
+        writer.write(np.frombuffer(data, dtype=np.uint8).reshape(strip[3] - strip[1], camera.res_x, 3))
+        if verbose and done % max(len(strips) // 10, 1) == 0:
+            print(done / len(strips))
+
+    with writer:
+        if not processes:
+            tile_renderer._init_worker(*init)
+            for done, strip in enumerate(strips, 1):
+                write(done, strip, tile_renderer.tile_bytes(strip))
+            return
+
+        with ProcessPoolExecutor(processes, initializer=tile_renderer._init_worker, initargs=init) as pool:
+            pending = deque()
+            queued = iter(strips)
+            for strip in queued:
+                pending.append((strip, pool.submit(tile_renderer.tile_bytes, strip)))
+                if len(pending) >= processes * 2:
+                    break
+            done = 0
+            while pending:
+                strip, future = pending.popleft()
+                done += 1
+                write(done, strip, future.result())
+                for strip in queued:
+                    pending.append((strip, pool.submit(tile_renderer.tile_bytes, strip)))
+                    break
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ray_tracer as rt
+from vector import Vector
+
+
+@pytest.fixture
+def scene():
+    # a small room with every kind of material: a squared floor, a mirror wall, a glass and a reflective
+    # sphere, a triangle and a point and a distant light
+    P = rt.Properties
+    camera = rt.Camera(Vector(0, 1, 0), Vector(1, 0, 0), 40, 20, 20, 1)
+    objects = [rt.Plane(Vector(0, -2, 0), Vector(0, -1, 0), P(Vector(0.8, 0.8, 0.8), type=rt.SQUARED, scale=0.2)),
+               rt.Plane(Vector(40, 0, 0), Vector(1, 0, 0), P(Vector(0.2, 0.3, 0.9), reflective=0.5)),
+               rt.Sphere(Vector(20, 0, 0), 3.3, P(Vector(0.7, 1, 0.7), refractive=0.8, refractive_coef=1.5)),
+               rt.Sphere(Vector(10, 0, 6), 3.3, P(Vector(0.9, 0.6, 0.1), reflective=0.5)),
+               rt.Triangle(Vector(25, -2, -8), Vector(25, 6, -4), Vector(15, -2, -10), P(Vector(1, 0.5, 0.5)))]
+    lights = [rt.Light(Vector(0, 100, 100), Vector(1, 1, 1), distance_coef=2 ** 0.5 * 200000),
+              rt.Light(Vector(1, -1, 0.3), Vector(0.3, 0.3, 0.3), type=rt.DISTANT)]
+    return camera, objects, lights
@@ -0,0 +1,16 @@
+import benchmark
+import ray_tracer as rt
+from ray_stats import RayStats
+
+
+def test_stage_timer_sees_the_rays_ray_stats_counts(scene):
+    camera, objects, lights = scene
+    stats = RayStats()
+    expected = rt.render_image(camera, objects, lights, 4, 0, stats=stats).tobytes()
+    timer = benchmark.render_stages(camera, objects, lights, 4, benchmark.SCALAR)
+    assert timer.rays == stats.rays
+    assert not timer.stack
+    assert all(seconds > 0 for seconds in timer.times.values())
+    # the lights are back to their own calculate_effect
+    assert rt.render_image(camera, objects, lights, 4, 0).tobytes() == expected
+    assert all('calculate_effect' not in vars(light) for light in lights)
@@ -0,0 +1,117 @@
+from random import Random
+
+import pytest
+
+import ray_tracer as rt
+from bvh import BVH
+from instancing import Instance, Transform
+from render_cache import RenderCache
+from vector import Vector
+
+
+def shadowed_scene():
+    # a sphere between the floor and the light, with enough other objects for the tree to have several leaves
+    P = rt.Properties
+    camera = rt.Camera(Vector(-20, 10, 0), Vector(1, -0.3, 0), 40, 20, 20, 1)
+    sphere = rt.Sphere(Vector(8, 6, 2), 2, P(Vector(0.9, 0.6, 0.1)))
+    objects = [rt.Plane(Vector(0, 0, 0), Vector(0, 1, 0), P(Vector(0.8, 0.8, 0.8))), sphere]
+    objects += [rt.Sphere(Vector(15 + 4 * i, 2, -12 + 5 * (i % 3)), 1.5, P(Vector(0.3, 0.6, 0.3), reflective=0.3))
+                for i in range(12)]
+    lights = [rt.Light(Vector(0, 30, 30), Vector(1, 1, 1), distance_coef=200000)]
+    return camera, objects, lights, sphere
+
+
+def random_scene(rng, count=60):
+    # spheres and triangles scattered in a 40 unit cube, a floor and an instance of a few more
+    P = rt.Properties
+    objects = [rt.Plane(Vector(0, -25, 0), Vector(0, 1, 0), P(Vector(0.8, 0.8, 0.8)))]
+    for _ in range(count):
+        center = random_point(rng, 20)
+        if rng.random() < 0.5:
+            objects.append(rt.Sphere(center, rng.uniform(0.5, 3), P(Vector(0.5, 0.5, 0.5))))
+        else:
+            objects.append(rt.Triangle(*(center + random_point(rng, 3) for _ in range(3)), P(Vector(0.5, 0.5, 0.5))))
+    box = Instance([rt.Sphere(Vector(0, 0, 0), 2, P(Vector(0.9, 0.6, 0.1))),
+                    rt.Triangle(Vector(-3, -3, 0), Vector(3, -3, 0), Vector(0, 3, 0), P(Vector(1, 0.5, 0.5)))],
+                   Transform(Vector(5, 5, 5), 1.5, (0.3, 0.2, 0)))
+    return objects + [box]
+
+
+def random_point(rng, size):
+    return Vector(rng.uniform(-size, size), rng.uniform(-size, size), rng.uniform(-size, size))
+
+
+def random_rays(rng, count=300):
+    return [rt.Ray(random_point(rng, 30), random_point(rng, 1).normal()) for _ in range(count)]
+
+
+def assert_same_hits(tree, objects, rays):
+    for ray in rays:
+        expected = rt.test_ray(ray, objects)
+        hit = tree.test_ray(ray)
+        assert hit.obj is expected.obj
+        assert hit.d == pytest.approx(expected.d)
+
+
+def move_objects(rng, objects):
+    # every other sphere and the instance, by a few units
+    moved = []
+    for obj in objects:
+        if isinstance(obj, rt.Sphere) and rng.random() < 0.5:
+            obj.c = obj.c + random_point(rng, 4)
+            moved.append(obj)
+        elif isinstance(obj, Instance):
+            obj.move(center=obj.transform.center + random_point(rng, 4), rotation=(0, 1.1, 0.4))
+            moved.append(obj)
+    return moved
+
+
+def test_bvh_hits_match_linear_search():
+    rng = Random(3)
+    objects = random_scene(rng)
+    assert_same_hits(BVH(objects), objects, random_rays(rng))
+
+
+@pytest.mark.parametrize('method', ['refit', 'update', 'rebuild'])
+def test_bvh_hits_match_linear_search_after_moving(method):
+    rng = Random(4)
+    objects = random_scene(rng)
+    tree = BVH(objects)
+    rays = random_rays(rng)
+    for _ in range(3):
+        moved = move_objects(rng, objects)
+        if method == 'update':
+            tree.update(moved)
+        else:
+            getattr(tree, method)()
+        assert_same_hits(tree, objects, rays)
+
+
+def make_refractive(obj):
+    properties = obj.properties.cp()
+    properties.refractive = 0.8
+    properties.refractive_coef = 1.5
+    obj.update_properties(properties)
+
+
+def test_refractive_after_update_properties_lets_shadow_rays_through():
+    camera, objects, lights, sphere = shadowed_scene()
+    tree = BVH(objects)
+    ray, max_distance, skip_refractive = lights[0].shadow_ray(Vector(10, 0, -5))
+    assert rt.occluded(ray, tree, max_distance, (), skip_refractive) is sphere
+
+    make_refractive(sphere)
+    assert rt.occluded(ray, objects, max_distance, (), skip_refractive) is None
+    assert rt.occluded(ray, tree, max_distance, (), skip_refractive) is None
+    expected = rt.render_image(camera, objects, lights, 3, 0).tobytes()
+    assert rt.render_image(camera, tree, lights, 3, 0).tobytes() == expected
+
+
+def test_render_cache_over_bvh_sees_material_edits():
+    camera, objects, lights, sphere = shadowed_scene()
+    tree = BVH(objects)
+    cache = RenderCache(camera, tree, lights, 3)
+    cache.render()
+    make_refractive(sphere)
+    image = cache.update([sphere])
+    assert image.tobytes() == rt.render_image(camera, objects, lights, 3, 0).tobytes()
@@ -0,0 +1,101 @@
+import os
+import signal
+import socket
+from multiprocessing import Process
+from multiprocessing.connection import Client
+from threading import Thread
+
+import pytest
+
+import farm
+import ray_tracer
+from main import build_scene
+
+
+DEPTH = 3
+TILE_SIZE = 8
+
+
+@pytest.fixture(scope='module')
+def room():
+    camera, objects, lights = build_scene(1)
+    return camera, objects, lights, ray_tracer.render_image(camera, objects, lights, DEPTH, 0).tobytes()
+
+
+def dying_worker(address, authkey):
+    # takes the scene and its first tile, then goes away without an answer
+    connection = Client(address, authkey=authkey)
+    connection.recv()
+    connection.recv()
+    os._exit(1)
+
+
+def closing_worker(address, authkey):
+    Client(address, authkey=authkey).close()
+
+
+def render(coordinator, room, timeout=60):
+    # in a thread, so that a coordinator waiting for a lost tile fails the test instead of hanging it
+    camera, objects, lights, _ = room
+    result = []
+    thread = Thread(target=lambda: result.append(
+        coordinator.render(camera, objects, lights, DEPTH, tile_size=TILE_SIZE).tobytes()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert result, 'the coordinator did not finish the frame'
+    return result[0]
+
+
+def start(target, coordinator):
+    process = Process(target=target, args=(coordinator.address, coordinator.authkey), daemon=True)
+    process.start()
+    return process
+
+
+def test_healthy_workers(room):
+    with farm.Coordinator() as coordinator:
+        farm.start_local_workers(coordinator.address, 3, coordinator.authkey)
+        assert render(coordinator, room) == room[3]
+
+
+def test_lost_workers_tiles_are_requeued(room):
+    with farm.Coordinator() as coordinator:
+        start(closing_worker, coordinator).join(10)
+        start(dying_worker, coordinator)
+        farm.start_local_workers(coordinator.address, 2, coordinator.authkey)
+        assert render(coordinator, room) == room[3]
+
+
+def test_dying_worker_mid_frame(room):
+    with farm.Coordinator() as coordinator:
+        start(dying_worker, coordinator)
+        farm.start_local_workers(coordinator.address, 2, coordinator.authkey)
+        assert render(coordinator, room) == room[3]
+
+
+def test_stalled_worker_times_out(room):
+    with farm.Coordinator(timeout=0.5) as coordinator:
+        stalled, healthy = farm.start_local_workers(coordinator.address, 2, coordinator.authkey)
+        # the first frame gets both workers the scene, in the second one stops answering
+        assert render(coordinator, room) == room[3]
+        os.kill(stalled.pid, signal.SIGSTOP)
+        try:
+            assert render(coordinator, room) == room[3]
+        finally:
+            os.kill(stalled.pid, signal.SIGCONT)
+
+
+def test_silent_client_does_not_block_workers(room):
+    with farm.Coordinator() as coordinator:
+        silent = socket.create_connection(coordinator.address)
+        try:
+            farm.start_local_workers(coordinator.address, 2, coordinator.authkey)
+            assert render(coordinator, room) == room[3]
+        finally:
+            silent.close()
+
+
+def test_unauthorized_worker_is_refused(room):
+    with farm.Coordinator() as coordinator:
+        with pytest.raises(Exception):
+            farm.run_worker(coordinator.address, b'wrong key')
@@ -0,0 +1,39 @@
+import ray_tracer as rt
+from mesh import Mesh
+from vector import Vector
+
+
+# an L: a floor and a wall standing across it, the floor behind the wall is in its shadow
+VERTICES = [(0, 0, -5), (10, 0, -5), (10, 0, 5), (0, 0, 5), (5, 0, -5), (5, 5, -5), (5, 5, 5), (5, 0, 5)]
+FACES = [(0, 1, 2), (0, 2, 3), (4, 5, 6), (4, 6, 7)]
+
+
+def scene():
+    properties = rt.Properties(Vector(0.8, 0.7, 0.6))
+    mesh = Mesh(VERTICES, FACES, properties)
+    corners = [Vector(*vertex) for vertex in VERTICES]
+    triangles = [rt.Triangle(corners[a], corners[b], corners[c], properties) for a, b, c in FACES]
+    light = rt.Light(Vector(0, 3, 0), Vector(1, 1, 1), distance_coef=20000)
+    return mesh, triangles, light
+
+
+def floor_light(x, objects, light):
+    hit = rt.test_ray(rt.Ray(Vector(x, 10, 0), Vector(0, -1, 0)), objects)
+    assert abs(hit.d - 10) < 1e-9
+    return light.calculate_effect(hit.p, hit.n, hit.obj, objects)
+
+
+def test_opaque_mesh_shadows_itself():
+    mesh, triangles, light = scene()
+    for objects in ([mesh], triangles, rt.Scene(None, [mesh], []).compile().objects):
+        assert floor_light(8, objects, light) == Vector(0, 0, 0)
+        assert floor_light(3, objects, light) != Vector(0, 0, 0)
+
+
+def test_mesh_renders_like_its_triangles():
+    mesh, triangles, light = scene()
+    camera = rt.Camera(Vector(-6, 8, 0), Vector(1, -0.6, 0), 20, 20, 20, 1)
+    floor = rt.Plane(Vector(0, -1, 0), Vector(0, 1, 0), rt.Properties(Vector(0.3, 0.3, 0.3)))
+    expected = rt.render_image(camera, triangles + [floor], [light], 3, 0).tobytes()
+    image = rt.render_image(camera, [mesh, floor], [light], 3, 0).tobytes()
+    assert max(abs(a - b) for a, b in zip(expected, image)) <= 1
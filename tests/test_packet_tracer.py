@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pytest
+
+import main
+import ray_tracer as rt
+
+# the backends differ only in float rounding: the linear colors by a hair, the encoded pixels by a level at most
+HDR_TOLERANCE = 1e-6
+PIXEL_TOLERANCE = 1
+
+MODEL_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'model.txt')
+
+
+@pytest.fixture
+def room():
+    # the scene of main.py at 20x20 pixels, with its model of refractive triangles
+    return main.build_scene(0.4, MODEL_FILE)
+
+
+def assert_backends_match(camera, objects, lights, depth, sampler=None):
+    scalar = rt.render_image(camera, objects, lights, depth, 0, hdr=True, sampler=sampler)
+    packet = rt.render_image(camera, objects, lights, depth, 0, backend='numpy', hdr=True, sampler=sampler)
+    assert np.abs(packet - scalar).max() <= HDR_TOLERANCE
+
+    scalar = np.asarray(rt.render_image(camera, objects, lights, depth, 0, sampler=sampler), dtype=int)
+    packet = np.asarray(rt.render_image(camera, objects, lights, depth, 0, backend='numpy', sampler=sampler), dtype=int)
+    assert np.abs(packet - scalar).max() <= PIXEL_TOLERANCE
+
+
+def test_numpy_matches_scalar_on_the_room(room):
+    assert_backends_match(*room, 3)
+
+
+def test_numpy_matches_scalar_on_squared_planes(scene):
+    assert_backends_match(*scene, 4)
+
+
+@pytest.mark.parametrize('pixel_filter', [rt.BOX, rt.TENT, rt.GAUSSIAN])
+def test_numpy_matches_scalar_when_sampled(room, scene, pixel_filter):
+    sampler = rt.Sampler(4, pixel_filter)
+    assert_backends_match(*room, 3, sampler=sampler)
+    assert_backends_match(*scene, 4, sampler=sampler)
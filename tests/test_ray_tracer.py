@@ -0,0 +1,114 @@
+from random import Random
+
+import pytest
+
+import ray_tracer as rt
+from vector import Vector
+
+
+def test_triangle_hits_from_both_sides():
+    t = rt.Triangle(Vector(0, 0, 0), Vector(0, 3, 0), Vector(0, 0, 5), rt.Properties(Vector(1, 1, 1)))
+    assert t.is_point_inside(Vector(0, 1, 1))
+    hit = t.intersect(rt.Ray(Vector(-1, 1, 1), Vector(1, 0, 0)))
+    assert hit.d == pytest.approx(1)
+    assert (hit.n.x, hit.n.y, hit.n.z) == pytest.approx((-1, 0, 0))
+    assert hit.uv == pytest.approx((1 / 3, 1 / 5))
+    hit = t.intersect(rt.Ray(Vector(1, 1, 1), Vector(-1, 0, 0)))
+    assert hit.d == pytest.approx(1)
+    assert (hit.n.x, hit.n.y, hit.n.z) == pytest.approx((1, 0, 0))
+    # (0, 3, 5) lies past the long edge
+    assert t.intersect(rt.Ray(Vector(-1, 3, 5), Vector(1, 0, 0))).d == -1
+
+
+def test_pixel_order_does_not_change_colors(scene):
+    camera, objects, lights = scene
+    pixels = [(y, x) for y in range(camera.res_y) for x in range(camera.res_x)]
+    reference = [rt.get_color(rt.trace(camera.get_ray(y, x), objects, lights, 4)) for y, x in pixels]
+    shuffled = list(range(len(pixels)))
+    Random(1).shuffle(shuffled)
+    for order in (shuffled, list(reversed(shuffled))):
+        colors = {i: rt.get_color(rt.trace(camera.get_ray(*pixels[i]), objects, lights, 4)) for i in order}
+        assert [colors[i] for i in range(len(pixels))] == reference
+
+
+def test_thread_pool_matches_serial_render(scene):
+    camera, objects, lights = scene
+    image = rt.render_image(camera, objects, lights, 4, 0)
+    threaded = rt.render_image(camera, objects, lights, 4, 0, threads=4, tile_order='hilbert')
+    assert threaded.tobytes() == image.tobytes()
+
+
+@pytest.mark.parametrize('backend', ['scalar', 'numpy'])
+def test_squared_only_textures_planes(scene, backend):
+    camera, objects, lights = scene
+
+    def render(material_type):
+        # every object of the scene with its own material set to material_type
+        retyped = []
+        for obj in objects:
+            properties = obj.properties.cp()
+            properties.type = material_type
+            properties.scale = 0.2
+            if isinstance(obj, rt.Sphere):
+                retyped.append(rt.Sphere(obj.c, obj.r, properties))
+            elif isinstance(obj, rt.Plane):
+                retyped.append(rt.Plane(obj.p, obj.n, properties))
+            else:
+                retyped.append(rt.Triangle(obj.p1, obj.p2, obj.p3, properties))
+        return rt.render_image(camera, retyped, lights, 4, 0, backend=backend).tobytes()
+
+    assert render(rt.SQUARED) != render(rt.FILL)
+    objects[:] = [obj for obj in objects if not isinstance(obj, rt.Plane)]
+    assert render(rt.SQUARED) == render(rt.FILL)
+
+
+def blockers():
+    # along the x axis: a glass sphere at 5, an opaque one at 10 and an opaque triangle at 15
+    P = rt.Properties
+    glass = rt.Sphere(Vector(5, 0, 0), 1, P(Vector(1, 1, 1), refractive=0.8, refractive_coef=1.5))
+    sphere = rt.Sphere(Vector(10, 0, 0), 1, P(Vector(1, 0, 0)))
+    triangle = rt.Triangle(Vector(15, -1, -1), Vector(15, 2, -1), Vector(15, -1, 2), P(Vector(0, 1, 0)))
+    return glass, sphere, triangle
+
+
+@pytest.mark.parametrize('container', ['list', 'compiled', 'bvh'])
+def test_occluded_limits(container):
+    import bvh
+    import compiled
+
+    glass, sphere, triangle = blockers()
+    objects = [glass, sphere, triangle]
+    objects = {'list': objects, 'compiled': compiled.compile_objects(objects), 'bvh': bvh.BVH(objects)}[container]
+    ray = rt.Ray(Vector(0, 0, 0), Vector(1, 0, 0))
+
+    assert rt.occluded(ray, objects) is sphere
+    # the glass sphere blocks only when refractive blockers are asked for
+    assert rt.occluded(ray, objects, skip_refractive=False) is not None
+    assert rt.occluded(ray, objects, 8, skip_refractive=False) is glass
+    # blockers at or past max_distance do not count
+    assert rt.occluded(ray, objects, 8) is None
+    assert rt.occluded(ray, objects, 9.5) is sphere
+    assert rt.occluded(ray, objects, 9) is None
+    assert rt.occluded(ray, objects, 3, skip_refractive=False) is None
+    # ignored objects are seen through
+    assert rt.occluded(ray, objects, None, (sphere,)) is triangle
+    assert rt.occluded(ray, objects, 14, (sphere,)) is None
+    assert rt.occluded(ray, objects, None, (sphere, triangle)) is None
+    assert rt.occluded(ray, objects, None, (glass, sphere), False) is triangle
+
+
+def test_shadow_rays_stop_at_point_lights():
+    glass, sphere, triangle = blockers()
+    objects = [glass, sphere, triangle]
+    floor = rt.Plane(Vector(0, 0, 0), Vector(-1, 0, 0), rt.Properties(Vector(1, 1, 1)))
+    point = Vector(0, 0, 0)
+    normal = Vector(1, 0, 0)
+    white = Vector(1, 1, 1)
+    # glass lets point light through, the opaque sphere past the light does not matter
+    assert rt.Light(Vector(8, 0, 0), white).calculate_effect(point, normal, floor, objects).len() > 0
+    assert rt.Light(Vector(12, 0, 0), white).calculate_effect(point, normal, floor, objects).len() == 0
+    # distant light comes from beyond everything and is blocked by the glass too
+    distant = rt.Light(Vector(-1, 0, 0), white, type=rt.DISTANT)
+    assert distant.calculate_effect(point, normal, floor, objects).len() == 0
+    assert distant.calculate_effect(point, normal, floor, [triangle]).len() == 0
+    assert distant.calculate_effect(Vector(0, 5, 0), normal, floor, objects).len() > 0
@@ -0,0 +1,36 @@
+import pytest
+
+import ray_tracer as rt
+from instancing import Instance, Transform
+from render_cache import RenderCache
+from vector import Vector
+
+
+@pytest.fixture
+def boxed(scene):
+    # the shared room with an instance of two triangles and a reflective sphere added
+    camera, objects, lights = scene
+    P = rt.Properties
+    box = Instance([rt.Triangle(Vector(0, -2, -2), Vector(0, 2, -2), Vector(0, -2, 2), P(Vector(1, 0.5, 0.5))),
+                    rt.Triangle(Vector(0, 2, 2), Vector(0, 2, -2), Vector(0, -2, 2), P(Vector(0.5, 1, 0.5))),
+                    rt.Sphere(Vector(-2, 0, 0), 1.5, P(Vector(0.9, 0.6, 0.1), reflective=0.5))],
+                   Transform(Vector(30, 2, 8), 1.5, (0, 0.4, 0)))
+    return camera, objects + [box], lights, box
+
+
+def test_cached_render_matches_render_image(boxed):
+    camera, objects, lights, _ = boxed
+    cached = RenderCache(camera, objects, lights, 3).render()
+    assert cached.tobytes() == rt.render_image(camera, objects, lights, 3, 0).tobytes()
+
+
+def test_moved_instance_matches_fresh_render(boxed):
+    camera, objects, lights, box = boxed
+    cache = RenderCache(camera, objects, lights, 3)
+    before = cache.render().tobytes()
+    box.move(center=Vector(26, 1, -4), rotation=(0, 1.2, 0.1))
+    after = cache.update([box], geometry=True).tobytes()
+    fresh = RenderCache(camera, objects, lights, 3).render().tobytes()
+    assert after != before
+    assert after == fresh
+    assert cache.retraced < camera.res_x * camera.res_y
@@ -0,0 +1,69 @@
+import json
+import os
+
+import pytest
+
+import bvh
+import ray_tracer as rt
+import scene_file
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def room(tmp_path):
+    # scenes/room.json, small, with the model file found from anywhere
+    with open(os.path.join(ROOT, 'scenes', 'room.json')) as fin:
+        description = json.load(fin)
+    description['camera']['resolution'] = 0.5
+    for spec in description['objects']:
+        if 'file' in spec:
+            spec['file'] = os.path.join(ROOT, 'scenes', spec['file'])
+    path = str(tmp_path / 'room.json')
+    with open(path, 'w') as fout:
+        json.dump(description, fout)
+    return path, description
+
+
+def render(path):
+    scene, settings = scene_file.load_scene(path)
+    return rt.render_image(scene=scene, depth=settings['depth'], verbose=0).tobytes()
+
+
+def test_second_load_restores_the_bvh_from_the_bundle(room, monkeypatch):
+    path, _ = room
+    first = render(path)
+
+    def build(items):
+        raise AssertionError('the tree was built again')
+    monkeypatch.setattr(bvh, 'build', build)
+    scene, _ = scene_file.load_scene(path)
+    assert isinstance(scene.objects, bvh.BVH)
+    assert render(path) == first
+
+
+def test_bundle_holds_only_arrays(room):
+    path, _ = room
+    render(path)
+    cache_dir = path + scene_file.CACHE_SUFFIX
+    with open(os.path.join(cache_dir, scene_file.LATEST_FILE)) as fin:
+        bundle = os.path.join(cache_dir, fin.read())
+    assert {os.path.splitext(name)[1] for name in os.listdir(bundle)} == {'.npy', '.json'}
+
+
+def test_changed_scene_removes_only_its_stale_bundle(room):
+    path, description = room
+    render(path)
+    cache_dir = path + scene_file.CACHE_SUFFIX
+    stale, = set(os.listdir(cache_dir)) - {scene_file.LATEST_FILE}
+    # a bundle some other version of the scene uses
+    os.makedirs(os.path.join(cache_dir, 'other'))
+
+    description['render']['depth'] = 2
+    with open(path, 'w') as fout:
+        json.dump(description, fout)
+    render(path)
+    kept = set(os.listdir(cache_dir))
+    assert stale not in kept
+    assert 'other' in kept
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import ray_tracer as rt
+import streaming
+
+
+@pytest.mark.parametrize('extension', ['png', 'tif'])
+@pytest.mark.parametrize('processes', [None, 2])
+def test_streamed_file_decodes_to_render_image(scene, tmp_path, extension, processes):
+    camera, objects, lights = scene
+    expected = np.asarray(rt.render_image(camera, objects, lights, 4, 0))
+    path = str(tmp_path / ('render.' + extension))
+    # strips that do not divide the height, so the last one is short
+    writer = streaming.open_writer(path, camera.res_x, camera.res_y)
+    streaming.render_strips(camera, objects, lights, writer, 4, strip_height=7, processes=processes)
+    with Image.open(path) as image:
+        assert (np.asarray(image.convert('RGB')) == expected).all()
+
+
+@pytest.mark.parametrize('backend', ['scalar', 'numpy'])
+def test_streamed_samples_match_render_image(scene, tmp_path, backend):
+    camera, objects, lights = scene
+    sampler = rt.Sampler(4, rt.TENT)
+    expected = np.asarray(rt.render_image(camera, objects, lights, 3, 0, backend=backend, sampler=sampler))
+    path = str(tmp_path / 'render.png')
+    writer = streaming.open_writer(path, camera.res_x, camera.res_y)
+    streaming.render_strips(camera, objects, lights, writer, 3, strip_height=6, backend=backend, sampler=sampler)
+    with Image.open(path) as image:
+        assert (np.asarray(image.convert('RGB')) == expected).all()
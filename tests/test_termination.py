@@ -0,0 +1,36 @@
+import numpy as np
+
+import ray_tracer as rt
+
+DEPTH = 6
+# roulette from the first bounce on for every branch lighter than 0.9, so most pixels are affected
+ROULETTE = dict(min_weight=0, roulette_depth=1, roulette_weight=0.9)
+
+
+def render(scene, termination):
+    camera, objects, lights = scene
+    return rt.render_image(camera, objects, lights, DEPTH, 0, hdr=True, termination=termination)
+
+
+def test_roulette_is_deterministic_for_a_seed(scene):
+    first = render(scene, rt.Termination(seed=3, **ROULETTE))
+    assert (render(scene, rt.Termination(seed=3, **ROULETTE)) == first).all()
+    assert (render(scene, rt.Termination(seed=4, **ROULETTE)) != first).any()
+    # pixels are seeded by their index, not by the order they are traced in
+    camera, objects, lights = scene
+    serial = rt.render_image(camera, objects, lights, DEPTH, 0, termination=rt.Termination(seed=3, **ROULETTE))
+    threaded = rt.render_image(camera, objects, lights, DEPTH, 0, termination=rt.Termination(seed=3, **ROULETTE),
+                               threads=3, tile_order='hilbert')
+    assert threaded.tobytes() == serial.tobytes()
+
+
+def test_roulette_mean_converges_to_full_depth(scene):
+    camera, objects, lights = scene
+    full = rt.render_image(camera, objects, lights, DEPTH, 0, hdr=True)
+    renders = [render(scene, rt.Termination(seed=seed, **ROULETTE)) for seed in range(32)]
+    single = np.abs(renders[0] - full).mean()
+    mean = np.mean(renders, axis=0)
+    # unbiased: the average error shrinks with the number of renders and the overall brightness is kept
+    assert np.abs(mean - full).mean() < single / 3
+    assert abs(mean.mean() - full.mean()) < 0.01 * full.mean()
+
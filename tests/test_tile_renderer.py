@@ -0,0 +1,24 @@
+import pytest
+
+import ray_tracer as rt
+import tile_renderer
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+@pytest.mark.parametrize('order', [tile_renderer.ROWS, tile_renderer.CENTER_OUT, tile_renderer.HILBERT])
+def test_tiles_match_render_image(scene, processes, order):
+    camera, objects, lights = scene
+    expected = rt.render_image(camera, objects, lights, 4, 0).tobytes()
+    # tiles smaller than the image, so the order and the split between processes both matter
+    tiles = tile_renderer.render_tiles(camera, objects, lights, 4, processes, tile_size=8, order=order)
+    assert bytes(tiles) == expected
+    image = rt.render_image(camera, objects, lights, 4, 0, processes=processes, tile_order=order)
+    assert image.tobytes() == expected
+
+
+def test_tiles_cover_the_image_once():
+    for order in (tile_renderer.ROWS, tile_renderer.CENTER_OUT, tile_renderer.HILBERT):
+        covered = []
+        for x0, y0, x1, y1 in tile_renderer.make_tiles(45, 30, 8, order):
+            covered += [(x, y) for y in range(y0, y1) for x in range(x0, x1)]
+        assert sorted(covered) == [(x, y) for x in range(45) for y in range(30)]
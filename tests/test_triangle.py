@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+import ray_tracer
+from bench.bench_triangle import AreaSumTriangle, MODELS
+from main import build_scene
+
+# share of pixels that may differ from the reference: edge rays that the area sum's EPS or the numpy
+# backend's arithmetic decide the other way
+MAX_DIFFERING = 0.001
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def differing_pixels(image, other):
+    image = image.tobytes()
+    other = other.tobytes()
+    return sum(image[i:i + 3] != other[i:i + 3] for i in range(0, len(image), 3))
+
+
+@pytest.mark.parametrize('model_file', MODELS)
+def test_kernels_render_the_same_room(model_file):
+    path = os.path.join(ROOT, model_file)
+    camera, objects, lights = build_scene(1, path)
+    reference = ray_tracer.render_image(camera, objects, lights, 5, 0)
+    allowed = MAX_DIFFERING * camera.res_x * camera.res_y
+
+    area_sum = [AreaSumTriangle(obj.p1, obj.p2, obj.p3, obj.properties) if isinstance(obj, ray_tracer.Triangle)
+                else obj for obj in objects]
+    assert differing_pixels(reference, ray_tracer.render_image(camera, area_sum, lights, 5, 0)) <= allowed
+    packet = ray_tracer.render_image(camera, objects, lights, 5, 0, backend='numpy')
+    assert differing_pixels(reference, packet) <= allowed
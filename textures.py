@@ -0,0 +1,197 @@
+import os
+from math import floor, sin
+from random import Random
+
+import numpy as np
+
+from vector import Vector
+from ray_tracer import sign, g
+
+
+# the angle one pixel covers, camera.w / camera.res_x / camera.dist, for the default room camera
+PIXEL_ANGLE = 0.0004
+NOISE_TABLE_SIZE = 256
+
+# mip pyramids by file, shared by every texture that uses the image
+_images = {}
+
+
+class Texture:
+    # maps the base color of an object and a hit point to the color there; color takes one point as
+    # Vectors, colors (n, 3) arrays of base colors and points and an array of hit distances
+    def color(self, color, point, distance=0):
+        colors = self.colors(np.array([[color.x, color.y, color.z]]), np.array([[point.x, point.y, point.z]]),
+                             np.array([distance], dtype=np.float64))
+        return Vector(*colors[0].tolist())
+
+    def colors(self, colors, points, distances):
+        raise NotImplementedError
+
+
+class Squared(Texture):
+    # the SQUARED material: the sign of the g pattern over a grid of scale sized cells, which
+    # blacks out every other cell of planes
+    def __init__(self, scale=1):
+        self.scale = scale
+
+    def color(self, color, point, distance=0):
+        x = sign(sin(point.x / self.scale))
+        y = sign(sin(point.y / self.scale))
+        z = sign(sin(point.z / self.scale))
+        return color * sign(g(x, y, z))
+
+    def colors(self, colors, points, distances):
+        xyz = np.where(np.sin(points / self.scale) >= 0, 1.0, -1.0)
+        return colors * np.where(np.prod(np.sin(xyz), axis=1) >= 0, 1.0, -1.0)[:, None]
+
+
+class Checker(Texture):
+    # a 3D checkerboard of scale sized cubes in the base color and other
+    def __init__(self, scale=1, other=Vector(0, 0, 0)):
+        self.scale = scale
+        self.other = other
+
+    def color(self, color, point, distance=0):
+        cell = floor(point.x / self.scale) + floor(point.y / self.scale) + floor(point.z / self.scale)
+        return self.other if cell % 2 else color
+
+    def colors(self, colors, points, distances):
+        odd = np.floor(points / self.scale).sum(axis=1) % 2 == 1
+        return np.where(odd[:, None], [self.other.x, self.other.y, self.other.z], colors)
+
+
+class Pattern(Texture):
+    # the base color scaled by function(x, y, z) of the point in scale units; function has to take
+    # arrays as well as floats, e.g. lambda x, y, z: abs(np.sin(x) * np.sin(y) * np.sin(z)) for g
+    def __init__(self, function, scale=1):
+        self.function = function
+        self.scale = scale
+
+    def color(self, color, point, distance=0):
+        return color * float(self.function(point.x / self.scale, point.y / self.scale, point.z / self.scale))
+
+    def colors(self, colors, points, distances):
+        p = points / self.scale
+        return colors * np.asarray(self.function(p[:, 0], p[:, 1], p[:, 2]), dtype=np.float64)[:, None]
+
+
+class Noise(Texture):
+    # fractal value noise blending the base color into other, octaves halving in size and weight
+    def __init__(self, scale=1, other=Vector(0, 0, 0), octaves=4, seed=0):
+        self.scale = scale
+        self.other = other
+        self.octaves = octaves
+        table = list(range(NOISE_TABLE_SIZE))
+        Random(seed).shuffle(table)
+        self.table = table
+        self.table_array = np.array(table)
+
+    def amount(self, x, y, z, table, floor):
+        total = 0
+        weight = 1
+        weights = 0
+        for _ in range(self.octaves):
+            total = total + value_noise(x, y, z, table, floor) * weight
+            weights += weight
+            x, y, z = x * 2, y * 2, z * 2
+            weight /= 2
+        return total / weights
+
+    def color(self, color, point, distance=0):
+        t = self.amount(point.x / self.scale, point.y / self.scale, point.z / self.scale, self.table, floor)
+        return color + (self.other - color) * t
+
+    def colors(self, colors, points, distances):
+        p = points / self.scale
+        t = self.amount(p[:, 0], p[:, 1], p[:, 2], self.table_array, floor_array)
+        return colors + ([self.other.x, self.other.y, self.other.z] - colors) * t[:, None]
+
+
+def floor_array(a):
+    return np.floor(a).astype(np.int64)
+
+
+def value_noise(x, y, z, table, floor):
+    # smoothly interpolated random values on the integer lattice, the same code for floats and arrays
+    xi, yi, zi = floor(x), floor(y), floor(z)
+    fx, fy, fz = x - xi, y - yi, z - zi
+    sx, sy, sz = fx * fx * (3 - 2 * fx), fy * fy * (3 - 2 * fy), fz * fz * (3 - 2 * fz)
+    mask = NOISE_TABLE_SIZE - 1
+
+    def corner(i, j, k):
+        return table[(table[(table[(xi + i) & mask] + yi + j) & mask] + zi + k) & mask] / mask
+
+    def lerp(a, b, t):
+        return a + (b - a) * t
+
+    x00 = lerp(corner(0, 0, 0), corner(1, 0, 0), sx)
+    x10 = lerp(corner(0, 1, 0), corner(1, 1, 0), sx)
+    x01 = lerp(corner(0, 0, 1), corner(1, 0, 1), sx)
+    x11 = lerp(corner(0, 1, 1), corner(1, 1, 1), sx)
+    return lerp(lerp(x00, x10, sy), lerp(x01, x11, sy), sz)
+
+
+def load_mipmaps(path):
+    # the image and its halvings down to 1x1 as float rgb arrays, read once per file and modification
+    path = os.path.abspath(path)
+    key = path, os.stat(path).st_mtime_ns
+    levels = _images.get(key)
+    if levels is None:
+        from PIL import Image
+
+        image = Image.open(path).convert('RGB')
+        levels = [np.asarray(image, dtype=np.float64) / 255]
+        while image.size != (1, 1):
+            image = image.resize((max(image.size[0] // 2, 1), max(image.size[1] // 2, 1)), Image.BOX)
+            levels.append(np.asarray(image, dtype=np.float64) / 255)
+        _images[key] = levels
+    return levels
+
+
+class ImageTexture(Texture):
+    # an image tiled over the plane through origin spanned by u_axis and v_axis, size units per repeat;
+    # the mip level follows the area one pixel covers at the hit distance, pixel_angle being the
+    # camera's w / res_x / dist
+    def __init__(self, path, size=1, origin=Vector(0, 0, 0), u_axis=Vector(1, 0, 0), v_axis=Vector(0, 0, 1),
+                 pixel_angle=PIXEL_ANGLE):
+        self.path = path
+        self.size = size
+        self.origin = origin
+        self.u_axis = u_axis
+        self.v_axis = v_axis
+        self.pixel_angle = pixel_angle
+        self.levels = load_mipmaps(path)
+
+    def __getstate__(self):
+        # workers load the image from the file instead of getting the pyramid pickled
+        state = dict(self.__dict__)
+        del state['levels']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.levels = load_mipmaps(self.path)
+
+    def colors(self, colors, points, distances):
+        relative = points - [self.origin.x, self.origin.y, self.origin.z]
+        u = relative @ [self.u_axis.x, self.u_axis.y, self.u_axis.z] / self.size
+        v = relative @ [self.v_axis.x, self.v_axis.y, self.v_axis.z] / self.size
+        texels = distances * self.pixel_angle * self.levels[0].shape[1] / self.size
+        level = np.clip(np.log2(np.maximum(texels, 1)), 0, len(self.levels) - 1)
+        lower = np.floor(level).astype(np.int64)
+        t = (level - lower)[:, None]
+        result = np.empty_like(colors)
+        for index in np.unique(lower):
+            mask = lower == index
+            upper = min(index + 1, len(self.levels) - 1)
+            near = self.texel(index, u[mask], v[mask])
+            far = self.texel(upper, u[mask], v[mask])
+            result[mask] = near + (far - near) * t[mask]
+        return result
+
+    def texel(self, level, u, v):
+        image = self.levels[level]
+        height, width = image.shape[:2]
+        column = (np.floor(u * width).astype(np.int64)) % width
+        row = (np.floor(v * height).astype(np.int64)) % height
+        return image[row, column]
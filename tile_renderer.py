@@ -0,0 +1,156 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import RawArray
+
+from array import array
+
+from ray_tracer import trace, sample_pixel, encode_colors
+
+
+TILE_SIZE = 32
+ROWS = 'rows'
+CENTER_OUT = 'center'
+HILBERT = 'hilbert'
+
+_worker = {}
+
+
+def make_tiles(res_x, res_y, tile_size=TILE_SIZE, order=CENTER_OUT):
+    columns = (res_x + tile_size - 1) // tile_size
+    rows = (res_y + tile_size - 1) // tile_size
+    cells = [(tx, ty) for ty in range(rows) for tx in range(columns)]
+
+    if order == CENTER_OUT:
+        cx = (columns - 1) / 2
+        cy = (rows - 1) / 2
+        cells.sort(key=lambda cell: (cell[0] - cx) ** 2 + (cell[1] - cy) ** 2)
+    elif order == HILBERT:
+        side = 1
+        while side < max(columns, rows):
+            side *= 2
+        cells.sort(key=lambda cell: hilbert_index(side, cell[0], cell[1]))
+    elif order != ROWS:
+        raise ValueError('Unknown tile order: {}'.format(order))
+
+    tiles = []
+    for tx, ty in cells:
+        x0 = tx * tile_size
+        y0 = ty * tile_size
+        tiles.append((x0, y0, min(x0 + tile_size, res_x), min(y0 + tile_size, res_y)))
+    return tiles
+
+
+def hilbert_index(side, x, y):
+    d = 0
+    s = side // 2
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = side - 1 - x
+                y = side - 1 - y
+            x, y = y, x
+        s //= 2
+    return d
+
+
+def _init_worker(camera, objects, lights, depth, backend, buffer=None, termination=None, gamma=1, sampler=None):
+    # buffer is the shared image render_tile writes to, workers that only return tile_bytes go without
+    _worker['camera'] = camera
+    _worker['objects'] = objects
+    _worker['lights'] = lights
+    _worker['depth'] = depth
+    _worker['backend'] = backend
+    _worker['buffer'] = None if buffer is None else memoryview(buffer).cast('B')
+    _worker['termination'] = termination
+    _worker['gamma'] = gamma
+    _worker['sampler'] = sampler
+    _worker['scene'] = None
+    if termination is not None:
+        termination.start(depth)
+    if backend == 'numpy':
+        import packet_tracer
+        _worker['scene'] = packet_tracer.PacketScene(objects, lights)
+
+
+def render_tile(tile):
+    write_region(_worker['buffer'], _worker['camera'].res_x, tile, tile_bytes(tile))
+    return tile
+
+
+def tile_bytes(tile):
+    return region_bytes(_worker['camera'], _worker['objects'], _worker['lights'], _worker['depth'], tile,
+                        _worker['scene'], _worker['termination'], _worker['gamma'], _worker['sampler'])
+
+
+def region_bytes(camera, objects, lights, depth, tile, scene=None, termination=None, gamma=1, sampler=None):
+    # the encoded pixels of the box, row after row; scene is the PacketScene of the numpy backend
+    if scene is not None:
+        import packet_tracer
+        return packet_tracer.render_region(scene, camera, depth, tile, gamma=gamma, sampler=sampler).tobytes()
+    x0, y0, x1, y1 = tile
+    return b''.join(trace_row(camera, objects, lights, depth, termination, y, x0, x1, gamma, sampler)
+                    for y in range(y0, y1))
+
+
+def write_region(buffer, res_x, tile, data):
+    x0, y0, x1, y1 = tile
+    width = (x1 - x0) * 3
+    for y in range(y0, y1):
+        start = (y * res_x + x0) * 3
+        buffer[start:start + width] = data[(y - y0) * width:(y - y0 + 1) * width]
+
+
+def trace_row(camera, objects, lights, depth, termination, y, x0, x1, gamma=1, sampler=None):
+    # the encoded pixels x0..x1 of row y
+    row = array('d')
+    for x in range(x0, x1):
+        if termination is not None:
+            termination.pixel(y * camera.res_x + x)
+        if sampler is None:
+            color = trace(camera.get_ray(y, x), objects, lights, depth, None, termination)
+        else:
+            color = sample_pixel(camera, y, x, objects, lights, depth, sampler, None, termination)
+        row.extend((color.x, color.y, color.z))
+    return encode_colors(row, gamma).tobytes()
+
+
+def render_tiles(camera, objects, lights, depth=2, processes=None, tile_size=TILE_SIZE, order=CENTER_OUT,
+                 backend='scalar', verbose=0, termination=None, gamma=1, sampler=None):
+    processes = processes or os.cpu_count()
+    buffer = RawArray('B', camera.res_x * camera.res_y * 3)
+    tiles = make_tiles(camera.res_x, camera.res_y, tile_size, order)
+
+    with ProcessPoolExecutor(processes, initializer=_init_worker,
+                             initargs=(camera, objects, lights, depth, backend, buffer, termination, gamma,
+                                       sampler)) as pool:
+        for done, _ in enumerate(pool.map(render_tile, tiles), 1):
+            if verbose and done % max(len(tiles) // 10, 1) == 0:
+                print(done / len(tiles))
+    return memoryview(buffer).cast('B')
+
+
+def render_tiles_threaded(camera, objects, lights, depth=2, threads=None, tile_size=TILE_SIZE, order=CENTER_OUT,
+                          backend='scalar', verbose=0, termination=None, gamma=1, sampler=None):
+    # every thread shares the scene and the sampler, neither is written to; only the termination
+    # random state is per pixel and so gets a copy per tile
+    threads = threads or os.cpu_count()
+    buffer = bytearray(camera.res_x * camera.res_y * 3)
+    tiles = make_tiles(camera.res_x, camera.res_y, tile_size, order)
+    scene = None
+    if backend == 'numpy':
+        import packet_tracer
+        scene = packet_tracer.PacketScene(objects, lights)
+
+    def render(tile):
+        write_region(buffer, camera.res_x, tile, region_bytes(camera, objects, lights, depth, tile, scene,
+                                                              termination and termination.copy(), gamma, sampler))
+        return tile
+
+    with ThreadPoolExecutor(threads) as pool:
+        for done, _ in enumerate(pool.map(render, tiles), 1):
+            if verbose and done % max(len(tiles) // 10, 1) == 0:
+                print(done / len(tiles))
+    return buffer
@@ -1,79 +1,198 @@
+import argparse
+
 import pygame
-from time import sleep
-from math import pi
+import pygame.surfarray
+from math import pi, sqrt
+from multiprocessing import Pipe, Process
+from time import perf_counter
+
+import numpy as np
 
-from vector import *
+from vector import Vector, roty
 import ray_tracer as RT
 
 
-def main():
-    width = 20
-    height = width
-    res_coef = 1
-    min_frame_width = 500
-    min_frame_height = 500    
+FRAME_TIME = 1 / 30
+MOTION_DEPTH = 1
+DEPTH = 2
+MIN_SCALE = 0.1
+# input has to stay quiet this long before the picture is refined
+IDLE_TIME = 0.15
+# refinement passes after the motion frames, as fractions of the full resolution
+REFINE_SCALES = (0.5, 1)
+SPEED = 15
+TURN_SPEED = pi / 3
 
-    pygame.init()
-    pygame.display.set_caption("AACERRRTY")
-    screen = pygame.display.set_mode((min_frame_width, min_frame_height))
-    pygame.display.flip()    
-    
-    distance = width * 2
-    head = Vector(0, 1, 0)
-    direction = Vector(1, 0, 0)
-    
-    
-    # magic constants
+
+def build_scene(width=20, res_coef=1):
     a = 10
     r = a / 3
-    # magic constants end
-    
-    camera = RT.Camera(head, direction, distance, width, height, res_coef)
-    objects = []
-    objects.append(RT.Sphere(Vector(2 * a, 0, 0), r, Vector(0.7, 1, 0.7), 0, 0))
-    objects.append(RT.Sphere(Vector(2 * a, a / 1.3, 0), r, Vector(0.5, 0.2, 0.4), 0, 0))
-    objects.append(RT.Sphere(Vector(a, 0, -2 * a), r, Vector(0.9, 0.6, 0.1), 0, 0))
-    objects.append(RT.Sphere(Vector(a, 0, 2 * a), r, Vector(0.1, 0.3, 0.9), 0, 0))
-    objects.append(RT.Plane(Vector(0, 0, 0), Vector(0, 1, 0), Vector(0.8, 0.8, 0.8), 0, type=RT.SQUARED, scale=0.2))
-    lights = []
-    lights.append(RT.Light(Vector(0, 100, 100), Vector(1, 1, 1), distance_coef=sqrt(2) * 200000))
-    scene = RT.Scene(camera, objects, lights)
-    
-    keys = set()
+    distance = width * 2
+    camera = RT.Camera(Vector(0, 1, 0), Vector(1, 0, 0), distance, width, width, res_coef)
+    camera.update()
+
+    P = RT.Properties
+    objects = [
+        RT.Sphere(Vector(2 * a, 0, 0), r, P(Vector(0.7, 1, 0.7))),
+        RT.Sphere(Vector(2 * a, a / 1.3, 0), r, P(Vector(0.5, 0.2, 0.4))),
+        RT.Sphere(Vector(a, 0, -2 * a), r, P(Vector(0.9, 0.6, 0.1), 0.5)),
+        RT.Sphere(Vector(a, 0, 2 * a), r, P(Vector(0.1, 0.3, 0.9))),
+        RT.Plane(Vector(0, 0, 0), Vector(0, 1, 0), P(Vector(0.8, 0.8, 0.8), type=RT.SQUARED, scale=0.2)),
+    ]
+    lights = [RT.Light(Vector(0, 100, 100), Vector(1, 1, 1), distance_coef=sqrt(2) * 200000)]
+    return camera, objects, lights
+
+
+def scaled_camera(camera, scale):
+    # the same view at a fraction of the resolution, at least 1x1
+    res_coef = max(camera.res_x * scale, 1) / camera.w
+    scaled = RT.Camera(camera.o, camera.d, camera.dist, camera.w, camera.h, res_coef)
+    scaled.update()
+    return scaled
+
+
+def render_worker(connection, objects, lights, backend):
+    if backend == 'numpy':
+        import packet_tracer
+        scene = packet_tracer.PacketScene(objects, lights)
+
     while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: 
-                pygame.quit() 
-                exit()
-            if event.type == pygame.KEYDOWN:
-                keys.add(chr(event.key))
-            if event.type == pygame.KEYUP:
-                keys.remove(chr(event.key))
-
-        for k in keys:
-            if k == 'w':
-                scene.camera.o += camera.d
-            elif k == 'a':
-                camera.d = roty(camera.d, pi/100)
-                print(camera.d)
-            elif k == 's':
-                scene.camera.o -= camera.d
-            elif k == 'd':
-                camera.d = roty(camera.d, -pi/100)
-            elif k == 'q':
-                camera.d = roty(camera.d, pi/30) 
-            elif k == 'e':
-                camera.d = roty(camera.d, -pi/30)                 
-        scene.camera.update()
-
-        frame = RT.render_image(scene=scene, verbose=0, pygame_mode=True)
-        frame = pygame.transform.scale(frame, (min_frame_width, min_frame_height), screen)
-        #frame.save('screen.png')
-        #screen.blit(frame, (0, 0))
-        
-        pygame.display.flip() 
-        #sleep(1/30)
+        request = connection.recv()
+        # only the newest view matters, anything queued behind it is stale
+        while request is not None and connection.poll():
+            request = connection.recv()
+        if request is None:
+            return
+
+        generation, motion, passes = request
+        for camera, depth in passes:
+            if connection.poll():
+                break
+            start = perf_counter()
+            if backend == 'numpy':
+                pixels = packet_tracer.render_region(scene, camera, depth)
+            else:
+                pixels = np.asarray(RT.render_image(camera, objects, lights, depth, 0))
+            connection.send((generation, motion, pixels, perf_counter() - start))
+
+
+class Viewer:
+    def __init__(self, camera, objects, lights, screen_size=(500, 500), backend='numpy', frame_time=FRAME_TIME,
+                 depth=DEPTH):
+        self.camera = camera
+        self.depth = depth
+        self.screen_size = screen_size
+        self.frame_time = frame_time
+        self.scale = 0.25
+        self.generation = 0
+        self.shown = -1
+        self.last_input = 0
+        self.refining = False
+        self.surfaces = {}
+
+        self.connection, worker_connection = Pipe()
+        self.worker = Process(target=render_worker, args=(worker_connection, objects, lights, backend), daemon=True)
+        self.worker.start()
+
+    def close(self):
+        self.connection.send(None)
+        self.worker.join()
+
+    def request(self, motion, passes):
+        self.generation += 1
+        self.refining = not motion
+        self.connection.send((self.generation, motion, passes))
+
+    def request_motion(self):
+        self.request(True, [(scaled_camera(self.camera, self.scale), MOTION_DEPTH)])
+
+    def request_refinement(self):
+        passes = [(scaled_camera(self.camera, scale), self.depth) for scale in REFINE_SCALES if scale > self.scale]
+        self.request(False, passes or [(self.camera, self.depth)])
+
+    def move(self, keys, dt):
+        camera = self.camera
+        moved = True
+        if keys[pygame.K_w]:
+            camera.o = camera.o + camera.d * SPEED * dt
+        elif keys[pygame.K_s]:
+            camera.o = camera.o - camera.d * SPEED * dt
+        elif keys[pygame.K_a] or keys[pygame.K_q]:
+            camera.d = roty(camera.d, TURN_SPEED * dt * (3 if keys[pygame.K_q] else 1))
+        elif keys[pygame.K_d] or keys[pygame.K_e]:
+            camera.d = roty(camera.d, -TURN_SPEED * dt * (3 if keys[pygame.K_e] else 1))
+        else:
+            moved = False
+        if moved:
+            camera.update()
+        return moved
+
+    def receive(self):
+        # returns the newest finished frame, if any arrived
+        latest = None
+        while self.connection.poll():
+            generation, motion, pixels, elapsed = self.connection.recv()
+            # while moving the worker always lags a request or two behind, older views than
+            # the one on screen are dropped
+            if generation < self.shown:
+                continue
+            self.shown = generation
+            latest = pixels
+            if motion:
+                # keep motion frames inside the budget, the pixel count follows the square of the scale
+                ratio = sqrt(self.frame_time / max(elapsed, 1e-6))
+                self.scale = min(max(self.scale * min(max(ratio, 0.5), 1.5), MIN_SCALE), 1)
+        return latest
+
+    def draw(self, screen, pixels):
+        size = pixels.shape[1], pixels.shape[0]
+        surface = self.surfaces.get(size)
+        if surface is None:
+            surface = self.surfaces[size] = pygame.Surface(size)
+        pygame.surfarray.blit_array(surface, pixels.transpose(1, 0, 2))
+        pygame.transform.scale(surface, self.screen_size, screen)
+
+    def tick(self, screen, keys, dt, now):
+        if self.move(keys, dt):
+            self.last_input = now
+            self.request_motion()
+        elif not self.refining and now - self.last_input > IDLE_TIME:
+            self.request_refinement()
+
+        pixels = self.receive()
+        if pixels is not None:
+            self.draw(screen, pixels)
+            return True
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Walk through the scene with w, a, s, d, q and e.')
+    parser.add_argument('--resolution', type=float, default=1, help='Pixels per scene unit of the full view')
+    parser.add_argument('--depth', type=int, default=DEPTH, help='Ray depth once the view holds still')
+    args = parser.parse_args()
+    screen_size = (500, 500)
+
+    pygame.init()
+    pygame.display.set_caption("AACERRRTY")
+    screen = pygame.display.set_mode(screen_size)
+
+    camera, objects, lights = build_scene(res_coef=args.resolution)
+    viewer = Viewer(camera, objects, lights, screen_size, depth=args.depth)
+    viewer.request_motion()
+    clock = pygame.time.Clock()
+    try:
+        while True:
+            dt = clock.tick(120) / 1000
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    return
+            if viewer.tick(screen, pygame.key.get_pressed(), dt, perf_counter()):
+                pygame.display.flip()
+    finally:
+        viewer.close()
+        pygame.quit()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -2,6 +2,8 @@ from math import sqrt, sin, cos
 
 
 class Vector:
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
@@ -25,6 +27,65 @@ class Vector:
         else:
             return Vector(self.x / length, self.y / length, self.z / length)
 
+    def inormal(self):
+        length = self.len()
+        if length != 0:
+            self.x /= length
+            self.y /= length
+            self.z /= length
+        return self
+
+    def iadd(self, other):
+        self.x += other.x
+        self.y += other.y
+        self.z += other.z
+        return self
+
+    def isub(self, other):
+        self.x -= other.x
+        self.y -= other.y
+        self.z -= other.z
+        return self
+
+    def imul(self, other):
+        self.x *= other
+        self.y *= other
+        self.z *= other
+        return self
+
+    def imul_vector(self, other):
+        self.x *= other.x
+        self.y *= other.y
+        self.z *= other.z
+        return self
+
+    def iadd_scaled(self, other, k):
+        self.x += other.x * k
+        self.y += other.y * k
+        self.z += other.z * k
+        return self
+
+    def add_scaled(self, other, k):
+        return Vector(self.x + other.x * k, self.y + other.y * k, self.z + other.z * k)
+
+    def scaled_sum(self, k, other, m):
+        return Vector(self.x * k + other.x * m, self.y * k + other.y * m, self.z * k + other.z * m)
+
+    def sub_dot(self, other, direction):
+        return ((self.x - other.x) * direction.x +
+                (self.y - other.y) * direction.y +
+                (self.z - other.z) * direction.z)
+
+    def direction_to(self, other):
+        return Vector(other.x - self.x, other.y - self.y, other.z - self.z).inormal()
+
+    def reflect(self, normal):
+        k = 2 * self.dot(normal)
+        return Vector(self.x - normal.x * k, self.y - normal.y * k, self.z - normal.z * k)
+
+    def copy(self):
+        return Vector(self.x, self.y, self.z)
+
     def proection(self, other):
         return self.normal() * self.dot(other.normal()) * other.len()
 
@@ -38,18 +99,14 @@ class Vector:
         return Vector(self.x - other.x, self.y - other.y, self.z - other.z)
 
     def __mul__(self, other):
-        if isinstance(other, Vector):
+        if other.__class__ is Vector:
             return Vector(self.x * other.x, self.y * other.y, self.z * other.z)
-        else:
-            assert type(other) == float or type(other) == int
-            return Vector(self.x * other, self.y * other, self.z * other)
+        return Vector(self.x * other, self.y * other, self.z * other)
 
     def __truediv__(self, other):
-        if isinstance(other, Vector):
+        if other.__class__ is Vector:
             return Vector(self.x / other.x, self.y / other.y, self.z / other.z)
-        else:
-            assert type(other) == float or type(other) == int
-            return Vector(self.x / other, self.y / other, self.z / other)
+        return Vector(self.x / other, self.y / other, self.z / other)
 
     def __pow__(self, other):
         return Vector(self.x ** other, self.y ** other, self.z ** other)